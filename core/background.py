@@ -0,0 +1,66 @@
+"""
+Fire-and-forget para tareas cortas (webhooks, peticiones CAR_INFO escalonadas).
+
+Por defecto cada tarea va en su propio hilo daemon (runtime clásico de main.py).
+Con INGEST_BACKEND=asyncio, main.py llama a use_event_loop() y las tareas pasan al
+loop: las corrutinas se programan como Task y las funciones bloqueantes
+(requests.post, consultas a la BD) van a un ThreadPoolExecutor acotado en lugar de
+abrir un hilo nuevo por evento.
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+_loop = None
+_executor = None
+_tasks = set()
+
+
+def use_event_loop(loop, max_workers=16):
+    """Enruta spawn()/spawn_async() al loop dado (llamar desde el propio loop)."""
+    global _loop, _executor
+    _executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ac-bg")
+    _loop = loop
+
+
+def event_loop_active():
+    return _loop is not None
+
+
+def _start_task(coro):
+    task = _loop.create_task(coro)
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+
+
+def _report_failure(func, future):
+    # Sin esto, una excepción en el executor queda guardada en el future y nadie la ve.
+    if future.cancelled():
+        return
+    exc = future.exception()
+    if exc is not None:
+        print(f"❌ [background] {getattr(func, '__name__', func)} falló: {exc!r}")
+
+
+def _run_in_executor(func, args):
+    future = _loop.run_in_executor(_executor, func, *args)
+    future.add_done_callback(lambda f: _report_failure(func, f))
+
+
+def spawn(func, *args):
+    """Ejecuta func(*args) en segundo plano sin esperar el resultado."""
+    if _loop is None:
+        threading.Thread(target=func, args=args, daemon=True).start()
+        return
+    _loop.call_soon_threadsafe(_run_in_executor, func, args)
+
+
+def spawn_async(coro_func, *args):
+    """
+    Programa coro_func(*args) en el loop activo (seguro desde cualquier hilo).
+    Devuelve False si no hay loop, para que el llamador use su variante con hilos.
+    """
+    if _loop is None:
+        return False
+    _loop.call_soon_threadsafe(_start_task, coro_func(*args))
+    return True
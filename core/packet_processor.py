@@ -1,9 +1,13 @@
 import time
 import os
 import re
-from network.ac_packet import ACSP, PacketParser
+from uuid import uuid4
+from time import perf_counter_ns
+from network.ac_packet import ACSP, PacketParser, read_car_update, read_client_event, read_lap_completed
 from core.session_manager import DriverInfo, send_registration, send_chat, send_admin_command
-from db.database import save_driver, save_lap, get_active_server_event, get_server_mode_for_instance
+from core.session_context import refresh_session_context
+from core.background import spawn
+from db.database import record_lap_history, save_driver, save_lap, warm_personal_bests
 from network.event_dispatcher import dispatch_event, send_server_event
 
 MIN_VALID_LAP_MS = int(os.getenv("MIN_VALID_LAP_MS", "10000"))
@@ -17,30 +21,11 @@ def _mark_driver_seen(driver):
     driver.last_seen_ms = int(time.time() * 1000)
 
 
-def _resolve_server_mode(server_state):
-    folder_id = ""
-    cfg_path = getattr(server_state, "cfg_path", "") or ""
-    if cfg_path:
-        try:
-            cfg_dir = os.path.dirname(cfg_path)
-            server_dir = os.path.dirname(cfg_dir)
-            folder_id = os.path.basename(server_dir).strip()
-        except Exception:
-            folder_id = ""
-    names = [
-        folder_id,
-        (server_state.server_name or "").strip(),
-        (getattr(server_state, "config_server_name", "") or "").strip(),
-    ]
-    seen = set()
-    for n in names:
-        if not n or n in seen:
-            continue
-        seen.add(n)
-        mode = get_server_mode_for_instance(n)
-        if mode:
-            return mode
-    return None
+def _sync_battle_mode(server_state, ctx):
+    # Comparación barata en la ruta caliente; set_server_mode solo cuando cambia el modo.
+    battle_manager = server_state.battle_manager
+    if battle_manager.is_battle_server != ctx.is_battle:
+        battle_manager.set_server_mode(ctx.is_battle)
 
 
 def _drop_stale_drivers_on_new_session(server_state, now_ms):
@@ -65,417 +50,506 @@ def _drop_stale_drivers_on_new_session(server_state, now_ms):
         print(f"🧹 [{server_state.port}] Limpieza NEW_SESSION: {removed} ghost(s) removidos")
 
 
-def process_packet(data, server_state, addr):
-    # Auto-connect logic: register once per server startup/connection when we see traffic
-    server_ip = addr[0]
-    if server_state.last_server_addr is None:
-        print(f"🔌 Auto-Connected from server {server_state.server_name} @ {server_ip}")
-        server_state.last_server_addr = (server_ip, server_state.server_cmd_port)
-        send_registration(server_state, server_ip)
-
-    server_state.last_server_addr = addr
-    parser = PacketParser(data)
-    packet_type = parser.read_uint8()
-    if packet_type is None:
-        return
-    # Keep a lightweight cache to recover driver identity by car slot when packets arrive out of order.
-    if not hasattr(server_state, "last_known_by_car_id"):
-        server_state.last_known_by_car_id = {}
-
-    # ─── NEW_SESSION (50) ───────────────────────────────────
-    if packet_type == ACSP.NEW_SESSION:
-        now_ms = int(time.time() * 1000)
-        _drop_stale_drivers_on_new_session(server_state, now_ms)
-        # After AC /restart_session, some servers stop realtime feed subscriptions.
-        # Re-register to ensure packet 53 (CAR_UPDATE) resumes.
-        last_reg_ms = getattr(server_state, "last_registration_ms", 0)
-        if now_ms - last_reg_ms >= REGISTRATION_REFRESH_MIN_MS:
-            send_registration(server_state, addr[0])
-            server_state.last_registration_ms = now_ms
-
-        parser.read_uint8()   # version
-        parser.read_uint8()   # sessionIndex
-        parser.read_uint8()   # currentSessionIndex
-        parser.read_uint8()   # sessionCount
-
-        # NEW_SESSION is a mixed bag: 
-        # - Server Name is typically a wstring (UTF-32)
-        # - Track and Config are typically standard strings (1 byte length)
-        server_state.server_name = parser.read_wstring()
-        server_state.track       = parser.read_string()
-        server_state.config      = parser.read_string()
-
-        # If we have a cfg_path, reload it to update config_server_name and ensure track info
-        if server_state.cfg_path and os.path.exists(server_state.cfg_path):
+# ─── NEW_SESSION (50) ───────────────────────────────────
+def _handle_new_session(parser, server_state, addr):
+    now_ms = int(time.time() * 1000)
+    server_state.session_uid = uuid4().hex
+    _drop_stale_drivers_on_new_session(server_state, now_ms)
+    # After AC /restart_session, some servers stop realtime feed subscriptions.
+    # Re-register to ensure packet 53 (CAR_UPDATE) resumes.
+    last_reg_ms = getattr(server_state, "last_registration_ms", 0)
+    if now_ms - last_reg_ms >= REGISTRATION_REFRESH_MIN_MS:
+        send_registration(server_state, addr[0])
+        server_state.last_registration_ms = now_ms
+
+    parser.read_uint8()   # version
+    parser.read_uint8()   # sessionIndex
+    parser.read_uint8()   # currentSessionIndex
+    parser.read_uint8()   # sessionCount
+
+    # NEW_SESSION is a mixed bag: 
+    # - Server Name is typically a wstring (UTF-32)
+    # - Track and Config are typically standard strings (1 byte length)
+    server_state.server_name = parser.read_wstring()
+    server_state.track       = parser.read_string()
+    server_state.config      = parser.read_string()
+
+    # If we have a cfg_path, reload it to update config_server_name and ensure track info
+    if server_state.cfg_path and os.path.exists(server_state.cfg_path):
+        try:
+            with open(server_state.cfg_path, 'rb') as f:
+                raw = f.read()
             try:
-                with open(server_state.cfg_path, 'rb') as f:
-                    raw = f.read()
-                try:
-                    content = raw.decode('utf-8')
-                except UnicodeDecodeError:
-                    content = raw.decode('utf-16le', errors='ignore')
-
-                # Update server names
-                server_name_m = re.search(r'^SERVER_NAME=(.+)', content, re.MULTILINE)
-                if not server_name_m:
-                    server_name_m = re.search(r'^NAME=(.+)', content, re.MULTILINE)
-                if server_name_m:
-                    server_state.config_server_name = server_name_m.group(1).strip()
-
-                # Robustly update track/config from INI if packet data looks weird or we want disk priority
-                track_m  = re.search(r'^TRACK=(.+)', content, re.MULTILINE)
-                config_m = re.search(r'^CONFIG_TRACK=(.*)', content, re.MULTILINE)
-                if track_m:
-                    server_state.track = track_m.group(1).strip()
-                if config_m:
-                    server_state.config = config_m.group(1).strip()
-                
-                print(f"🔄 [{server_state.port}] Config reloaded from {server_state.cfg_path}")
-            except Exception as e:
-                print(f"❌ Error reloading {server_state.cfg_path}: {e}")
-
-        # Log active event for this server (try session name, then config name)
-        print(f"   🔍 DB Lookup: '{server_state.server_name}' or '{server_state.config_server_name}'")
-        event = get_active_server_event(server_state.server_name)
-        if not event:
-            event = get_active_server_event(server_state.config_server_name)
-        
-        server_mode = _resolve_server_mode(server_state)
-        is_battle_server = server_mode == "battle"
-        server_state.battle_manager.set_server_mode(is_battle_server)
-            
-        if event:
-            event_info = f" | 🎮 Event: {event['event_type']}"
-        elif server_mode:
-            event_info = f" | 🎛️  Mode: {server_mode}"
-        else:
-            event_info = " | ⚠️  No Event registered"
+                content = raw.decode('utf-8')
+            except UnicodeDecodeError:
+                content = raw.decode('utf-16le', errors='ignore')
+
+            # Update server names
+            server_name_m = re.search(r'^SERVER_NAME=(.+)', content, re.MULTILINE)
+            if not server_name_m:
+                server_name_m = re.search(r'^NAME=(.+)', content, re.MULTILINE)
+            if server_name_m:
+                server_state.config_server_name = server_name_m.group(1).strip()
+
+            # Robustly update track/config from INI if packet data looks weird or we want disk priority
+            track_m  = re.search(r'^TRACK=(.+)', content, re.MULTILINE)
+            config_m = re.search(r'^CONFIG_TRACK=(.*)', content, re.MULTILINE)
+            if track_m:
+                server_state.track = track_m.group(1).strip()
+            if config_m:
+                server_state.config = config_m.group(1).strip()
+
+            print(f"🔄 [{server_state.port}] Config reloaded from {server_state.cfg_path}")
+        except Exception as e:
+            print(f"❌ Error reloading {server_state.cfg_path}: {e}")
+
+    # PB de la pista en memoria: save_lap solo escribirá vueltas que los mejoren.
+    spawn(warm_personal_bests, server_state.track, server_state.config)
+
+    # Log active event for this server (try session name, then config name)
+    print(f"   🔍 DB Lookup: '{server_state.server_name}' or '{server_state.config_server_name}'")
+    # Consulta bloqueante: en segundo plano, nunca en el hilo/loop que recibe UDP.
+    # Hasta que termine vale el contexto anterior (session_context_refresh_loop lo
+    # mantiene al día) y los handlers aplican el modo de batalla con el siguiente paquete.
+    spawn(_resolve_new_session_context, server_state)
+
+
+def _resolve_new_session_context(server_state):
+    ctx = refresh_session_context(server_state)
+    event = ctx.event
+    server_mode = ctx.mode
+
+    if event:
+        event_info = f" | 🎮 Event: {event['event_type']}"
+    elif server_mode:
+        event_info = f" | 🎛️  Mode: {server_mode}"
+    else:
+        event_info = " | ⚠️  No Event registered"
+
+    print(f"🌍 Session [{server_state.port}]: {server_state.track} ({server_state.config}) | Name: {server_state.server_name}{event_info}")
+    return ctx
+
+
+# ─── NEW_CONNECTION (51) ────────────────────────────────
+def _handle_new_connection(parser, server_state, addr):
+    name   = parser.read_wstring()
+    guid   = parser.read_wstring()
+    car_id = parser.read_uint8()
+    if car_id is None: return
+    model  = parser.read_string()
+    parser.skip_string()  # skin
+
+    if not name or not guid: return
+
+    driver = DriverInfo(name, guid, model)
+    _mark_driver_seen(driver)
+    driver.car_id = car_id
+    server_state.active_drivers[car_id] = driver
+    if guid and not guid.startswith('unknown_'):
+        server_state.guid_to_driver[guid] = driver
+        server_state.last_known_by_car_id[car_id] = {
+            "guid": guid,
+            "name": name,
+            "model": model,
+            "seen_ms": int(time.time() * 1000),
+        }
+
+    print(f"🟢 [{server_state.port}] [CONNECTED] CarID {car_id} | {name} | {model} | {guid}")
+    server_state.battle_manager.set_driver_name(guid, name)
+    save_driver(guid, name, model)
+
+    driver.lap_start_time = time.time() * 1000
+    driver.lap_notified_fail = False
+
+    # Notify Node.js the player joined (Event webhook dropped as it's not a lap update)
+    if not guid.startswith('unknown_'):
+
+        # Node.js General Webhook
+        send_server_event("player_join", server_state.server_name, {
+            "steamId": guid,
+            "name": name,
+            "carModel": model,
+            "trackName": server_state.track,
+            "trackConfig": server_state.config
+        }, server_key=server_state.port)
+
+
+# ─── CAR_INFO (54) ──────────────────────────────────────
+def _handle_car_info(parser, server_state, addr):
+    car_id       = parser.read_uint8()
+    if car_id is None: return
+    is_connected = parser.read_uint8()
+    model   = parser.read_wstring()
+    parser.skip_wstring()  # skin
+    name    = parser.read_wstring()
+    parser.skip_wstring()  # team
+    guid    = parser.read_wstring()
+
+    # If AC says this slot is empty OR the player aborted load (connected but no name/guid),
+    # but we still have them tracked as an active driver...
+    if is_connected == 0 or not name or not guid:
+        driver = server_state.active_drivers.get(car_id)
+        if driver:
+            # Debounce transient empty CAR_INFO pulses to avoid flapping remove/re-add.
+            suspects = getattr(server_state, "ghost_suspects", None)
+            if suspects is None:
+                suspects = {}
+                server_state.ghost_suspects = suspects
+            first_seen = suspects.get(car_id, 0)
+            now_ms = int(time.time() * 1000)
+            if not first_seen:
+                suspects[car_id] = now_ms
+                return
+            if now_ms - first_seen < GHOST_CARINFO_DEBOUNCE_MS:
+                return
+            suspects.pop(car_id, None)
+
+            # Only purge if the driver is truly stale.
+            # Empty CAR_INFO pulses can happen transiently while the player is still online.
+            last_seen = getattr(driver, "last_seen_ms", 0)
+            if last_seen > 0 and (now_ms - last_seen) <= GHOST_DRIVER_TIMEOUT_MS:
+                return
 
-        print(f"🌍 Session [{server_state.port}]: {server_state.track} ({server_state.config}) | Name: {server_state.server_name}{event_info}")
+            print(f"🧹 [{server_state.port}] Cleaning up Ghost Player: {driver.name} (CarID {car_id})")
 
-    # ─── NEW_CONNECTION (51) ────────────────────────────────
-    elif packet_type == ACSP.NEW_CONNECTION:
-        name   = parser.read_wstring()
-        guid   = parser.read_wstring()
-        car_id = parser.read_uint8()
-        if car_id is None: return
-        model  = parser.read_string()
-        _skin  = parser.read_string()
+            # Node.js Event Leave
+            if not driver.guid.startswith('unknown_'):
+                send_server_event("player_leave", getattr(server_state, 'config_server_name', server_state.server_name), {
+                    "steamId": driver.guid,
+                    "trackName": server_state.track,
+                    "trackConfig": server_state.config
+                }, server_key=server_state.port)
+
+            server_state.battle_manager.remove_car(driver.guid)
+            if driver.guid in server_state.guid_to_driver:
+                del server_state.guid_to_driver[driver.guid]
+            del server_state.active_drivers[car_id]
+        return
 
-        if not name or not guid: return
+    if not name or not guid: return
+    suspects = getattr(server_state, "ghost_suspects", None)
+    if suspects is not None:
+        suspects.pop(car_id, None)
 
+    # DO NOT wipe existing driver state (laps, penalties) on heartbeat ping
+    driver = server_state.active_drivers.get(car_id)
+    if not driver:
         driver = DriverInfo(name, guid, model)
         _mark_driver_seen(driver)
-        driver.car_id = car_id
         server_state.active_drivers[car_id] = driver
-        if guid and not guid.startswith('unknown_'):
-            server_state.guid_to_driver[guid] = driver
-            server_state.last_known_by_car_id[car_id] = {
-                "guid": guid,
-                "name": name,
-                "model": model,
-                "seen_ms": int(time.time() * 1000),
-            }
-
-        print(f"🟢 [{server_state.port}] [CONNECTED] CarID {car_id} | {name} | {model} | {guid}")
-        server_state.battle_manager.set_driver_name(guid, name)
-        save_driver(guid, name, model)
-
-        driver.lap_start_time = time.time() * 1000
-        driver.lap_notified_fail = False
-
-        # Notify Node.js the player joined (Event webhook dropped as it's not a lap update)
-        if not guid.startswith('unknown_'):
-            
+    else:
+        driver.name = name
+        driver.guid = guid
+        driver.model = model
+        _mark_driver_seen(driver)
+
+    if guid and not guid.startswith('unknown_'):
+        server_state.guid_to_driver[guid] = driver
+        server_state.last_known_by_car_id[car_id] = {
+            "guid": guid,
+            "name": name,
+            "model": model,
+            "seen_ms": int(time.time() * 1000),
+        }
+
+    print(f"🏎️ [{server_state.port}] [CAR_INFO] CarID {car_id} | {name} | {model} | {guid}")
+    server_state.battle_manager.set_driver_name(guid, name)
+    save_driver(guid, name, model)
+
+    # If realtime stream (packet 53) drops, recover subscription proactively.
+    now_ms = int(time.time() * 1000)
+    last_car_update_ms = getattr(server_state, "last_car_update_ms", 0)
+    last_reg_ms = getattr(server_state, "last_registration_ms", 0)
+    if (
+        now_ms - last_car_update_ms >= CAR_UPDATE_WATCHDOG_MS
+        and now_ms - last_reg_ms >= REGISTRATION_REFRESH_MIN_MS
+    ):
+        send_registration(server_state, addr[0])
+        server_state.last_registration_ms = now_ms
+        print(f"🔁 [{server_state.port}] Re-subscribed realtime feed (no CAR_UPDATE detected)")
+
+
+# ─── CONNECTION_CLOSED (52) ─────────────────────────────
+def _handle_connection_closed(parser, server_state, addr):
+    name   = parser.read_wstring()
+    guid   = parser.read_wstring()
+    car_id = parser.read_uint8()
+    if car_id is None: return
+
+    driver = server_state.active_drivers.get(car_id)
+    if driver:
+        print(f"👋 [{server_state.port}] Disconnected: {driver.name} (CarID {car_id})")
+        if not driver.guid.startswith('unknown_'):
+            if server_state.session.feeds_events:
+                dispatch_event(server_state, driver, driver.last_lap, is_finished=True)
             # Node.js General Webhook
-            send_server_event("player_join", server_state.server_name, {
-                "steamId": guid,
-                "name": name,
-                "carModel": model,
+            send_server_event("player_leave", server_state.server_name, {
+                "steamId": driver.guid,
                 "trackName": server_state.track,
                 "trackConfig": server_state.config
-            })
-
-    # ─── CAR_INFO (210) ─────────────────────────────────────
-    elif packet_type == ACSP.CAR_INFO:
-        car_id       = parser.read_uint8()
-        if car_id is None: return
-        is_connected = parser.read_uint8()
-        model   = parser.read_wstring()
-        _skin   = parser.read_wstring()
-        name    = parser.read_wstring()
-        _team   = parser.read_wstring()
-        guid    = parser.read_wstring()
-
-        # If AC says this slot is empty OR the player aborted load (connected but no name/guid),
-        # but we still have them tracked as an active driver...
-        if is_connected == 0 or not name or not guid:
-            driver = server_state.active_drivers.get(car_id)
-            if driver:
-                # Debounce transient empty CAR_INFO pulses to avoid flapping remove/re-add.
-                suspects = getattr(server_state, "ghost_suspects", None)
-                if suspects is None:
-                    suspects = {}
-                    server_state.ghost_suspects = suspects
-                first_seen = suspects.get(car_id, 0)
-                now_ms = int(time.time() * 1000)
-                if not first_seen:
-                    suspects[car_id] = now_ms
-                    return
-                if now_ms - first_seen < GHOST_CARINFO_DEBOUNCE_MS:
-                    return
-                suspects.pop(car_id, None)
-
-                # Only purge if the driver is truly stale.
-                # Empty CAR_INFO pulses can happen transiently while the player is still online.
-                last_seen = getattr(driver, "last_seen_ms", 0)
-                if last_seen > 0 and (now_ms - last_seen) <= GHOST_DRIVER_TIMEOUT_MS:
-                    return
-
-                print(f"🧹 [{server_state.port}] Cleaning up Ghost Player: {driver.name} (CarID {car_id})")
-                
-                # Node.js Event Leave
-                if not driver.guid.startswith('unknown_'):
-                    send_server_event("player_leave", getattr(server_state, 'config_server_name', server_state.server_name), {
-                        "steamId": driver.guid,
-                        "trackName": server_state.track,
-                        "trackConfig": server_state.config
-                    })
-
-                server_state.battle_manager.remove_car(driver.guid)
-                if driver.guid in server_state.guid_to_driver:
-                    del server_state.guid_to_driver[driver.guid]
-                del server_state.active_drivers[car_id]
-            return
+            }, server_key=server_state.port)
 
-        if not name or not guid: return
-        suspects = getattr(server_state, "ghost_suspects", None)
-        if suspects is not None:
-            suspects.pop(car_id, None)
+            server_state.battle_manager.remove_car(driver.guid)
+        if driver.guid in server_state.guid_to_driver:
+            del server_state.guid_to_driver[driver.guid]
+        del server_state.active_drivers[car_id]
 
-        # DO NOT wipe existing driver state (laps, penalties) on heartbeat ping
-        driver = server_state.active_drivers.get(car_id)
-        if not driver:
-            driver = DriverInfo(name, guid, model)
-            _mark_driver_seen(driver)
-            server_state.active_drivers[car_id] = driver
-        else:
-            driver.name = name
-            driver.guid = guid
-            driver.model = model
-            _mark_driver_seen(driver)
-            
-        if guid and not guid.startswith('unknown_'):
-            server_state.guid_to_driver[guid] = driver
-            server_state.last_known_by_car_id[car_id] = {
-                "guid": guid,
-                "name": name,
-                "model": model,
-                "seen_ms": int(time.time() * 1000),
-            }
-
-        print(f"🏎️ [{server_state.port}] [CAR_INFO] CarID {car_id} | {name} | {model} | {guid}")
-        server_state.battle_manager.set_driver_name(guid, name)
-        save_driver(guid, name, model)
-
-        # If realtime stream (packet 53) drops, recover subscription proactively.
-        now_ms = int(time.time() * 1000)
-        last_car_update_ms = getattr(server_state, "last_car_update_ms", 0)
-        last_reg_ms = getattr(server_state, "last_registration_ms", 0)
-        if (
-            now_ms - last_car_update_ms >= CAR_UPDATE_WATCHDOG_MS
-            and now_ms - last_reg_ms >= REGISTRATION_REFRESH_MIN_MS
-        ):
-            send_registration(server_state, addr[0])
-            server_state.last_registration_ms = now_ms
-            print(f"🔁 [{server_state.port}] Re-subscribed realtime feed (no CAR_UPDATE detected)")
-
-    # ─── CONNECTION_CLOSED (52) ─────────────────────────────
-    elif packet_type == ACSP.CONNECTION_CLOSED:
-        name   = parser.read_wstring()
-        guid   = parser.read_wstring()
-        car_id = parser.read_uint8()
-        if car_id is None: return
 
-        driver = server_state.active_drivers.get(car_id)
-        if driver:
-            print(f"👋 [{server_state.port}] Disconnected: {driver.name} (CarID {car_id})")
-            if not driver.guid.startswith('unknown_'):
-                server_mode = _resolve_server_mode(server_state)
-                if server_mode in ("event", "time-attack"):
-                    dispatch_event(server_state, driver, driver.last_lap, is_finished=True)
-                # Node.js General Webhook
-                send_server_event("player_leave", server_state.server_name, {
-                    "steamId": driver.guid,
-                    "trackName": server_state.track,
-                    "trackConfig": server_state.config
-                })
+# ─── CAR_UPDATE (53) ────────────────────────────────────
+def _handle_car_update(parser, server_state, addr):
+    upd = read_car_update(parser)
+    car_id = upd.car_id
+    if car_id is None: return
 
-                server_state.battle_manager.remove_car(driver.guid)
-            if driver.guid in server_state.guid_to_driver:
-                del server_state.guid_to_driver[driver.guid]
-            del server_state.active_drivers[car_id]
+    driver = server_state.active_drivers.get(car_id)
+    if driver:
+        _mark_driver_seen(driver)
+        server_state.last_car_update_ms = int(time.time() * 1000)
+        speed_ms = ((upd.v_x or 0)**2 + (upd.v_y or 0)**2 + (upd.v_z or 0)**2)**0.5
+        now = int(time.time() * 1000)
 
-    # ─── CAR_UPDATE (53) ────────────────────────────────────
-    elif packet_type == getattr(ACSP, 'CAR_UPDATE', 53):
-        car_id = parser.read_uint8()
-        if car_id is None: return
-        pos_x  = parser.read_float()
-        pos_y  = parser.read_float()
-        pos_z  = parser.read_float()
-        v_x    = parser.read_float()
-        v_y    = parser.read_float()
-        v_z    = parser.read_float()
-        gear   = parser.read_uint8()
-        rpm    = parser.read_uint16()
-        spline = parser.read_float()
-        
+        ctx = server_state.session
+        # Feed Time Attack/Endurance engine only in event/time-attack mode (meta vacío en otros modos).
+        driver.car_id = car_id
+        server_state.event_engine.check_idle(driver, speed_ms, now, ctx.meta)
+
+        _sync_battle_mode(server_state, ctx)
+
+        # Feed BattleManager only on battle servers.
+        if ctx.is_battle:
+            server_state.battle_manager.update(
+                driver.guid, upd.spline, speed_ms * 3.6, (upd.pos_x, upd.pos_y, upd.pos_z)
+            )
+
+
+# ─── CLIENT_EVENT (130) ─────────────────────────────────
+def _handle_client_event(parser, server_state, addr):
+    ev = read_client_event(parser)
+    ev_type = ev.ev_type
+    car_id  = ev.car_id
+
+    # Battle Engine Collision Check
+    if ev_type == getattr(ACSP, 'CE_COLLISION_WITH_CAR', 10):
+        other_car_id = ev.other_car_id
+        impact_speed = ev.impact_speed
+        driver1 = server_state.active_drivers.get(car_id)
+        driver2 = server_state.active_drivers.get(other_car_id)
+        ctx = server_state.session
+        _sync_battle_mode(server_state, ctx)
+        if ctx.is_battle and driver1 and driver2:
+            server_state.battle_manager.handle_collision(
+                driver1.guid, driver2.guid, impact_speed
+            )
+    elif ev_type == getattr(ACSP, 'CE_COLLISION_WITH_ENV', 11):
+        pass
+
+    if ev_type in (getattr(ACSP, 'CE_COLLISION_WITH_CAR', 10), getattr(ACSP, 'CE_COLLISION_WITH_ENV', 11)):
         driver = server_state.active_drivers.get(car_id)
         if driver:
-            _mark_driver_seen(driver)
-            server_state.last_car_update_ms = int(time.time() * 1000)
-            speed_ms = ((v_x or 0)**2 + (v_y or 0)**2 + (v_z or 0)**2)**0.5
-            now = int(time.time() * 1000)
-            
-            server_mode = _resolve_server_mode(server_state)
-            # Feed Time Attack/Endurance engine only in event/time-attack mode.
-            event = None
-            if server_mode in ("event", "time-attack"):
-                event = get_active_server_event(server_state.server_name) or get_active_server_event(server_state.config_server_name)
-            meta = event.get("metadata", {}) if event else {}
-            
             driver.car_id = car_id
-            server_state.event_engine.check_idle(driver, speed_ms, now, meta)
-
-            is_battle_server = server_mode == "battle"
-            server_state.battle_manager.set_server_mode(is_battle_server)
-
-            # Feed BattleManager only on battle servers.
-            if is_battle_server:
-                server_state.battle_manager.update(
-                    driver.guid, spline, speed_ms * 3.6, (pos_x, pos_y, pos_z)
-                )
-
-    # ─── CLIENT_EVENT (130) ─────────────────────────────────
-    elif packet_type == getattr(ACSP, 'CLIENT_EVENT', 130):
-        ev_type = parser.read_uint8()
-        car_id  = parser.read_uint8()
-        
-        # Battle Engine Collision Check
-        if ev_type == getattr(ACSP, 'CE_COLLISION_WITH_CAR', 10):
-            other_car_id = parser.read_uint8()
-            impact_speed = parser.read_float()
-            driver1 = server_state.active_drivers.get(car_id)
-            driver2 = server_state.active_drivers.get(other_car_id)
-            server_mode = _resolve_server_mode(server_state)
-            is_battle_server = server_mode == "battle"
-            server_state.battle_manager.set_server_mode(is_battle_server)
-            if is_battle_server and driver1 and driver2:
-                server_state.battle_manager.handle_collision(
-                    driver1.guid, driver2.guid, impact_speed
-                )
-        elif ev_type == getattr(ACSP, 'CE_COLLISION_WITH_ENV', 11):
-            pass
-        
-        if ev_type in (getattr(ACSP, 'CE_COLLISION_WITH_CAR', 10), getattr(ACSP, 'CE_COLLISION_WITH_ENV', 11)):
-            driver = server_state.active_drivers.get(car_id)
-            if driver:
-                driver.car_id = car_id
-                server_mode = _resolve_server_mode(server_state)
-                if server_mode in ("event", "time-attack"):
-                    event = get_active_server_event(server_state.server_name) or get_active_server_event(server_state.config_server_name)
-                    meta = event.get("metadata", {}) if event else {}
-                    server_state.event_engine.check_collision(driver, meta)
-
-    # ─── LAP_COMPLETED (58) ─────────────────────────────────
-    elif packet_type == ACSP.LAP_COMPLETED:
-        car_id      = parser.read_uint8()
-        if car_id is None: return
-        ac_lap_time = parser.read_uint32() or 0
-        cuts        = parser.read_uint8() or 0
-
-        now    = int(time.time() * 1000)
-        driver = server_state.active_drivers.get(car_id)
-
-        if not driver:
-            # Recover from recent CAR_INFO/NEW_CONNECTION cache to avoid losing laps.
-            cached = server_state.last_known_by_car_id.get(car_id)
-            if cached and cached.get("guid"):
-                driver = DriverInfo(
-                    cached.get("name") or f"Driver_CarID_{car_id}",
-                    cached["guid"],
-                    cached.get("model") or "Unknown",
-                )
-                driver.car_id = car_id
-                _mark_driver_seen(driver)
-                server_state.active_drivers[car_id] = driver
-                if not driver.guid.startswith('unknown_'):
-                    server_state.guid_to_driver[driver.guid] = driver
-            else:
-                import struct
-                # Ask AC for fresh CAR_INFO and skip this lap if identity is unknown.
-                if server_state.last_server_addr:
-                    server_state.sock.sendto(struct.pack('BB', 201, car_id), server_state.last_server_addr)
-                print(f"⚠️ [{server_state.port}] LAP_COMPLETED without driver identity (CarID {car_id}). Waiting CAR_INFO.")
-                return
-        else:
-            _mark_driver_seen(driver)
+            ctx = server_state.session
+            if ctx.feeds_events:
+                server_state.event_engine.check_collision(driver, ctx.meta)
 
-        if ac_lap_time <= 0 or ac_lap_time > 36000000:
-            return
 
-        if ac_lap_time < MIN_VALID_LAP_MS:
-            print(
-                f"⚠️ [{server_state.port}] Lap ignorada por sospechosa ({ac_lap_time/1000:.3f}s < {MIN_VALID_LAP_MS/1000:.3f}s)"
+# ─── LAP_COMPLETED (73) ─────────────────────────────────
+def _record_lap_history(server_state, driver, lap_time, cuts, valid, fail_reason, lap_number, now):
+    if driver.guid.startswith('unknown_'):
+        return
+    record_lap_history(
+        server_state.session_uid, server_state.server_name, server_state.track, server_state.config,
+        driver.guid, driver.name, driver.model, lap_number, lap_time, cuts, valid, fail_reason,
+        server_state.session.mode, now,
+    )
+
+
+def _handle_lap_completed(parser, server_state, addr):
+    lap = read_lap_completed(parser)
+    car_id      = lap.car_id
+    if car_id is None: return
+    ac_lap_time = lap.lap_time or 0
+    cuts        = lap.cuts or 0
+
+    now    = int(time.time() * 1000)
+    driver = server_state.active_drivers.get(car_id)
+
+    if not driver:
+        # Recover from recent CAR_INFO/NEW_CONNECTION cache to avoid losing laps.
+        cached = server_state.last_known_by_car_id.get(car_id)
+        if cached and cached.get("guid"):
+            driver = DriverInfo(
+                cached.get("name") or f"Driver_CarID_{car_id}",
+                cached["guid"],
+                cached.get("model") or "Unknown",
             )
+            driver.car_id = car_id
+            _mark_driver_seen(driver)
+            server_state.active_drivers[car_id] = driver
+            if not driver.guid.startswith('unknown_'):
+                server_state.guid_to_driver[driver.guid] = driver
+        else:
+            import struct
+            # Ask AC for fresh CAR_INFO and skip this lap if identity is unknown.
+            if server_state.last_server_addr:
+                server_state.sock.sendto(struct.pack('BB', 201, car_id), server_state.last_server_addr)
+            print(f"⚠️ [{server_state.port}] LAP_COMPLETED without driver identity (CarID {car_id}). Waiting CAR_INFO.")
             return
+    else:
+        _mark_driver_seen(driver)
 
-        driver.last_lap   = ac_lap_time
-        driver.lap_count += 1
-        is_valid = (cuts == 0)
-
-        server_mode = _resolve_server_mode(server_state)
-        # Get active event settings to check constraints.
-        event = None
-        if server_mode in ("event", "time-attack"):
-            event = get_active_server_event(server_state.server_name)
-            if not event:
-                event = get_active_server_event(server_state.config_server_name)
-
-        meta = event.get("metadata", {}) if event else {}
-        total_laps = meta.get("totalLaps", "?")
-        
-        driver.car_id = car_id
-        is_valid, fail_reason = server_state.event_engine.evaluate_lap(driver, ac_lap_time, cuts, meta)
-
-        if not is_valid:
-            print(f"🏁 [{server_state.port}] [LAP] ⚠️  INVALID | {driver.name} | {ac_lap_time/1000:.3f}s | Cuts: {cuts} ({fail_reason})")
-            
-            # Send webhook to update failed lap counts in real time
-            if server_mode in ("event", "time-attack"):
-                dispatch_event(server_state, driver, lap_time_ms=0, is_finished=False)
-            return
+    if ac_lap_time <= 0 or ac_lap_time > 36000000:
+        return
 
-        if driver.best_lap == 0 or ac_lap_time < driver.best_lap:
-            driver.best_lap = ac_lap_time
+    if ac_lap_time < MIN_VALID_LAP_MS:
+        _record_lap_history(server_state, driver, ac_lap_time, cuts, False, "below_min_lap_time", None, now)
+        print(
+            f"⚠️ [{server_state.port}] Lap ignorada por sospechosa ({ac_lap_time/1000:.3f}s < {MIN_VALID_LAP_MS/1000:.3f}s)"
+        )
+        return
 
-        print(f"🏁 [{server_state.port}] [LAP] ✅ | {driver.name} | Lap #{driver.lap_count} | {ac_lap_time/1000:.3f}s | Best: {driver.best_lap/1000:.3f}s")
-        if event:
-            send_chat(server_state, car_id, f"[EVENT] Lap {driver.lap_count}/{total_laps} COMPLETED! Time: {ac_lap_time/1000:.3f}s")
+    driver.last_lap   = ac_lap_time
+    driver.lap_count += 1
+    is_valid = (cuts == 0)
 
-        if not driver.guid.startswith('unknown_'):
-            save_lap(driver.guid, driver.model, server_state.track, server_state.config,
-                     server_state.server_name, ac_lap_time, True, now)
-            
-            # Node.js General Webhook
-            send_server_event("lap_completed", server_state.server_name, {
-                "steamId": driver.guid,
-                "carModel": driver.model,
-                "trackName": server_state.track,
-                "trackConfig": server_state.config,
-                "lapTime": ac_lap_time
-            })
+    ctx = server_state.session
+    # Active event settings to check constraints (only in event/time-attack mode).
+    event = ctx.active_event
+    meta = ctx.meta
+    total_laps = meta.get("totalLaps", "?")
+
+    driver.car_id = car_id
+    is_valid, fail_reason = server_state.event_engine.evaluate_lap(driver, ac_lap_time, cuts, meta)
+    _record_lap_history(server_state, driver, ac_lap_time, cuts, is_valid, fail_reason, driver.lap_count, now)
+
+    if not is_valid:
+        print(f"🏁 [{server_state.port}] [LAP] ⚠️  INVALID | {driver.name} | {ac_lap_time/1000:.3f}s | Cuts: {cuts} ({fail_reason})")
+
+        # Send webhook to update failed lap counts in real time
+        if ctx.feeds_events:
+            dispatch_event(server_state, driver, lap_time_ms=0, is_finished=False)
+        return
+
+    if driver.best_lap == 0 or ac_lap_time < driver.best_lap:
+        driver.best_lap = ac_lap_time
+
+    print(f"🏁 [{server_state.port}] [LAP] ✅ | {driver.name} | Lap #{driver.lap_count} | {ac_lap_time/1000:.3f}s | Best: {driver.best_lap/1000:.3f}s")
+    if event:
+        send_chat(server_state, car_id, f"[EVENT] Lap {driver.lap_count}/{total_laps} COMPLETED! Time: {ac_lap_time/1000:.3f}s")
+
+    if not driver.guid.startswith('unknown_'):
+        save_lap(driver.guid, driver.model, server_state.track, server_state.config,
+                 server_state.server_name, ac_lap_time, True, now)
+
+        # Node.js General Webhook
+        send_server_event("lap_completed", server_state.server_name, {
+            "steamId": driver.guid,
+            "carModel": driver.model,
+            "trackName": server_state.track,
+            "trackConfig": server_state.config,
+            "lapTime": ac_lap_time
+        }, server_key=server_state.port)
+
+    # ── Dispatch dynamic webhook based on active event ──
+    if ctx.feeds_events:
+        dispatch_event(server_state, driver, lap_time_ms=ac_lap_time)
+
+# ─── END_SESSION (55) ───────────────────────────────────
+def _handle_end_session(parser, server_state, addr):
+    results_file = parser.read_wstring()
+    print(f"🏁 [{server_state.port}] END_SESSION | Results: {results_file or '-'}")
+
+
+# ─── VERSION (56) ───────────────────────────────────────
+def _handle_version(parser, server_state, addr):
+    server_state.protocol_version = parser.read_uint8()
+    print(f"ℹ️ [{server_state.port}] ACSP protocol version: {server_state.protocol_version}")
+
+
+# ──────────────────────────────────────────────
+# HANDLER REGISTRY
+# ──────────────────────────────────────────────
+# Tabla indexada por id de paquete: process_packet hace un único acceso por índice
+# en lugar de recorrer una cadena if/elif. Paquetes sin handler (p.ej. CHAT 57) se ignoran.
+_HANDLERS = [None] * 256
+# Por id: [llamadas, ns acumulados, ns máximo]. Sin lock: entre hilos listener se
+# puede perder algún incremento, suficiente para métricas.
+_HANDLER_STATS = [None] * 256
+
+
+def register_handler(packet_type, handler):
+    """
+    Registra handler(parser, server_state, addr) para un id de paquete ACSP (0-255).
+    El parser llega posicionado tras el byte de tipo. Sustituye al handler anterior.
+    """
+    if not 0 <= packet_type <= 255:
+        raise ValueError(f"packet_type fuera de rango: {packet_type}")
+    _HANDLERS[packet_type] = handler
+    _HANDLER_STATS[packet_type] = [0, 0, 0]
+
+
+def handler_stats():
+    """{packet_type: {handler, calls, total_ms, avg_us, max_us}} de los handlers con llamadas."""
+    out = {}
+    for packet_type, handler in enumerate(_HANDLERS):
+        stats = _HANDLER_STATS[packet_type]
+        if handler is None or not stats or not stats[0]:
+            continue
+        calls, total_ns, max_ns = stats
+        out[packet_type] = {
+            "handler": handler.__name__,
+            "calls": calls,
+            "total_ms": total_ns / 1e6,
+            "avg_us": total_ns / calls / 1e3,
+            "max_us": max_ns / 1e3,
+        }
+    return out
+
+
+def format_handler_stats():
+    stats = handler_stats()
+    if not stats:
+        return "sin paquetes"
+    return " | ".join(
+        f"{pt}:{s['handler'].lstrip('_')} n={s['calls']} avg={s['avg_us']:.0f}µs max={s['max_us']:.0f}µs"
+        for pt, s in stats.items()
+    )
+
+
+register_handler(ACSP.NEW_SESSION, _handle_new_session)
+register_handler(ACSP.NEW_CONNECTION, _handle_new_connection)
+register_handler(ACSP.CONNECTION_CLOSED, _handle_connection_closed)
+register_handler(ACSP.CAR_UPDATE, _handle_car_update)
+register_handler(ACSP.CAR_INFO, _handle_car_info)
+register_handler(ACSP.END_SESSION, _handle_end_session)
+register_handler(ACSP.VERSION, _handle_version)
+register_handler(ACSP.LAP_COMPLETED, _handle_lap_completed)
+register_handler(ACSP.CLIENT_EVENT, _handle_client_event)
+
+
+def process_packet(data, server_state, addr):
+    # Auto-connect logic: register once per server startup/connection when we see traffic
+    server_ip = addr[0]
+    if server_state.last_server_addr is None:
+        print(f"🔌 Auto-Connected from server {server_state.server_name} @ {server_ip}")
+        server_state.last_server_addr = (server_ip, server_state.server_cmd_port)
+        send_registration(server_state, server_ip)
+
+    server_state.last_server_addr = addr
+    parser = PacketParser(data)
+    packet_type = parser.read_uint8()
+    if packet_type is None:
+        return
+    handler = _HANDLERS[packet_type]
+    if handler is None:
+        return
 
-        # ── Dispatch dynamic webhook based on active event ──
-        if server_mode in ("event", "time-attack"):
-            dispatch_event(server_state, driver, lap_time_ms=ac_lap_time)
+    stats = _HANDLER_STATS[packet_type]
+    t0 = perf_counter_ns()
+    try:
+        handler(parser, server_state, addr)
+    finally:
+        elapsed = perf_counter_ns() - t0
+        stats[0] += 1
+        stats[1] += elapsed
+        if elapsed > stats[2]:
+            stats[2] = elapsed
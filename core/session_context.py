@@ -0,0 +1,83 @@
+"""
+Contexto de sesión por servidor: modo operativo (battle / event / time-attack) y
+evento activo, resueltos contra la BD fuera de la ruta caliente.
+
+Se resuelve en NEW_SESSION y lo refresca session_context_refresh_loop en segundo
+plano; los handlers de paquetes solo leen `server_state.session` (una asignación de
+atributo, atómica entre hilos) y nunca llaman a db/database.py en línea.
+"""
+
+import os
+import time
+
+from db.database import get_active_server_event, get_server_mode_for_instance
+
+SESSION_CONTEXT_REFRESH_SEC = float(os.getenv("SESSION_CONTEXT_REFRESH_SEC", "3"))
+
+
+class SessionContext:
+    """Instantánea inmutable del modo y evento activo de un servidor."""
+
+    __slots__ = ("mode", "event", "is_battle", "feeds_events", "active_event", "meta")
+
+    def __init__(self, mode=None, event=None):
+        self.mode = mode
+        self.event = event
+        self.is_battle = mode == "battle"
+        # Time Attack/Endurance engine y webhooks de evento solo en estos modos.
+        self.feeds_events = mode in ("event", "time-attack")
+        self.active_event = event if self.feeds_events else None
+        self.meta = (self.active_event or {}).get("metadata") or {}
+
+    def same_as(self, other):
+        return other is not None and self.mode == other.mode and self.event == other.event
+
+
+def _candidate_names(server_state):
+    # Nombres desde AC / ini pueden diferir en espacios; panel/control debe coincidir.
+    names = [
+        (server_state.server_folder_id or "").strip(),
+        (server_state.server_name or "").strip(),
+        (server_state.config_server_name or "").strip(),
+    ]
+    seen = set()
+    out = []
+    for n in names:
+        if n and n not in seen:
+            seen.add(n)
+            out.append(n)
+    return out
+
+
+def resolve_session_context(server_state):
+    """Consulta la BD (bloqueante) y construye un SessionContext nuevo."""
+    mode = None
+    for name in _candidate_names(server_state):
+        mode = get_server_mode_for_instance(name)
+        if mode:
+            break
+    event = get_active_server_event(server_state.server_name)
+    if not event:
+        event = get_active_server_event(server_state.config_server_name)
+    return SessionContext(mode, event)
+
+
+def refresh_session_context(server_state):
+    ctx = resolve_session_context(server_state)
+    previous = server_state.session
+    server_state.session = ctx
+    if not ctx.same_as(previous):
+        event_type = ctx.event["event_type"] if ctx.event else "-"
+        print(f"🎛️  [{server_state.port}] Session context: mode={ctx.mode} | event={event_type}")
+    return ctx
+
+
+def session_context_refresh_loop(servers, interval=SESSION_CONTEXT_REFRESH_SEC):
+    """Refresca el contexto de todos los servidores cada `interval` segundos."""
+    while True:
+        for state in servers.values():
+            try:
+                refresh_session_context(state)
+            except Exception as e:
+                print(f"⚠️ [{state.port}] Session context refresh error: {e}")
+        time.sleep(interval)
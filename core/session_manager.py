@@ -1,12 +1,15 @@
+import asyncio
 import struct
 import threading
 import time
 import os
 import os.path
 from uuid import uuid4
-from db.database import get_server_mode_for_instance
+from core.background import spawn_async
+from core.session_context import SessionContext
 from engines.battle_engine import BattleManager
 from engines.event_engine import TimeAttackEngine
+from network.udp_receiver import BatchStats, RecvBuffer
 
 class DriverInfo:
     def __init__(self, name, guid, model):
@@ -51,8 +54,16 @@ class ServerState:
         
         self.active_drivers = {} # car_id -> DriverInfo
         self.guid_to_driver = {} # guid -> DriverInfo
+        # car_id -> {guid, name, model, seen_ms}: recupera la identidad si LAP_COMPLETED llega antes que CAR_INFO
+        self.last_known_by_car_id = {}
         self.sock = None
         self.last_server_addr = None
+        self.recv_stats = BatchStats()
+        self.recv_buffer = RecvBuffer()
+        # Modo/evento activo; lo sustituyen NEW_SESSION y session_context_refresh_loop.
+        self.session = SessionContext()
+        # Identificador de la sesión AC actual (lap_history); nuevo en cada NEW_SESSION.
+        self.session_uid = uuid4().hex
         
         # Sub-engines
         self.battle_manager = BattleManager()
@@ -69,21 +80,7 @@ class ServerState:
         )
 
     def _get_server_mode(self):
-        # Nombres desde AC / ini pueden diferir en espacios; panel/control debe coincidir.
-        names = [
-            (self.server_folder_id or "").strip(),
-            (self.server_name or "").strip(),
-            (self.config_server_name or "").strip(),
-        ]
-        seen = set()
-        for n in names:
-            if not n or n in seen:
-                continue
-            seen.add(n)
-            mode = get_server_mode_for_instance(n)
-            if mode:
-                return mode
-        return ""
+        return self.session.mode or ""
 
     def _get_battle_webhook_url(self):
         # Battle must use dedicated webhook endpoint only.
@@ -98,7 +95,7 @@ class ServerState:
         return f"battle-{uuid4().hex[:12]}"
 
     def handle_battle_score(self, battle_id, p1_score, p2_score, winner_guid, points_log):
-        from network.event_dispatcher import dispatch_battle_webhook
+        from network.event_dispatcher import battle_webhook_secret, dispatch_battle_webhook
         webhook_url = self._get_battle_webhook_url()
         battle = self.battle_manager.battle
         # Only dispatch final results (series winner decided).
@@ -117,11 +114,7 @@ class ServerState:
             "player1_steam_id": p1_guid,
             "player2_steam_id": p2_guid,
             "webhook_url": webhook_url,
-            "webhook_secret": (
-                (os.getenv("BATTLE_WEBHOOK_SECRET") or "").strip()
-                or (os.getenv("battle_webhook_secret") or "").strip()
-                or None
-            ),
+            "webhook_secret": battle_webhook_secret(),
             "metadata": {
                 "player1Name": getattr(p1_driver, "name", ""),
                 "player2Name": getattr(p2_driver, "name", ""),
@@ -173,8 +166,15 @@ def send_registration(server_state, server_ip):
             packet = struct.pack('BB', 201, i)
             sock.sendto(packet, target)
             time.sleep(0.05)
-    
-    threading.Thread(target=_request, daemon=True).start()
+
+    async def _request_async():
+        for i in range(32):
+            packet = struct.pack('BB', 201, i)
+            sock.sendto(packet, target)
+            await asyncio.sleep(0.05)
+
+    if not spawn_async(_request_async):
+        threading.Thread(target=_request, daemon=True).start()
 
 def send_chat(server_state, car_id, message):
     """Sends a private chat message to a player ID."""
@@ -0,0 +1,108 @@
+"""
+Codificación delta de server_status (opt-in con SERVER_STATUS_DELTA=true).
+
+server_status_loop mandaba cada 15 s la lista completa de jugadores de cada
+servidor aunque no hubiera cambiado nada. StatusDeltaEncoder recuerda la última
+instantánea enviada por servidor y decide qué publicar:
+
+  keyframe  `server_status` completo como siempre (más "seq" y "keyframe": true):
+            el primero, tras cambiar de pista/config y cada `keyframe_sec` para
+            resincronizar
+  delta     `server_status_delta` con joined / left / changed respecto a "baseSeq"
+  nada      si no cambió nada y no toca keyframe
+
+Si el backend ve un delta cuyo baseSeq no es el último seq que recibió (un envío
+perdido), debe ignorar deltas hasta el siguiente keyframe. Del lado emisor, quien
+pierde un envío (cola llena, fallo HTTP) llama a forget() para que el siguiente
+ya sea keyframe y no haya que esperar a `keyframe_sec`.
+"""
+
+import threading
+import time
+
+
+class _Sent:
+    __slots__ = ("seq", "players", "track", "config", "keyframe_at")
+
+    def __init__(self, seq, players, track, config, keyframe_at):
+        self.seq = seq
+        self.players = players
+        self.track = track
+        self.config = config
+        self.keyframe_at = keyframe_at
+
+
+class StatusDeltaEncoder:
+    def __init__(self, keyframe_sec=60.0):
+        self.keyframe_sec = keyframe_sec
+        self._lock = threading.Lock()
+        self._sent = {}  # clave de servidor -> _Sent
+        self.keyframes = 0
+        self.deltas = 0
+        self.skipped = 0
+
+    def encode(self, key, players, track, config, now=None):
+        """
+        Devuelve (event_type, data) a publicar para este servidor, o None si no hay
+        cambios. `players`: lista de dicts con steamId / name / carModel.
+        """
+        if now is None:
+            now = time.monotonic()
+        current = {p["steamId"]: p for p in players}
+        with self._lock:
+            last = self._sent.get(key)
+            keyframe = (
+                last is None
+                or last.track != track
+                or last.config != config
+                or now - last.keyframe_at >= self.keyframe_sec
+            )
+            if keyframe:
+                seq = last.seq + 1 if last else 0
+                self._sent[key] = _Sent(seq, current, track, config, now)
+                self.keyframes += 1
+                return "server_status", {
+                    "players": list(current.values()),
+                    "trackName": track,
+                    "trackConfig": config,
+                    "seq": seq,
+                    "keyframe": True,
+                }
+
+            previous = last.players
+            joined = [p for steam_id, p in current.items() if steam_id not in previous]
+            left = [steam_id for steam_id in previous if steam_id not in current]
+            changed = [
+                p for steam_id, p in current.items()
+                if steam_id in previous and previous[steam_id] != p
+            ]
+            if not (joined or left or changed):
+                self.skipped += 1
+                return None
+            base_seq = last.seq
+            last.seq += 1
+            last.players = current
+            self.deltas += 1
+            return "server_status_delta", {
+                "seq": last.seq,
+                "baseSeq": base_seq,
+                "joined": joined,
+                "left": left,
+                "changed": changed,
+                "trackName": track,
+                "trackConfig": config,
+            }
+
+    def forget(self, key):
+        """La siguiente publicación de `key` será un keyframe."""
+        with self._lock:
+            self._sent.pop(key, None)
+
+    def summary(self) -> str:
+        with self._lock:
+            total = self.keyframes + self.deltas + self.skipped
+            saved = 100.0 * self.skipped / total if total else 0.0
+            return (
+                f"server_status: keyframes={self.keyframes} deltas={self.deltas} "
+                f"sin cambios={self.skipped} ({saved:.0f}% de ciclos sin envío)"
+            )
@@ -0,0 +1,100 @@
+"""
+Circuit breaker para la conexión a Postgres (closed / open / half-open).
+
+Con la BD caída, cada get_connection() intentaba el pool y luego un
+psycopg2.connect con connect_timeout completo. CircuitBreaker corta eso:
+
+  closed     normal; `failure_threshold` fallos seguidos → open
+  open       allow() devuelve False sin tocar la red durante `reset_timeout` s
+  half-open  pasado ese tiempo se deja pasar UNA conexión de prueba: si va bien
+             → closed, si falla → open otra vez
+
+Solo la conexión de prueba (allow() devuelve PROBE) cierra el circuito: una
+conexión sacada antes de abrirse que termina bien no dice nada de la BD actual.
+
+Las transiciones se imprimen y se cuentan (summary()); db/database.py decide qué
+es éxito o fallo (ver _PooledConn/_DirectConn.close()).
+"""
+
+import threading
+import time
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+PROBE = "probe"
+
+
+class CircuitBreaker:
+    def __init__(self, name, failure_threshold=3, reset_timeout=10.0):
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self.state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_started = 0.0
+        self.changed_at = time.time()
+        self.opens = 0
+        self.rejected = 0
+        self.transitions = 0
+
+    def allow(self):
+        """¿Se puede intentar una conexión ahora? PROBE (verdadero) si es la de prueba."""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            now = time.monotonic()
+            if self.state == OPEN:
+                if now - self._opened_at < self.reset_timeout:
+                    self.rejected += 1
+                    return False
+                self._transition(HALF_OPEN)
+                self._probe_started = now
+                return PROBE
+            # half-open: una sola prueba en vuelo (otra si la anterior no terminó nunca)
+            if now - self._probe_started >= self.reset_timeout:
+                self._probe_started = now
+                return PROBE
+            self.rejected += 1
+            return False
+
+    def record_success(self, probe=False):
+        with self._lock:
+            if self.state == CLOSED:
+                self._failures = 0
+            elif probe:
+                self._failures = 0
+                self._transition(CLOSED)
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self.state == HALF_OPEN or (self.state == CLOSED and self._failures >= self.failure_threshold):
+                self._opened_at = time.monotonic()
+                self.opens += 1
+                self._transition(OPEN)
+
+    def _transition(self, state):
+        previous, self.state = self.state, state
+        self.changed_at = time.time()
+        self.transitions += 1
+        if state == OPEN:
+            print(f"🔌 [{self.name}] Circuit {previous} → open: sin conexiones durante {self.reset_timeout:.0f}s (modo degradado)")
+        elif state == HALF_OPEN:
+            print(f"🔌 [{self.name}] Circuit open → half-open: probando la conexión")
+        else:
+            print(f"✅ [{self.name}] Circuit {previous} → closed: BD disponible")
+
+    @property
+    def is_open(self) -> bool:
+        return self.state != CLOSED
+
+    def summary(self) -> str:
+        with self._lock:
+            since = time.time() - self.changed_at
+            return (
+                f"{self.name} breaker: {self.state} ({since:.0f}s) aperturas={self.opens} "
+                f"rechazadas={self.rejected} transiciones={self.transitions}"
+            )
@@ -0,0 +1,124 @@
+"""
+Instantánea del plano de control de esta instancia (ac_server_control + server_events).
+
+En lugar de una consulta por nombre de servidor cada vez que expira un cache de 3 s,
+load_control_plane() trae en bloque todas las filas de ac_server_control del
+AC_INSTANCE_ID y todos los server_events 'started' (con los SQL ya montados por
+db/schema.py), y construye un
+ControlPlaneSnapshot inmutable. db/database.py lo refresca en segundo plano y lo
+sustituye con una sola asignación (swap atómico); las lecturas no tocan la red.
+
+Las reglas replican las consultas por nombre de db/database.py:
+  - activo: power_state exacto 'running' y server_name exacto
+  - modo:   power_state en running/started/online, nombre sin espacios/mayúsculas,
+            fila más reciente según updated_at/created_at/id
+  - evento: server_name exacto, event_status 'started', el de mayor id
+"""
+
+import json
+import time
+from typing import Optional
+
+RUNNING_STATES = ("running", "started", "online")
+SERVER_MODES = {"battle", "event", "time-attack"}
+
+
+def normalize_server_mode(raw) -> str:
+    mode = (raw or "").strip().lower().replace("_", "-")
+    return mode if mode in SERVER_MODES else "time-attack"
+
+
+def control_mode_column(columns) -> Optional[str]:
+    if "server_type" in columns:
+        return "server_type"
+    if "event_type" in columns:
+        return "event_type"
+    return None
+
+
+def control_order_clause(columns, fallback) -> str:
+    order_terms = []
+    if "updated_at" in columns:
+        order_terms.append("updated_at DESC NULLS LAST")
+    if "created_at" in columns:
+        order_terms.append("created_at DESC NULLS LAST")
+    if "id" in columns:
+        order_terms.append("id DESC")
+    if not order_terms:
+        # No reliable ordering columns in schema; still return first matching row.
+        order_terms.append(fallback)
+    return ", ".join(order_terms)
+
+
+def event_from_row(row) -> dict:
+    meta = row["metadata"] if row["metadata"] else {}
+    if isinstance(meta, str):
+        try:
+            meta = json.loads(meta)
+        except json.JSONDecodeError:
+            meta = {}
+    return {
+        "webhook_url": row["webhook_url"],
+        "event_type": row["event_type"],
+        "metadata": meta,
+    }
+
+
+class ControlPlaneSnapshot:
+    """Vista en memoria, de solo lectura, del plano de control de una instancia."""
+
+    __slots__ = ("loaded_at", "has_control_table", "events_isolated", "_active", "_modes", "_events")
+
+    def __init__(self, has_control_table, events_isolated, active, modes, events):
+        self.loaded_at = time.time()
+        self.has_control_table = has_control_table
+        # False si hay AC_INSTANCE_ID pero server_events no tiene instance_id (fail-closed).
+        self.events_isolated = events_isolated
+        self._active = active    # {server_name exacto}
+        self._modes = modes      # {lower(strip(server_name)): modo}
+        self._events = events    # {server_name exacto: [evento, ...] por id DESC}
+
+    def is_server_active(self, server_name) -> bool:
+        return server_name in self._active
+
+    def server_mode(self, server_name) -> str:
+        return self._modes.get((server_name or "").strip(" ").lower(), "time-attack")
+
+    def active_event(self, server_name, event_type=None) -> Optional[dict]:
+        for event in self._events.get(server_name, ()):
+            if event_type is None or event["event_type"] == event_type:
+                return event
+        return None
+
+    def summary(self) -> str:
+        n_events = sum(len(v) for v in self._events.values())
+        return f"{len(self._active)} server(s) activos, {len(self._modes)} con modo, {n_events} evento(s) started"
+
+
+def load_control_plane(cursor, schema) -> ControlPlaneSnapshot:
+    """
+    Carga la instantánea completa con un RealDictCursor. Los SQL vienen ya montados
+    en `schema` (db/schema.SchemaCapabilities): como mucho 2 consultas, sin catálogo.
+    """
+    active = set()
+    modes = {}
+    if schema.control_plane_sql:
+        cursor.execute(schema.control_plane_sql, (schema.instance_id,))
+        for row in cursor.fetchall() or []:
+            name = row["server_name"] or ""
+            power_state = row["power_state"] if row["power_state"] is not None else "stopped"
+            if power_state == "running":
+                active.add(name)
+            key = name.strip(" ").lower()
+            if key not in modes and power_state.lower() in RUNNING_STATES:
+                modes[key] = normalize_server_mode(row["mode"])
+
+    events = {}
+    if schema.started_events_sql:
+        cursor.execute(schema.started_events_sql, schema.instance_params())
+        for row in cursor.fetchall() or []:
+            events.setdefault(row["server_name"], []).append(event_from_row(row))
+
+    return ControlPlaneSnapshot(
+        schema.has_table("ac_server_control"), schema.events_isolated, active, modes, events
+    )
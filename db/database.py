@@ -1,14 +1,34 @@
-import json
 import os
+import threading
 import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
 from typing import Optional
 from urllib.parse import urlparse, parse_qs, urlencode, urlunparse
+from uuid import uuid4
 
 import psycopg2
 from dotenv import load_dotenv
 from psycopg2 import pool
-from psycopg2.extras import Json, RealDictCursor
+from psycopg2.extras import Json, RealDictCursor, execute_values
+
+from db.control_plane import (
+    ControlPlaneSnapshot,
+    event_from_row,
+    load_control_plane,
+    normalize_server_mode,
+)
+from db.circuit_breaker import PROBE, CircuitBreaker
+from db.driver_cache import DriverIdentityCache
+from db.lap_history import LAP_HISTORY_INDEX_SQL, LAP_HISTORY_TABLE_SQL, LapHistoryBuffer
+from db.pb_index import PersonalBestIndex
+from db.prepared import PreparedConnection, StatementRegistry
+from db.outbox import SQLiteOutbox
+from db.notify_listener import CONTROL_PLANE_CHANNEL, NotifyListener, install_control_plane_triggers
+from db.schema import SchemaCapabilities, probe_schema
+from db.ttl_cache import TTLCache
+from db.write_behind import PendingId, WriteBehindQueue
 
 load_dotenv()
 
@@ -78,22 +98,60 @@ if DATABASE_URL:
 else:
     print("❌ DATABASE_URL o SUPABASE_DB_URL no está definido en el entorno.")
 
+# PREPARE/EXECUTE para las consultas calientes. "auto": desactivado contra el pooler
+# en modo transacción (6543), donde la sesión cambia en cada transacción.
+DB_PREPARED_STATEMENTS = os.getenv("DB_PREPARED_STATEMENTS", "auto").strip().lower()
+if DB_PREPARED_STATEMENTS == "auto":
+    _prepared_enabled = bool(DATABASE_URL) and urlparse(DATABASE_URL).port != 6543
+else:
+    _prepared_enabled = DB_PREPARED_STATEMENTS in ("1", "true", "yes", "on")
+
+_statements = StatementRegistry(enabled=_prepared_enabled)
+
 db_pool = None
 try:
     if DATABASE_URL:
-        db_pool = pool.ThreadedConnectionPool(1, 10, DATABASE_URL)
+        db_pool = pool.ThreadedConnectionPool(1, 10, DATABASE_URL, connection_factory=PreparedConnection)
 except Exception as err:
     print(f"[DB] Error al crear el pool de conexiones: {err}")
     db_pool = None
 
+# Con la BD caída, get_connection() falla al instante en vez de esperar connect_timeout.
+DB_BREAKER_FAILURES = int(os.getenv("DB_BREAKER_FAILURES", "3"))
+DB_BREAKER_RESET_SEC = float(os.getenv("DB_BREAKER_RESET_SEC", "10"))
+
+_db_breaker = CircuitBreaker("db", DB_BREAKER_FAILURES, DB_BREAKER_RESET_SEC)
+
+
+class DatabaseUnavailable(psycopg2.OperationalError):
+    """get_connection() con el circuit breaker abierto: ni siquiera se intenta conectar."""
+
+
+def _report_connection_health(raw, probe):
+    # psycopg2 marca `closed` != 0 cuando la conexión se rompió durante su uso.
+    # Con el breaker abierto/half-open solo cuenta el éxito de la conexión de prueba.
+    if raw.closed:
+        _db_breaker.record_failure()
+    else:
+        _db_breaker.record_success(probe)
+
+
+def db_breaker_stats() -> str:
+    return _db_breaker.summary()
+
+
+def prepared_statement_stats() -> str:
+    return _statements.summary()
+
 
 class _PooledConn:
     """Devuelve la conexión al pool al llamar a close() (comportamiento tipo mysql-connector)."""
 
-    __slots__ = ("_raw",)
+    __slots__ = ("_raw", "_probe")
 
-    def __init__(self, raw):
+    def __init__(self, raw, probe=False):
         self._raw = raw
+        self._probe = probe
 
     def __getattr__(self, name):
         return getattr(self._raw, name)
@@ -104,6 +162,7 @@ class _PooledConn:
             return
         raw = self._raw
         self._raw = None
+        _report_connection_health(raw, self._probe)
         try:
             db_pool.putconn(raw)
         except Exception:
@@ -119,16 +178,18 @@ class _PooledConn:
 class _DirectConn:
     """Conexión fuera del pool (fallback si getconn falla o no hay pool)."""
 
-    __slots__ = ("_raw",)
+    __slots__ = ("_raw", "_probe")
 
-    def __init__(self, raw):
+    def __init__(self, raw, probe=False):
         self._raw = raw
+        self._probe = probe
 
     def __getattr__(self, name):
         return getattr(self._raw, name)
 
     def close(self):
         if self._raw:
+            _report_connection_health(self._raw, self._probe)
             try:
                 self._raw.close()
             except Exception:
@@ -139,73 +200,112 @@ class _DirectConn:
 def get_connection():
     if not DATABASE_URL:
         raise RuntimeError("DATABASE_URL / SUPABASE_DB_URL no configurado")
+    allowed = _db_breaker.allow()
+    if not allowed:
+        raise DatabaseUnavailable("circuit breaker abierto: BD no disponible")
+    probe = allowed == PROBE
     if db_pool:
         try:
-            return _PooledConn(db_pool.getconn())
+            return _PooledConn(db_pool.getconn(), probe)
         except Exception as e:
             print(f"[DB] pool getconn failed ({e}); using direct connection")
-    return _DirectConn(psycopg2.connect(DATABASE_URL))
+    try:
+        return _DirectConn(psycopg2.connect(DATABASE_URL, connection_factory=PreparedConnection), probe)
+    except Exception:
+        _db_breaker.record_failure()
+        raise
 
 
-# Cache: si `id` es IDENTITY en Supabase, hace falta OVERRIDING SYSTEM VALUE al insertar un id explícito.
-_lap_id_is_identity: Optional[bool] = None
-_table_has_instance_id_cache = {}
+# Capacidades del esquema: se sondean una vez en init_db() (ver db/schema.py).
+_schema: Optional[SchemaCapabilities] = None
 
 
-def _lap_id_needs_overriding(cursor) -> bool:
-    global _lap_id_is_identity
-    if _lap_id_is_identity is not None:
-        return _lap_id_is_identity
+def refresh_schema() -> Optional[SchemaCapabilities]:
+    """
+    Vuelve a sondear information_schema (una consulta) y publica las capacidades
+    nuevas. Llamar tras cambios de esquema; si falla se conservan las anteriores.
+    """
+    global _schema
+    conn = None
+    cursor = None
     try:
-        cursor.execute(
-            """
-            SELECT COALESCE(
-                (SELECT c.is_identity = 'YES'
-                 FROM information_schema.columns c
-                 WHERE c.table_schema = 'public'
-                   AND c.table_name = 'lap_records'
-                   AND c.column_name = 'id'),
-                false
-            )
-            """
-        )
-        row = cursor.fetchone()
-        _lap_id_is_identity = bool(row and row[0])
-    except Exception:
-        _lap_id_is_identity = False
-    return _lap_id_is_identity
+        conn = get_connection()
+        cursor = conn.cursor()
+        _schema = probe_schema(cursor, AC_INSTANCE_ID)
+    except Exception as e:
+        if not isinstance(e, DatabaseUnavailable):
+            print(f"⚠️ Schema probe error: {e}")
+    finally:
+        if cursor:
+            cursor.close()
+        if conn:
+            conn.close()
+    return _schema
+
+
+class SchemaUnavailable(RuntimeError):
+    """get_schema() sin poder sondear el esquema (BD inaccesible): se reintenta."""
+
+
+def get_schema() -> SchemaCapabilities:
+    schema = _schema
+    if schema is None:
+        # Sin init_db() (scripts, reconexión fallida): sondeo perezoso.
+        schema = refresh_schema()
+        if schema is None:
+            raise SchemaUnavailable("capacidades del esquema no disponibles")
+    return schema
 
 
 def _next_lap_record_id(cursor) -> int:
-    """Drizzle define `id` sin SERIAL: generamos el siguiente entero (misma idea que AUTO_INCREMENT)."""
+    """
+    Fallback si lap_records.id no tiene secuencia (ver _ensure_lap_id_sequence): Drizzle
+    define `id` sin SERIAL y generamos el siguiente entero (misma idea que AUTO_INCREMENT).
+    """
     cursor.execute("SELECT COALESCE(MAX(id), 0) FROM lap_records")
     row = cursor.fetchone()
     return int(row[0]) + 1
 
 
-def _table_has_instance_id(cursor, table_name: str) -> bool:
-    cached = _table_has_instance_id_cache.get(table_name)
-    if cached is not None:
-        return cached
+LAP_ID_SEQUENCE = "lap_records_id_seq"
+LAP_ID_USE_SEQUENCE = os.getenv("LAP_ID_USE_SEQUENCE", "true").lower() == "true"
+
+
+def _ensure_lap_id_sequence(cursor):
+    """
+    lap_records.id lo asigna la BD, sin MAX(id)+1 por vuelta y sin carreras entre
+    procesos. IDENTITY o SERIAL ya tienen secuencia; el esquema de Drizzle (integer
+    sin default) recibe una propia (OWNED BY) como DEFAULT. Si la secuencia va por
+    detrás de MAX(id) (filas con id explícito: migración desde MySQL, versiones
+    anteriores con MAX(id)+1) se adelanta; si no, no se toca.
+
+    Todo va en una transacción con lap_records bloqueada en SHARE ROW EXCLUSIVE
+    (excluye INSERTs y otro init_db a la vez): entre leer MAX(id) y el setval nadie
+    puede pedir un id, así que un arranque nunca rebobina la secuencia de la flota.
+    """
+    cursor.execute("BEGIN")  # init_db usa autocommit
     try:
+        cursor.execute("LOCK TABLE lap_records IN SHARE ROW EXCLUSIVE MODE")
+        cursor.execute("SELECT pg_get_serial_sequence('lap_records', 'id')")
+        row = cursor.fetchone()
+        seq = row[0] if row else None
+        if not seq:
+            cursor.execute(f"CREATE SEQUENCE IF NOT EXISTS {LAP_ID_SEQUENCE} OWNED BY lap_records.id")
+            cursor.execute(f"ALTER TABLE lap_records ALTER COLUMN id SET DEFAULT nextval('{LAP_ID_SEQUENCE}')")
+            seq = LAP_ID_SEQUENCE
         cursor.execute(
-            """
-            SELECT EXISTS (
-                SELECT 1
-                FROM information_schema.columns
-                WHERE table_schema = 'public'
-                  AND table_name = %s
-                  AND column_name = 'instance_id'
-            )
-            """,
-            (table_name,),
+            "SELECT COALESCE(MAX(id), 0), pg_sequence_last_value(%s::regclass) FROM lap_records",
+            (seq,),
         )
-        row = cursor.fetchone()
-        has_col = bool(row and row[0])
+        max_id, last_value = cursor.fetchone()
+        # last_value es NULL si la secuencia aún no entregó ningún valor.
+        if max_id > (last_value or 0):
+            cursor.execute("SELECT setval(%s::regclass, %s)", (seq, max_id))
+        cursor.execute("COMMIT")
     except Exception:
-        has_col = False
-    _table_has_instance_id_cache[table_name] = has_col
-    return has_col
+        cursor.execute("ROLLBACK")
+        raise
+    return seq
 
 
 def _ensure_instance_id_column(table_name: str) -> bool:
@@ -222,8 +322,6 @@ def _ensure_instance_id_column(table_name: str) -> bool:
             f"ALTER TABLE IF EXISTS {table_name} ADD COLUMN IF NOT EXISTS instance_id TEXT"
         )
         conn.commit()
-        _table_has_instance_id_cache.pop(table_name, None)
-        return _table_has_instance_id(cursor, table_name)
     except Exception:
         return False
     finally:
@@ -231,10 +329,34 @@ def _ensure_instance_id_column(table_name: str) -> bool:
             cursor.close()
         if conn:
             conn.close()
+    schema = refresh_schema()
+    return schema is not None and schema.has_column(table_name, "instance_id")
+
+
+def _prepare_touge_write_key(cursor):
+    """write_key + índice único para el ON CONFLICT de touge_battles; sin permisos DDL, se comprueba si ya existen."""
+    global _touge_write_key
+    try:
+        cursor.execute("ALTER TABLE touge_battles ADD COLUMN IF NOT EXISTS write_key TEXT")
+        cursor.execute(
+            "CREATE UNIQUE INDEX IF NOT EXISTS touge_battles_write_key_idx ON touge_battles (write_key)"
+        )
+        _touge_write_key = True
+    except Exception as e:
+        try:
+            cursor.execute(
+                "SELECT 1 FROM pg_indexes WHERE tablename = 'touge_battles' AND indexname = 'touge_battles_write_key_idx'"
+            )
+            _touge_write_key = cursor.fetchone() is not None
+        except Exception:
+            _touge_write_key = False
+        if not _touge_write_key:
+            print(f"⚠️ No se pudo añadir touge_battles.write_key ({e}); las batallas se insertarán sin clave de idempotencia.")
 
 
 def init_db():
     """Crea tablas si no existen. En Supabase no se crea la base (ya existe)."""
+    global _schema, _lap_history_available
     if not DATABASE_URL:
         print("❌ No se puede inicializar: falta DATABASE_URL o SUPABASE_DB_URL")
         return
@@ -336,168 +458,540 @@ def init_db():
         cursor.execute(
             "ALTER TABLE IF EXISTS server_battles ADD COLUMN IF NOT EXISTS instance_id TEXT"
         )
+        _prepare_touge_write_key(cursor)
+
+        # Historial completo de vueltas (append-only, se llena con COPY)
+        if LAP_HISTORY_ENABLED:
+            try:
+                cursor.execute(LAP_HISTORY_TABLE_SQL)
+                for index_sql in LAP_HISTORY_INDEX_SQL:
+                    cursor.execute(index_sql)
+            except Exception as e:
+                _lap_history_available = False
+                print(f"⚠️ No se pudo crear lap_history ({e}); el historial de vueltas queda desactivado.")
+
+        if DB_LISTEN_NOTIFY:
+            try:
+                install_control_plane_triggers(cursor)
+                print("✅ Triggers NOTIFY del plano de control instalados.")
+            except Exception as e:
+                print(f"⚠️ No se pudieron instalar los triggers NOTIFY ({e}); se usará polling.")
+
+        if LAP_ID_USE_SEQUENCE:
+            try:
+                seq = _ensure_lap_id_sequence(cursor)
+                print(f"✅ lap_records.id asignado por secuencia ({seq}).")
+            except Exception as e:
+                print(f"⚠️ No se pudo preparar la secuencia de lap_records.id ({e}); se usará MAX(id)+1.")
+
+        _schema = probe_schema(cursor, AC_INSTANCE_ID)
+
+        try:
+            loaded = _driver_identities.preload(cursor)
+            print(f"✅ Driver cache: {loaded} piloto(s) precargados.")
+        except Exception as e:
+            print(f"⚠️ No se pudo precargar la caché de pilotos ({e}); se irá llenando en caliente.")
 
         cursor.close()
         conn.close()
         print("✅ Esquema PostgreSQL comprobado/creado (Supabase).")
+        print(f"✅ Schema: {_schema.summary()}")
     except Exception as e:
         print(f"❌ Error inicializando la base de datos: {e}")
 
 
-def save_driver(steam_id, name, car_model):
-    try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        query = """
+# ──────────────────────────────────────────────
+# Escrituras: write-behind fuera del hilo listener (db/write_behind.py)
+# ──────────────────────────────────────────────
+WRITE_BEHIND_ENABLED = os.getenv("WRITE_BEHIND_ENABLED", "true").lower() == "true"
+WRITE_BEHIND_WORKERS = int(os.getenv("WRITE_BEHIND_WORKERS", "2"))
+WRITE_BEHIND_QUEUE_SIZE = int(os.getenv("WRITE_BEHIND_QUEUE_SIZE", "10000"))
+WRITE_BEHIND_BATCH_SIZE = int(os.getenv("WRITE_BEHIND_BATCH_SIZE", "200"))
+WRITE_BEHIND_LINGER_MS = float(os.getenv("WRITE_BEHIND_LINGER_MS", "50"))
+# >0: el listener espera hasta N segundos con la cola llena antes de descartar.
+WRITE_BEHIND_PUT_TIMEOUT_SEC = float(os.getenv("WRITE_BEHIND_PUT_TIMEOUT_SEC", "0"))
+WRITE_BEHIND_FLUSH_TIMEOUT_SEC = float(os.getenv("WRITE_BEHIND_FLUSH_TIMEOUT_SEC", "10"))
+# Outbox en disco: escrituras que no llegan a Postgres se guardan y se reenvían (db/outbox.py).
+DB_OUTBOX_ENABLED = os.getenv("DB_OUTBOX_ENABLED", "true").lower() == "true"
+DB_OUTBOX_PATH = os.getenv(
+    "DB_OUTBOX_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "db_outbox.sqlite3"),
+)
+# Reintentos de una fila con la BD accesible antes de pasarla a cuarentena (outbox_dead).
+DB_OUTBOX_MAX_ATTEMPTS = int(os.getenv("DB_OUTBOX_MAX_ATTEMPTS", "10"))
+
+DRIVER_CACHE_MAX_ENTRIES = int(os.getenv("DRIVER_CACHE_MAX_ENTRIES", "50000"))
+
+_driver_identities = DriverIdentityCache(DRIVER_CACHE_MAX_ENTRIES)
+
+# Solo se envían a la BD las vueltas que mejoran el PB conocido (db/pb_index.py).
+PB_INDEX_ENABLED = os.getenv("PB_INDEX_ENABLED", "true").lower() == "true"
+PB_WARM_MIN_INTERVAL_SEC = float(os.getenv("PB_WARM_MIN_INTERVAL_SEC", "60"))
+
+_personal_bests = PersonalBestIndex()
+
+# Cada vuelta (válida o no) a lap_history, en lotes con COPY (db/lap_history.py).
+LAP_HISTORY_ENABLED = os.getenv("LAP_HISTORY_ENABLED", "true").lower() == "true"
+LAP_HISTORY_FLUSH_SEC = float(os.getenv("LAP_HISTORY_FLUSH_SEC", "15"))
+LAP_HISTORY_BATCH_ROWS = int(os.getenv("LAP_HISTORY_BATCH_ROWS", "500"))
+LAP_HISTORY_MAX_BUFFER = int(os.getenv("LAP_HISTORY_MAX_BUFFER", "50000"))
+
+# init_db lo pone a False si no puede crear la tabla (p. ej. rol sin permisos DDL).
+_lap_history_available = True
+
+_lap_history = LapHistoryBuffer(
+    get_connection,
+    flush_sec=LAP_HISTORY_FLUSH_SEC,
+    batch_rows=LAP_HISTORY_BATCH_ROWS,
+    max_rows=LAP_HISTORY_MAX_BUFFER,
+)
+
+# Solo sin secuencia (lap_records.id = MAX(id)+1): todas las vueltas pasan por el
+# mismo worker para que dos lotes no calculen el mismo id a la vez.
+_LAP_PARTITION_KEY = "lap_records"
+
+_DRIVER_UPSERT_SQL = """
         INSERT INTO drivers (steam_id, name)
-        VALUES (%s, %s)
+        VALUES %s
         ON CONFLICT (steam_id) DO UPDATE SET
             name = EXCLUDED.name,
             updated_at = NOW()
         """
-        cursor.execute(query, (steam_id, name))
-        conn.commit()
-        cursor.close()
-        conn.close()
-    except Exception as e:
-        print(f"❌ Error saving driver: {e}")
 
+_TOUGE_START_SQL = """
+        INSERT INTO touge_battles (server_name, track, track_config, player1_steam_id, player2_steam_id, player1_car, player2_car, status)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, 'active')
+        RETURNING id
+        """
 
-def save_lap(steam_id, car_model, track, track_config, server_name, lap_time, valid, timestamp=None):
-    try:
-        conn = get_connection()
-        cursor = conn.cursor()
+_TOUGE_UPDATE_SQL = """
+        UPDATE touge_battles AS t
+        SET player1_score=v.p1_score, player2_score=v.p2_score, winner_steam_id=v.winner,
+            status=v.status, points_log=v.points_log, updated_at=NOW()
+        FROM (VALUES %s) AS v(id, p1_score, p2_score, winner, status, points_log)
+        WHERE t.id = v.id
+        """
+_TOUGE_UPDATE_TEMPLATE = "(%s::int, %s::int, %s::int, %s::varchar, %s::varchar, %s::jsonb)"
 
-        if timestamp is None:
-            timestamp = int(time.time() * 1000)
-
-        valid_int = 1 if valid else 0
-        new_id = _next_lap_record_id(cursor)
-        use_ov = _lap_id_needs_overriding(cursor)
-        between = "\n    OVERRIDING SYSTEM VALUE\n    " if use_ov else "\n    "
-        # Columna `date` en Drizzle es text; ISO evita null si la columna pasó a NOT NULL en algún deploy.
-        date_str = datetime.now(timezone.utc).isoformat()
-
-        query = f"""
-        INSERT INTO lap_records (
-            id, steam_id, car_model, track, track_config, server_name, lap_time, valid_lap, "timestamp", "date"
-        ){between}VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-        ON CONFLICT (steam_id, car_model, track, track_config) DO UPDATE SET
-            lap_time = CASE
-                WHEN EXCLUDED.lap_time < lap_records.lap_time THEN EXCLUDED.lap_time
-                ELSE lap_records.lap_time
-            END,
-            valid_lap = CASE
-                WHEN EXCLUDED.lap_time < lap_records.lap_time THEN EXCLUDED.valid_lap
-                ELSE lap_records.valid_lap
-            END,
-            "timestamp" = CASE
-                WHEN EXCLUDED.lap_time < lap_records.lap_time THEN EXCLUDED."timestamp"
-                ELSE lap_records."timestamp"
-            END,
-            server_name = EXCLUDED.server_name,
-            "date" = CASE
-                WHEN EXCLUDED.lap_time < lap_records.lap_time THEN EXCLUDED."date"
-                ELSE lap_records."date"
-            END
+# write_key: clave de idempotencia; reenviar el lote desde el outbox no duplica batallas.
+_TOUGE_INSERT_SQL = """
+        INSERT INTO touge_battles (server_name, track, track_config, player1_steam_id, player2_steam_id, winner_steam_id, player1_score, player2_score, write_key, status)
+        VALUES %s
+        ON CONFLICT (write_key) DO NOTHING
         """
-        cursor.execute(
-            query,
-            (
-                new_id,
-                steam_id,
-                car_model,
-                track,
-                track_config,
-                server_name,
-                lap_time,
-                valid_int,
-                timestamp,
-                date_str,
-            ),
-        )
-        conn.commit()
-        cursor.close()
-        conn.close()
-        print(f"💾 Lap saved for {steam_id}: {lap_time}ms (Valid: {valid}) - Route: {track_config}")
+_TOUGE_INSERT_TEMPLATE = "(%s, %s, %s, %s, %s, %s, %s, %s, %s, 'finished')"
+# Sin write_key (el rol no pudo crear la columna/índice): un reenvío puede duplicar.
+_TOUGE_INSERT_NO_KEY_SQL = """
+        INSERT INTO touge_battles (server_name, track, track_config, player1_steam_id, player2_steam_id, winner_steam_id, player1_score, player2_score, status)
+        VALUES %s
+        """
+_TOUGE_INSERT_NO_KEY_TEMPLATE = "(%s, %s, %s, %s, %s, %s, %s, %s, 'finished')"
+_touge_write_key = True
+
+
+def _write_drivers(cursor, rows):
+    # ON CONFLICT DO UPDATE no admite la misma fila dos veces en una sentencia.
+    latest = {}
+    for steam_id, name in rows:
+        latest[steam_id] = name
+    _statements.execute_values(cursor, "driver_upsert", _DRIVER_UPSERT_SQL, list(latest.items()))
+
+
+def _fail_drivers(rows):
+    for steam_id, name in rows:
+        _driver_identities.forget(steam_id, name)
+
+
+def _write_laps(cursor, laps):
+    # Misma clave repetida en el lote: se queda la mejor vuelta (como el CASE del
+    # upsert) con el server_name de la última.
+    merged = {}
+    for lap in laps:
+        key = lap[:4]
+        prev = merged.get(key)
+        best = lap if prev is None or lap[5] < prev[5] else prev
+        merged[key] = best[:4] + (lap[4],) + best[5:]
+    schema = get_schema()
+    if schema.lap_id_generated:
+        rows = list(merged.values())
+    else:
+        first_id = _next_lap_record_id(cursor)
+        rows = [(first_id + i, *lap) for i, lap in enumerate(merged.values())]
+    stored = _statements.execute_values(cursor, "lap_upsert", schema.lap_upsert_sql, rows, fetch=True)
+
+    def report():
+        # RETURNING trae el PB que quedó en la BD (puede ser de otra instancia).
+        for steam_id, car_model, track, track_config, lap_time in stored:
+            _personal_bests.confirm(steam_id, car_model, track, track_config or "", lap_time)
+        # Solo las filas que se escribieron (merged), no las vueltas que se fusionaron.
+        for steam_id, _car, _track, track_config, _server, lap_time, valid_int, _ts, _date in merged.values():
+            print(f"💾 Lap saved for {steam_id}: {lap_time}ms (Valid: {bool(valid_int)}) - Route: {track_config}")
+    return report
+
+
+def _fail_laps(laps):
+    for steam_id, car_model, track, track_config, _server, lap_time, _valid, _ts, _date in laps:
+        _personal_bests.forget(steam_id, car_model, track, track_config, lap_time)
+
+
+def _write_touge_starts(cursor, starts):
+    created = []
+    for ref, params in starts:
+        cursor.execute(_TOUGE_START_SQL, params)
+        row = cursor.fetchone()
+        created.append((ref, row[0] if row else None, params))
+
+    def resolve():
+        for ref, battle_id, (_server, track, _config, p1_guid, p2_guid, p1_car, p2_car) in created:
+            ref.resolve(battle_id)
+            print(f"💾 Battle #{battle_id} started: {p1_guid} ({p1_car}) vs {p2_guid} ({p2_car}) on {track}")
+    return resolve
+
+
+def _fail_touge_starts(starts):
+    for ref, _params in starts:
+        ref.resolve(None)
+
+
+def _write_touge_updates(cursor, updates):
+    latest = OrderedDict()
+    for battle_id, p1_score, p2_score, winner_guid, points_log in updates:
+        if isinstance(battle_id, PendingId):
+            # Mismo worker que el INSERT: si existe, ya está resuelto.
+            battle_id = battle_id.value
+        if battle_id is None:
+            # El INSERT de la batalla falló o se descartó: no hay fila que actualizar.
+            print(f"⚠️ Battle update skipped: battle id unknown (score {p1_score}-{p2_score}, winner {winner_guid})")
+            continue
+        status = "finished" if winner_guid else "active"
+        log_json = Json(points_log) if points_log is not None else None
+        latest[battle_id] = (battle_id, p1_score, p2_score, winner_guid, status, log_json)
+    if latest:
+        execute_values(cursor, _TOUGE_UPDATE_SQL, list(latest.values()), template=_TOUGE_UPDATE_TEMPLATE)
+
+    def report():
+        for battle_id, p1_score, p2_score, winner_guid, _status, _log in latest.values():
+            flag = f"🏆 Winner: {winner_guid}" if winner_guid else f"Score: {p1_score}-{p2_score}"
+            print(f"💾 Battle #{battle_id} updated — {flag}")
+    return report
+
+
+def _write_touge_battles(cursor, battles):
+    if _touge_write_key:
+        execute_values(cursor, _TOUGE_INSERT_SQL, battles, template=_TOUGE_INSERT_TEMPLATE)
+    else:
+        execute_values(cursor, _TOUGE_INSERT_NO_KEY_SQL, [b[:8] for b in battles], template=_TOUGE_INSERT_NO_KEY_TEMPLATE)
+
+    def report():
+        for _server, track, _config, _p1, _p2, winner_guid, p1_score, p2_score, _key in battles:
+            print(f"💾 Touge Battle saved: Winner {winner_guid} | [{p1_score}-{p2_score}] on {track}")
+    return report
+
+
+def _outbox_encode(value):
+    # touge_update puede llevar el PendingId del INSERT: se guarda el id ya resuelto.
+    if isinstance(value, PendingId):
+        return value.value
+    return str(value)
+
+
+# Solo estos se reintentan desde el outbox. Cualquier otra cosa (error de datos,
+# TypeError/KeyError de un escritor) se reintentaría para siempre y taparía lo demás.
+_TRANSIENT_DB_ERRORS = (
+    psycopg2.OperationalError,  # incluye DatabaseUnavailable (breaker abierto)
+    psycopg2.InterfaceError,
+    pool.PoolError,
+    psycopg2.errors.InvalidSqlStatementName,  # sentencia preparada perdida: se vuelve a preparar
+    SchemaUnavailable,
+)
+
+
+def _is_transient_db_error(exc) -> bool:
+    """Caída/red/pool/esquema sin sondear → reintentar desde el outbox; lo demás → no."""
+    return isinstance(exc, _TRANSIENT_DB_ERRORS)
+
+
+def _open_outbox():
+    if not DB_OUTBOX_ENABLED:
+        return None
+    try:
+        return SQLiteOutbox(DB_OUTBOX_PATH, encode_default=_outbox_encode)
     except Exception as e:
-        print(f"❌ Error saving lap: {e}")
+        print(f"⚠️ Outbox local no disponible ({DB_OUTBOX_PATH}: {e}); las escrituras fallidas se perderán.")
+        return None
 
 
-def start_touge_battle(server_name, track, track_config, p1_guid, p2_guid, p1_car="", p2_car=""):
-    """Insert a new battle when it becomes ACTIVE. Returns the new battle_id."""
+_writes = WriteBehindQueue(
+    "db-writes",
+    get_connection,
+    workers=WRITE_BEHIND_WORKERS,
+    max_queue=WRITE_BEHIND_QUEUE_SIZE,
+    batch_size=WRITE_BEHIND_BATCH_SIZE,
+    linger_sec=WRITE_BEHIND_LINGER_MS / 1000.0,
+    put_timeout=WRITE_BEHIND_PUT_TIMEOUT_SEC,
+    is_transient=_is_transient_db_error,
+    max_replay_attempts=DB_OUTBOX_MAX_ATTEMPTS,
+)
+# Orden de escritura dentro de un lote: pilotos antes que sus vueltas, INSERT de
+# batalla antes que sus UPDATE. touge_start no es durable: su PendingId no
+# sobrevive a un reinicio.
+_writes.register("driver", _write_drivers, on_failure=_fail_drivers, durable=True)
+_writes.register("lap", _write_laps, on_failure=_fail_laps, durable=True)
+_writes.register("touge_start", _write_touge_starts, on_failure=_fail_touge_starts)
+_writes.register("touge_update", _write_touge_updates, durable=True)
+_writes.register("touge_battle", _write_touge_battles, durable=True)
+
+
+def start_write_behind():
+    """Arranca los workers de escritura. Sin llamarlo, save_* escriben en línea."""
+    if WRITE_BEHIND_ENABLED and DATABASE_URL:
+        # El outbox se abre aquí y no al importar: los scripts no crean ficheros.
+        _writes.outbox = _open_outbox()
+        if _writes.outbox is not None and _writes.outbox.pending:
+            print(f"💾 Outbox: {_writes.outbox.pending} escritura(s) pendientes de un arranque anterior")
+        _writes.start()
+    if LAP_HISTORY_ENABLED and DATABASE_URL and _lap_history_available:
+        _lap_history.start()
+
+
+def offload_inline_writes():
+    """
+    Sin write-behind (WRITE_BEHIND_ENABLED=false), save_* escriben en el hilo que
+    las llama. En el runtime asyncio ese hilo es el loop de todos los servidores:
+    las escrituras pasan a un único hilo propio (mantiene el orden).
+    """
+    if _writes.running or _writes.inline_executor is not None:
+        return
+    _writes.inline_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-inline")
+
+
+def flush_writes(timeout=WRITE_BEHIND_FLUSH_TIMEOUT_SEC):
+    """Vuelca lo pendiente y para los workers (apagado)."""
+    _writes.stop(timeout)
+    _lap_history.stop()
+
+
+def write_behind_stats() -> str:
+    return (
+        f"{_writes.summary()} | {_driver_identities.summary()} | "
+        f"{_personal_bests.summary()} | {_lap_history.summary()} | {_db_breaker.summary()} | "
+        f"{_statements.summary()}"
+    )
+
+
+def record_lap_history(session_id, server_name, track, track_config, steam_id, driver_name, car_model,
+                       lap_number, lap_time, cuts, valid, fail_reason=None, server_mode=None, timestamp=None):
+    """Añade la vuelta al buffer de lap_history (no bloquea; se vuelca con COPY)."""
+    if not LAP_HISTORY_ENABLED or not DATABASE_URL or not _lap_history_available:
+        return
+    if timestamp is None:
+        timestamp = int(time.time() * 1000)
+    _lap_history.append((
+        timestamp, session_id, AC_INSTANCE_ID or None, server_name, track, track_config or "",
+        steam_id, driver_name, car_model, lap_number, lap_time, cuts, bool(valid), fail_reason or None, server_mode,
+    ))
+
+
+def warm_personal_bests(track, track_config):
+    """Precarga los PB de la pista con una consulta (llamar en segundo plano en NEW_SESSION)."""
+    if not PB_INDEX_ENABLED or not DATABASE_URL or not track:
+        return
+    track_config = track_config or ""
+    if not _personal_bests.needs_warm(track, track_config, PB_WARM_MIN_INTERVAL_SEC):
+        return
+    conn = None
+    cursor = None
     try:
         conn = get_connection()
         cursor = conn.cursor()
-        query = """
-        INSERT INTO touge_battles (server_name, track, track_config, player1_steam_id, player2_steam_id, player1_car, player2_car, status)
-        VALUES (%s, %s, %s, %s, %s, %s, %s, 'active')
-        RETURNING id
-        """
-        cursor.execute(query, (server_name, track, track_config, p1_guid, p2_guid, p1_car, p2_car))
-        row = cursor.fetchone()
-        battle_id = row[0] if row else None
-        conn.commit()
-        cursor.close()
-        conn.close()
-        print(f"💾 Battle #{battle_id} started: {p1_guid} ({p1_car}) vs {p2_guid} ({p2_car}) on {track}")
-        return battle_id
+        loaded = _personal_bests.warm(cursor, track, track_config)
+        print(f"🏁 PB index: {loaded} PB cargados para {track} ({track_config})")
     except Exception as e:
-        print(f"❌ Error starting Touge Battle: {e}")
-        return None
+        print(f"⚠️ PB index warm error ({track}/{track_config}): {e}")
+    finally:
+        if cursor:
+            cursor.close()
+        if conn:
+            conn.close()
+
+
+def save_driver(steam_id, name, car_model):
+    # CAR_INFO repite el mismo piloto cada 15 s: solo se escribe si es nuevo o cambió el nombre.
+    if not _driver_identities.should_write(steam_id, name):
+        return
+    if not _writes.submit("driver", steam_id, (steam_id, name)):
+        _driver_identities.forget(steam_id, name)
+
+
+def save_lap(steam_id, car_model, track, track_config, server_name, lap_time, valid, timestamp=None):
+    if timestamp is None:
+        timestamp = int(time.time() * 1000)
+    valid_int = 1 if valid else 0
+    track_config = track_config or ""
+    if PB_INDEX_ENABLED and valid and not _personal_bests.should_write(steam_id, car_model, track, track_config, lap_time):
+        return
+    # Columna `date` en Drizzle es text; ISO evita null si la columna pasó a NOT NULL en algún deploy.
+    date_str = datetime.now(timezone.utc).isoformat()
+    schema = _schema
+    key = (steam_id, car_model, track, track_config)
+    if schema is None or not schema.lap_id_generated:
+        key = _LAP_PARTITION_KEY
+    if not _writes.submit(
+        "lap",
+        key,
+        (steam_id, car_model, track, track_config, server_name, lap_time, valid_int, timestamp, date_str),
+    ):
+        _personal_bests.forget(steam_id, car_model, track, track_config, lap_time)
+
+
+def start_touge_battle(server_name, track, track_config, p1_guid, p2_guid, p1_car="", p2_car=""):
+    """
+    Insert a new battle when it becomes ACTIVE. Returns a PendingId: pass it as-is to
+    update_touge_score (writes stay ordered) or call .result() for the integer id.
+    """
+    ref = PendingId()
+    params = (server_name, track, track_config, p1_guid, p2_guid, p1_car, p2_car)
+    if not _writes.submit("touge_start", ref, (ref, params)):
+        ref.resolve(None)
+    return ref
 
 
 def update_touge_score(battle_id, p1_score, p2_score, winner_guid=None, points_log=None):
     """Update the live score for a battle. Call this after every point."""
     if battle_id is None:
         return
-    try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        status = "finished" if winner_guid else "active"
-        log_json = Json(points_log) if points_log is not None else None
-        query = """
-        UPDATE touge_battles
-        SET player1_score=%s, player2_score=%s, winner_steam_id=%s, status=%s, points_log=%s, updated_at=NOW()
-        WHERE id=%s
-        """
-        cursor.execute(query, (p1_score, p2_score, winner_guid, status, log_json, battle_id))
-        conn.commit()
-        cursor.close()
-        conn.close()
-        flag = f"🏆 Winner: {winner_guid}" if winner_guid else f"Score: {p1_score}-{p2_score}"
-        print(f"💾 Battle #{battle_id} updated — {flag}")
-    except Exception as e:
-        print(f"❌ Error updating Touge Battle score: {e}")
+    _writes.submit("touge_update", battle_id, (battle_id, p1_score, p2_score, winner_guid, points_log))
 
 
 def save_touge_battle(server_name, track, track_config, p1_guid, p2_guid, winner_guid, p1_score, p2_score):
     """Legacy: save a complete battle at the end (used if no battle_id was set)."""
+    _writes.submit(
+        "touge_battle",
+        (server_name, p1_guid, p2_guid),
+        (server_name, track, track_config, p1_guid, p2_guid, winner_guid, p1_score, p2_score, uuid4().hex),
+    )
+
+
+# ──────────────────────────────────────────────
+# Plano de control: instantánea en memoria con refresco en segundo plano
+# ──────────────────────────────────────────────
+# Mientras haya una instantánea cargada, is_server_active_for_instance,
+# get_server_mode_for_instance y get_active_server_event se sirven desde memoria.
+# Si nunca se pudo cargar (BD caída al arrancar) se usan las consultas por nombre.
+CONTROL_PLANE_REFRESH_SEC = float(os.getenv("CONTROL_PLANE_REFRESH_SEC", "3"))
+# Con LISTEN/NOTIFY activo los cambios llegan por push: el polling queda como red de seguridad.
+DB_LISTEN_NOTIFY = os.getenv("DB_LISTEN_NOTIFY", "false").lower() == "true"
+CONTROL_PLANE_LISTEN_REFRESH_SEC = float(os.getenv("CONTROL_PLANE_LISTEN_REFRESH_SEC", "300"))
+# LISTEN necesita una sesión: el pooler en modo transacción (6543) no sirve.
+DATABASE_LISTEN_URL = _normalize_database_url(os.getenv("DATABASE_LISTEN_URL", "")) or DATABASE_URL
+
+_control_plane: Optional[ControlPlaneSnapshot] = None
+_control_plane_thread = None
+_control_plane_failing = False
+_control_plane_wake = threading.Event()
+_control_plane_listener: Optional[NotifyListener] = None
+
+
+def refresh_control_plane() -> bool:
+    """Recarga la instantánea completa y la publica con un swap atómico."""
+    global _control_plane, _control_plane_failing
+    if not DATABASE_URL or not AC_INSTANCE_ID:
+        return False
+    conn = None
+    cursor = None
     try:
+        schema = get_schema()
         conn = get_connection()
-        cursor = conn.cursor()
-        query = """
-        INSERT INTO touge_battles (server_name, track, track_config, player1_steam_id, player2_steam_id, winner_steam_id, player1_score, player2_score, status)
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, 'finished')
-        """
-        cursor.execute(
-            query,
-            (server_name, track, track_config, p1_guid, p2_guid, winner_guid, p1_score, p2_score),
-        )
-        conn.commit()
-        cursor.close()
-        conn.close()
-        print(f"💾 Touge Battle saved: Winner {winner_guid} | [{p1_score}-{p2_score}] on {track}")
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        snapshot = load_control_plane(cursor, schema)
     except Exception as e:
-        print(f"❌ Error saving Touge Battle: {e}")
+        if not _control_plane_failing:
+            print(f"⚠️ Control-plane refresh error (se mantiene la última instantánea): {e}")
+            _control_plane_failing = True
+        return False
+    finally:
+        if cursor:
+            cursor.close()
+        if conn:
+            conn.close()
+
+    if not snapshot.events_isolated:
+        # Self-heal como en get_active_server_event; hasta entonces, eventos fail-closed.
+        _ensure_instance_id_column("server_events")
+    if _control_plane is None or _control_plane_failing:
+        print(f"✅ Control-plane snapshot: {snapshot.summary()}")
+    _control_plane = snapshot
+    _control_plane_failing = False
+    return True
+
+
+def invalidate_control_plane():
+    """Descarta los caches por nombre y pide una recarga inmediata de la instantánea."""
+    _event_cache.clear()
+    _server_active_cache.clear()
+    _server_mode_cache.clear()
+    _control_plane_wake.set()
+
+
+def control_plane_listening() -> bool:
+    return _control_plane_listener is not None and _control_plane_listener.connected
+
+
+def _control_plane_loop(interval):
+    while True:
+        timeout = CONTROL_PLANE_LISTEN_REFRESH_SEC if control_plane_listening() else interval
+        _control_plane_wake.wait(timeout)
+        _control_plane_wake.clear()
+        refresh_control_plane()
+
+
+def _start_control_plane_listener():
+    global _control_plane_listener
+    listen_port = urlparse(DATABASE_LISTEN_URL).port
+    if listen_port == 6543 and not os.getenv("DATABASE_LISTEN_URL"):
+        print("⚠️ DB_LISTEN_NOTIFY: el pooler 6543 (modo transacción) no soporta LISTEN; "
+              "define DATABASE_LISTEN_URL (puerto 5432). Se usa polling.")
+        return
+    _control_plane_listener = NotifyListener(
+        DATABASE_LISTEN_URL,
+        CONTROL_PLANE_CHANNEL,
+        on_notify=invalidate_control_plane,
+        # Al caer el LISTEN se despierta el loop para volver al intervalo corto.
+        on_state=lambda connected: _control_plane_wake.set(),
+    )
+    _control_plane_listener.start()
+
+
+def start_control_plane_refresher(interval=CONTROL_PLANE_REFRESH_SEC):
+    """
+    Primera carga síncrona y refresco periódico en un hilo daemon (idempotente).
+    Con DB_LISTEN_NOTIFY=true además se escucha el canal NOTIFY y el intervalo de
+    polling pasa a CONTROL_PLANE_LISTEN_REFRESH_SEC mientras la suscripción esté viva.
+    """
+    global _control_plane_thread
+    if _control_plane_thread is not None:
+        return
+    refresh_control_plane()
+    _control_plane_thread = threading.Thread(target=_control_plane_loop, args=(interval,), daemon=True)
+    _control_plane_thread.start()
+    if DB_LISTEN_NOTIFY and DATABASE_URL and AC_INSTANCE_ID:
+        _start_control_plane_listener()
+
 
+LOOKUP_CACHE_TTL_SEC = float(os.getenv("LOOKUP_CACHE_TTL_SEC", "3"))
+LOOKUP_CACHE_MAX_ENTRIES = int(os.getenv("LOOKUP_CACHE_MAX_ENTRIES", "1024"))
 
-_event_cache = {}
-_server_active_cache = {}
-_server_mode_cache = {}
+_event_cache = TTLCache("server_events", LOOKUP_CACHE_TTL_SEC, LOOKUP_CACHE_MAX_ENTRIES)
+_server_active_cache = TTLCache("instance_gate", LOOKUP_CACHE_TTL_SEC, LOOKUP_CACHE_MAX_ENTRIES)
+_server_mode_cache = TTLCache("server_mode", LOOKUP_CACHE_TTL_SEC, LOOKUP_CACHE_MAX_ENTRIES)
 _instance_gate_warned = False
 
 
+def lookup_cache_stats() -> str:
+    """Resumen de los caches de consultas por nombre (para logs periódicos)."""
+    return " | ".join(c.summary() for c in (_server_active_cache, _server_mode_cache, _event_cache))
+
+
 def is_server_active_for_instance(server_name: str) -> bool:
     """
     Verifica en ac_server_control que este server esté activo para ESTA instancia.
@@ -514,52 +1008,32 @@ def is_server_active_for_instance(server_name: str) -> bool:
             _instance_gate_warned = True
         return False
 
-    cache_key = f"{name}_{AC_INSTANCE_ID}"
-    now = time.time()
-    if cache_key in _server_active_cache:
-        val, ts = _server_active_cache[cache_key]
-        if now - ts < 3.0:
-            return val
+    snapshot = _control_plane
+    if snapshot is not None:
+        return snapshot.is_server_active(name)
 
+    try:
+        # BD caída: se sirve el último valor conocido (stale_on_error).
+        return _server_active_cache.get_or_load(
+            (name, AC_INSTANCE_ID), lambda: _fetch_server_active(name), stale_on_error=True
+        )
+    except Exception as e:
+        if not isinstance(e, DatabaseUnavailable):
+            print(f"⚠️ Instance gate error ({name}/{AC_INSTANCE_ID}): {e}")
+        return False
+
+
+def _fetch_server_active(name: str) -> bool:
     conn = None
     cursor = None
     try:
+        sql = get_schema().server_active_sql
+        if not sql:
+            return False
         conn = get_connection()
         cursor = conn.cursor()
-        cursor.execute(
-            """
-            SELECT EXISTS (
-                SELECT 1
-                FROM information_schema.tables
-                WHERE table_schema = 'public'
-                  AND table_name = 'ac_server_control'
-            )
-            """
-        )
-        has_table = bool(cursor.fetchone()[0])
-        if not has_table:
-            _server_active_cache[cache_key] = (False, now)
-            return False
-
-        cursor.execute(
-            """
-            SELECT EXISTS (
-                SELECT 1
-                FROM ac_server_control
-                WHERE instance_id = %s
-                  AND server_name = %s
-                  AND COALESCE(power_state, 'stopped') = 'running'
-            )
-            """,
-            (AC_INSTANCE_ID, name),
-        )
-        is_active = bool(cursor.fetchone()[0])
-        _server_active_cache[cache_key] = (is_active, now)
-        return is_active
-    except Exception as e:
-        print(f"⚠️ Instance gate error ({name}/{AC_INSTANCE_ID}): {e}")
-        _server_active_cache[cache_key] = (False, now)
-        return False
+        _statements.execute(cursor, "server_active", sql, (AC_INSTANCE_ID, name))
+        return bool(cursor.fetchone()[0])
     finally:
         if cursor:
             cursor.close()
@@ -580,88 +1054,34 @@ def get_server_mode_for_instance(server_name: str) -> Optional[str]:
     if not name or not AC_INSTANCE_ID:
         return "time-attack"
 
-    cache_key = f"{name}_{AC_INSTANCE_ID}"
-    now = time.time()
-    if cache_key in _server_mode_cache:
-        val, ts = _server_mode_cache[cache_key]
-        if now - ts < 3.0:
-            return val
+    snapshot = _control_plane
+    if snapshot is not None:
+        return snapshot.server_mode(name)
+
+    try:
+        return _server_mode_cache.get_or_load(
+            (name, AC_INSTANCE_ID), lambda: _fetch_server_mode(name), stale_on_error=True
+        )
+    except Exception as e:
+        if not isinstance(e, DatabaseUnavailable):
+            print(f"⚠️ Server mode lookup error ({name}/{AC_INSTANCE_ID}): {e}")
+        return "time-attack"
+
 
+def _fetch_server_mode(name: str) -> str:
     conn = None
     cursor = None
     try:
+        sql = get_schema().server_mode_sql
+        if not sql:
+            return "time-attack"
         conn = get_connection()
         cursor = conn.cursor()
-
-        cursor.execute(
-            """
-            SELECT EXISTS (
-                SELECT 1
-                FROM information_schema.tables
-                WHERE table_schema = 'public'
-                  AND table_name = 'ac_server_control'
-            )
-            """
-        )
-        if not bool(cursor.fetchone()[0]):
-            _server_mode_cache[cache_key] = ("time-attack", now)
-            return "time-attack"
-
-        cursor.execute(
-            """
-            SELECT column_name
-            FROM information_schema.columns
-            WHERE table_schema='public'
-              AND table_name='ac_server_control'
-            """
-        )
-        available_cols = {r[0] for r in cursor.fetchall() or []}
-        if "server_type" in available_cols:
-            mode_col = "server_type"
-        elif "event_type" in available_cols:
-            mode_col = "event_type"
-        else:
-            _server_mode_cache[cache_key] = ("time-attack", now)
-            return "time-attack"
-
-        order_terms = []
-        if "updated_at" in available_cols:
-            order_terms.append("updated_at DESC NULLS LAST")
-        if "created_at" in available_cols:
-            order_terms.append("created_at DESC NULLS LAST")
-        if "id" in available_cols:
-            order_terms.append("id DESC")
-        if not order_terms:
-            # No reliable ordering columns in schema; still return first matching row.
-            order_terms.append(mode_col)
-        order_clause = ", ".join(order_terms)
-
-        cursor.execute(
-            f"""
-            SELECT {mode_col}
-            FROM ac_server_control
-            WHERE instance_id = %s
-              AND lower(btrim(server_name)) = lower(btrim(%s))
-              AND lower(COALESCE(power_state, 'stopped')) IN ('running', 'started', 'online')
-            ORDER BY {order_clause}
-            LIMIT 1
-            """,
-            (AC_INSTANCE_ID, name),
-        )
+        _statements.execute(cursor, "server_mode", sql, (AC_INSTANCE_ID, name))
         row = cursor.fetchone()
         if not row:
-            _server_mode_cache[cache_key] = ("time-attack", now)
             return "time-attack"
-
-        mode = (row[0] or "").strip().lower().replace("_", "-")
-        if mode not in {"battle", "event", "time-attack"}:
-            mode = "time-attack"
-        _server_mode_cache[cache_key] = (mode, now)
-        return mode
-    except Exception as e:
-        print(f"⚠️ Server mode lookup error ({name}/{AC_INSTANCE_ID}): {e}")
-        _server_mode_cache[cache_key] = ("time-attack", now)
-        return "time-attack"
+        return normalize_server_mode(row[0])
     finally:
         if cursor:
             cursor.close()
@@ -673,18 +1093,43 @@ def get_active_server_event(server_name, event_type=None):
     """
     Retorna la configuración del webhook activo para el server dado. Si event_type es
     None, retorna cualquier evento activo del servidor (el más reciente).
-    Usa un cache corto de 3 segundos para no saturar la BD.
+    Se sirve desde la instantánea del plano de control; sin ella, usa un TTLCache
+    corto (una sola consulta en vuelo por servidor) para no saturar la BD.
     """
-    cache_key = f"{server_name}_{event_type}_{AC_INSTANCE_ID or '-'}"
-    now = time.time()
+    snapshot = _control_plane
+    if snapshot is not None:
+        if not is_server_active_for_instance(server_name):
+            return None
+        return snapshot.active_event(server_name, event_type)
+
+    try:
+        return _event_cache.get_or_load(
+            (server_name, event_type, AC_INSTANCE_ID),
+            lambda: _fetch_active_server_event(server_name, event_type),
+            stale_on_error=True,
+        )
+    except Exception as e:
+        # Los errores no se cachean: la siguiente llamada reintenta.
+        if not isinstance(e, DatabaseUnavailable):
+            print(f"❌ Error getting active server event: {e}")
+    return None
 
-    if cache_key in _event_cache:
-        cached_result, cached_time = _event_cache[cache_key]
-        if now - cached_time < 3.0:
-            return cached_result
 
+def _fetch_active_server_event(server_name, event_type):
     if not is_server_active_for_instance(server_name):
-        _event_cache[cache_key] = (None, now)
+        return None
+
+    schema = get_schema()
+    if not schema.events_isolated and _ensure_instance_id_column("server_events"):
+        schema = get_schema()
+    # Fail-closed silently: sin SQL (p. ej. sin aislamiento por instance_id) no hay eventos.
+    if event_type:
+        query = schema.active_event_by_type_sql
+        params = (server_name, event_type, *schema.instance_params())
+    else:
+        query = schema.active_event_sql
+        params = (server_name, *schema.instance_params())
+    if not query:
         return None
 
     conn = None
@@ -692,61 +1137,14 @@ def get_active_server_event(server_name, event_type=None):
     try:
         conn = get_connection()
         cursor = conn.cursor(cursor_factory=RealDictCursor)
-        has_instance_id = _table_has_instance_id(cursor, "server_events")
-        if AC_INSTANCE_ID and not has_instance_id:
-            has_instance_id = _ensure_instance_id_column("server_events")
-        if AC_INSTANCE_ID and not has_instance_id:
-            # Fail-closed silently: ignore events if instance_id isolation is unavailable.
-            _event_cache[cache_key] = (None, now)
-            return None
-        if AC_INSTANCE_ID and has_instance_id:
-            instance_clause = " AND instance_id = %s"
-            instance_params = (AC_INSTANCE_ID,)
-        else:
-            instance_clause = ""
-            instance_params = ()
-        if event_type:
-            query = f"""
-                SELECT webhook_url, event_type, metadata, event_status
-                FROM server_events
-                WHERE server_name = %s AND event_type = %s AND event_status = 'started'{instance_clause}
-                ORDER BY id DESC LIMIT 1
-            """
-            cursor.execute(query, (server_name, event_type, *instance_params))
-        else:
-            query = f"""
-                SELECT webhook_url, event_type, metadata, event_status
-                FROM server_events
-                WHERE server_name = %s AND event_status = 'started'{instance_clause}
-                ORDER BY id DESC LIMIT 1
-            """
-            cursor.execute(query, (server_name, *instance_params))
-
+        _statements.execute(cursor, "active_event_by_type" if event_type else "active_event", query, params)
         row = cursor.fetchone()
-        if row:
-            meta = row["metadata"] if row["metadata"] else {}
-            if isinstance(meta, str):
-                try:
-                    meta = json.loads(meta)
-                except json.JSONDecodeError:
-                    meta = {}
-            res = {
-                "webhook_url": row["webhook_url"],
-                "event_type": row["event_type"],
-                "metadata": meta,
-            }
-            _event_cache[cache_key] = (res, now)
-            return res
-        _event_cache[cache_key] = (None, now)
-        return None
-    except Exception as e:
-        print(f"❌ Error getting active server event: {e}")
+        return event_from_row(row) if row else None
     finally:
         if cursor:
             cursor.close()
         if conn:
             conn.close()
-    return None
 
 
 _battle_cache = {}
@@ -0,0 +1,71 @@
+"""
+Cache de identidades de piloto (steam_id → nombre) para no repetir upserts en `drivers`.
+
+save_driver() se llama en cada NEW_CONNECTION y en cada CAR_INFO, y
+server_status_loop pide CAR_INFO de los 32 slots cada 15 s: ~2 upserts/s por
+servidor que casi nunca cambian nada. DriverIdentityCache se precarga desde
+`drivers` al arrancar y solo deja pasar la escritura si el steam_id es nuevo o
+su nombre cambió. Acotado con LRU; `skipped` cuenta las escrituras evitadas.
+"""
+
+import threading
+from collections import OrderedDict
+
+
+class DriverIdentityCache:
+    def __init__(self, max_entries=50000):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._names = OrderedDict()  # steam_id -> name
+        self.preloaded = 0
+        self.written = 0
+        self.skipped = 0
+
+    def preload(self, cursor, limit=None):
+        """Carga los pilotos más recientes de `drivers` (cursor de tuplas)."""
+        limit = limit or self.max_entries
+        cursor.execute(
+            "SELECT steam_id, name FROM drivers ORDER BY updated_at DESC NULLS LAST LIMIT %s",
+            (limit,),
+        )
+        rows = cursor.fetchall() or []
+        with self._lock:
+            # Del más antiguo al más reciente: los recientes quedan al final del LRU.
+            for steam_id, name in reversed(rows):
+                self._names[steam_id] = name
+                self._names.move_to_end(steam_id)
+            self._trim()
+            self.preloaded = len(rows)
+        return len(rows)
+
+    def should_write(self, steam_id, name) -> bool:
+        """True si hay que hacer upsert; lo marca como conocido (forget() si falla)."""
+        with self._lock:
+            known = self._names.get(steam_id)
+            if known is not None and known == name:
+                self._names.move_to_end(steam_id)
+                self.skipped += 1
+                return False
+            self._names[steam_id] = name
+            self._names.move_to_end(steam_id)
+            self._trim()
+            self.written += 1
+            return True
+
+    def forget(self, steam_id, name=None):
+        """Olvida un piloto cuya escritura no llegó a la BD para reintentarla la próxima vez."""
+        with self._lock:
+            if name is None or self._names.get(steam_id) == name:
+                self._names.pop(steam_id, None)
+
+    def _trim(self):
+        while len(self._names) > self.max_entries:
+            self._names.popitem(last=False)
+
+    def summary(self) -> str:
+        with self._lock:
+            size = len(self._names)
+            written, skipped = self.written, self.skipped
+        total = written + skipped
+        pct = 100.0 * skipped / total if total else 0.0
+        return f"drivers cache: {size} pilotos, {skipped} upserts evitados / {total} ({pct:.1f}%)"
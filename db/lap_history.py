@@ -0,0 +1,177 @@
+"""
+Historial completo de vueltas (`lap_history`, solo inserciones) volcado con COPY.
+
+lap_records guarda una fila por piloto/coche/pista (el PB); para analizar
+consistencia, ritmo por sesión o trampas hace falta cada vuelta, válida o no.
+LapHistoryBuffer acumula las filas en memoria y un hilo propio las vuelca con
+`COPY lap_history (...) FROM STDIN` cada `flush_sec` o al llegar a `batch_rows`:
+una parrilla completa cuesta unas pocas sentencias por minuto.
+
+Si el COPY falla, las filas vuelven al buffer para el siguiente intento; por
+encima de `max_rows` se descartan las más antiguas (contadas en `dropped`).
+"""
+
+import atexit
+import io
+import threading
+import time
+from collections import deque
+
+LAP_HISTORY_COLUMNS = (
+    "lap_ts", "session_id", "instance_id", "server_name", "track", "track_config",
+    "steam_id", "driver_name", "car_model", "lap_number", "lap_time", "cuts",
+    "valid", "fail_reason", "server_mode",
+)
+
+LAP_HISTORY_TABLE_SQL = """
+        CREATE TABLE IF NOT EXISTS lap_history (
+            id BIGSERIAL PRIMARY KEY,
+            lap_ts BIGINT NOT NULL,
+            session_id TEXT,
+            instance_id TEXT,
+            server_name VARCHAR(255),
+            track VARCHAR(100),
+            track_config VARCHAR(255) DEFAULT '',
+            steam_id VARCHAR(50) NOT NULL,
+            driver_name VARCHAR(100),
+            car_model VARCHAR(100),
+            lap_number INTEGER,
+            lap_time INTEGER NOT NULL,
+            cuts INTEGER DEFAULT 0,
+            valid BOOLEAN NOT NULL,
+            fail_reason TEXT,
+            server_mode VARCHAR(20),
+            recorded_at TIMESTAMPTZ DEFAULT NOW()
+        )
+        """
+
+LAP_HISTORY_INDEX_SQL = (
+    "CREATE INDEX IF NOT EXISTS lap_history_driver_track_idx ON lap_history (steam_id, track, track_config)",
+    "CREATE INDEX IF NOT EXISTS lap_history_session_idx ON lap_history (session_id)",
+)
+
+_COPY_SQL = f"COPY lap_history ({', '.join(LAP_HISTORY_COLUMNS)}) FROM STDIN"
+
+_ESCAPES = str.maketrans({"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r"})
+
+
+def _copy_value(value):
+    if value is None:
+        return "\\N"
+    if value is True:
+        return "t"
+    if value is False:
+        return "f"
+    return str(value).translate(_ESCAPES)
+
+
+def copy_text(rows) -> str:
+    """Filas → formato text de COPY (tabuladores, \\N para NULL)."""
+    return "".join("\t".join(_copy_value(v) for v in row) + "\n" for row in rows)
+
+
+class LapHistoryBuffer:
+    def __init__(self, get_connection, flush_sec=15.0, batch_rows=500, max_rows=50000):
+        self.get_connection = get_connection
+        self.flush_sec = flush_sec
+        self.batch_rows = batch_rows
+        self.max_rows = max_rows
+        self._rows = deque()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = False
+        self._thread = None
+        self.appended = 0
+        self.written = 0
+        self.dropped = 0
+        self.copies = 0
+        self.failures = 0
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="lap-history", daemon=True)
+            self._thread.start()
+            atexit.register(self.stop)
+
+    def append(self, row):
+        """Encola una fila en el orden de LAP_HISTORY_COLUMNS (no bloquea)."""
+        with self._lock:
+            self._rows.append(row)
+            self.appended += 1
+            while len(self._rows) > self.max_rows:
+                self._rows.popleft()
+                self.dropped += 1
+            full = len(self._rows) >= self.batch_rows
+        if full:
+            self._wake.set()
+
+    def _run(self):
+        while not self._stopping:
+            self._wake.wait(self.flush_sec)
+            self._wake.clear()
+            self.flush()
+
+    def flush(self) -> bool:
+        """Vuelca todo lo acumulado con un COPY por lote de `batch_rows`."""
+        with self._flush_lock:
+            while True:
+                with self._lock:
+                    if not self._rows:
+                        return True
+                    n = min(len(self._rows), self.batch_rows)
+                    batch = [self._rows.popleft() for _ in range(n)]
+                if not self._copy(batch):
+                    with self._lock:
+                        # Se devuelven al frente para no perder el orden.
+                        self._rows.extendleft(reversed(batch))
+                        while len(self._rows) > self.max_rows:
+                            self._rows.popleft()
+                            self.dropped += 1
+                    return False
+
+    def _copy(self, batch) -> bool:
+        conn = None
+        cursor = None
+        try:
+            conn = self.get_connection()
+            cursor = conn.cursor()
+            cursor.copy_expert(_COPY_SQL, io.StringIO(copy_text(batch)))
+            conn.commit()
+        except Exception as e:
+            self.failures += 1
+            print(f"⚠️ [lap_history] COPY de {len(batch)} vuelta(s) fallido, se reintentará: {e}")
+            if conn:
+                try:
+                    conn.rollback()
+                except Exception:
+                    pass
+            return False
+        finally:
+            if cursor:
+                cursor.close()
+            if conn:
+                conn.close()
+        self.written += len(batch)
+        self.copies += 1
+        return True
+
+    def stop(self):
+        """Último volcado al apagar (idempotente)."""
+        if self._thread is None:
+            return
+        self._stopping = True
+        self._wake.set()
+        self._thread.join(5.0)
+        self._thread = None
+        if not self.flush():
+            print(f"⚠️ [lap_history] Parada con {len(self._rows)} vuelta(s) sin volcar")
+
+    def summary(self) -> str:
+        with self._lock:
+            pending = len(self._rows)
+        per_copy = self.written / self.copies if self.copies else 0.0
+        return (
+            f"lap_history: pendientes={pending} escritas={self.written} COPY={self.copies} "
+            f"({per_copy:.1f}/COPY) fallos={self.failures} descartadas={self.dropped}"
+        )
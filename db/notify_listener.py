@@ -0,0 +1,114 @@
+"""
+Suscriptor LISTEN/NOTIFY de Postgres para invalidar el plano de control al instante.
+
+init_db() instala triggers por sentencia en server_events y ac_server_control que
+hacen pg_notify(CONTROL_PLANE_CHANNEL, '{"table": ..., "op": ...}'). NotifyListener
+mantiene una conexión dedicada (autocommit, fuera del pool) con LISTEN y llama a
+on_notify() por cada ráfaga de notificaciones. Si la conexión cae se reintenta con
+backoff y on_state(False) avisa para volver al polling.
+
+Ojo: el pooler de Supabase en modo transacción (puerto 6543) no soporta LISTEN;
+usa DATABASE_LISTEN_URL con el puerto de sesión (5432) o la conexión directa.
+"""
+
+import select
+import threading
+import time
+
+import psycopg2
+
+CONTROL_PLANE_CHANNEL = "ac_control_plane"
+
+CONTROL_PLANE_NOTIFY_FUNCTION_SQL = f"""
+CREATE OR REPLACE FUNCTION ac_control_plane_notify() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('{CONTROL_PLANE_CHANNEL}', json_build_object('table', TG_TABLE_NAME, 'op', TG_OP)::text);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql
+"""
+
+_TRIGGER_SQL = """
+DO $$
+BEGIN
+    IF to_regclass('public.{table}') IS NOT NULL THEN
+        DROP TRIGGER IF EXISTS {table}_control_plane_notify ON public.{table};
+        CREATE TRIGGER {table}_control_plane_notify
+            AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON public.{table}
+            FOR EACH STATEMENT EXECUTE FUNCTION ac_control_plane_notify();
+    END IF;
+END
+$$
+"""
+
+CONTROL_PLANE_TABLES = ("server_events", "ac_server_control")
+
+
+def install_control_plane_triggers(cursor):
+    """Crea/reemplaza la función y los triggers (idempotente; tablas ausentes se omiten)."""
+    cursor.execute(CONTROL_PLANE_NOTIFY_FUNCTION_SQL)
+    for table in CONTROL_PLANE_TABLES:
+        cursor.execute(_TRIGGER_SQL.format(table=table))
+
+
+class NotifyListener:
+    """Hilo daemon con LISTEN sobre `channel`; reconecta con backoff exponencial."""
+
+    def __init__(self, dsn, channel, on_notify, on_state=None, keepalive_sec=60.0):
+        self.dsn = dsn
+        self.channel = channel
+        self.on_notify = on_notify
+        self.on_state = on_state
+        self.keepalive_sec = keepalive_sec
+        self.connected = False
+        self.notifications = 0
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def _set_state(self, connected):
+        if self.connected != connected:
+            self.connected = connected
+            if self.on_state:
+                self.on_state(connected)
+
+    def _run(self):
+        backoff = 1.0
+        while True:
+            conn = None
+            try:
+                conn = psycopg2.connect(self.dsn)
+                conn.autocommit = True
+                cursor = conn.cursor()
+                cursor.execute(f"LISTEN {self.channel}")
+                backoff = 1.0
+                self._set_state(True)
+                # Lo que cambió mientras no escuchábamos también debe verse.
+                self.on_notify()
+                while True:
+                    if select.select([conn], [], [], self.keepalive_sec) == ([], [], []):
+                        # Detecta conexiones muertas en silencio. Lo que llegue con este
+                        # round trip se atiende ya, sin esperar al siguiente wakeup.
+                        cursor.execute("SELECT 1")
+                    conn.poll()
+                    if conn.notifies:
+                        self.notifications += len(conn.notifies)
+                        conn.notifies.clear()
+                        self.on_notify()
+            except Exception as e:
+                if self.connected:
+                    print(f"⚠️ [LISTEN] {self.channel} desconectado ({e}); vuelta a polling")
+                else:
+                    print(f"⚠️ [LISTEN] No se pudo escuchar {self.channel}: {e}")
+                self._set_state(False)
+            finally:
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+            time.sleep(backoff)
+            backoff = min(backoff * 2, 60.0)
@@ -0,0 +1,134 @@
+"""
+Outbox local y durable (SQLite) para escrituras que no llegaron a Postgres.
+
+Cuando Supabase corta la conexión, las escrituras del write-behind
+(db/write_behind.py) fallaban y se perdían. Ahora, en lugar de descartarlas, el
+writer las guarda aquí: fallos, desbordes de cola y todo lo que llegue mientras
+haya atrasos (para no adelantar escrituras de la misma clave). Un hilo de replay
+las vuelve a pasar por los mismos escritores en lotes y borra cada fila solo tras
+el commit.
+
+Cada fila lleva su clave de idempotencia: los upserts (drivers, lap_records,
+touge_battles por id) ya lo son por su clave natural, y los INSERT de batalla
+usan `write_key` con ON CONFLICT DO NOTHING. Repetir un lote tras un corte entre
+el commit y el borrado no duplica nada.
+
+Las filas que Postgres nunca aceptará pasan a `outbox_dead` (quarantine()) con el
+error, para revisarlas a mano sin bloquear el replay.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+class SQLiteOutbox:
+    def __init__(self, path, encode_default=str):
+        self.path = path
+        self._encode_default = encode_default
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                kind TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                created_at REAL NOT NULL
+            )
+            """
+        )
+        self._db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS outbox_dead (
+                id INTEGER PRIMARY KEY,
+                kind TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                failed_at REAL NOT NULL,
+                error TEXT
+            )
+            """
+        )
+        self._pending = self._db.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+        self.dead = self._db.execute("SELECT COUNT(*) FROM outbox_dead").fetchone()[0]
+        self.stored = 0
+        self.replayed = 0
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def put_many(self, items):
+        """items: [(kind, payload), ...]; payload serializable a JSON (tuplas → listas)."""
+        now = time.time()
+        rows = [(kind, json.dumps(payload, default=self._encode_default), now) for kind, payload in items]
+        with self._lock:
+            self._db.executemany("INSERT INTO outbox (kind, payload, created_at) VALUES (?, ?, ?)", rows)
+            self._pending += len(rows)
+            self.stored += len(rows)
+
+    def peek(self, limit, exclude_kinds=()):
+        """Las `limit` filas más antiguas como [(id, kind, payload_tuple)], sin las de `exclude_kinds`."""
+        exclude_kinds = list(exclude_kinds)
+        where = f"WHERE kind NOT IN ({', '.join('?' * len(exclude_kinds))}) " if exclude_kinds else ""
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT id, kind, payload FROM outbox {where}ORDER BY id LIMIT ?", (*exclude_kinds, limit)
+            ).fetchall()
+        return [(row_id, kind, tuple(json.loads(payload))) for row_id, kind, payload in rows]
+
+    def delete(self, ids):
+        if not ids:
+            return
+        with self._lock:
+            self._db.executemany("DELETE FROM outbox WHERE id = ?", [(i,) for i in ids])
+            self._pending = max(0, self._pending - len(ids))
+            self.replayed += len(ids)
+
+    def quarantine(self, ids, error):
+        """Mueve las filas a outbox_dead (con el error) y las saca del replay."""
+        if not ids:
+            return
+        now = time.time()
+        with self._lock:
+            self._db.execute("BEGIN")
+            try:
+                for row_id in ids:
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO outbox_dead (id, kind, payload, created_at, failed_at, error) "
+                        "SELECT id, kind, payload, created_at, ?, ? FROM outbox WHERE id = ?",
+                        (now, error, row_id),
+                    )
+                    self._db.execute("DELETE FROM outbox WHERE id = ?", (row_id,))
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+            self._pending = max(0, self._pending - len(ids))
+            self.dead += len(ids)
+
+    def count_by_kind(self) -> dict:
+        with self._lock:
+            return dict(self._db.execute("SELECT kind, COUNT(*) FROM outbox GROUP BY kind").fetchall())
+
+    def oldest_age(self) -> float:
+        with self._lock:
+            row = self._db.execute("SELECT MIN(created_at) FROM outbox").fetchone()
+        return time.time() - row[0] if row and row[0] else 0.0
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def summary(self) -> str:
+        return (
+            f"outbox: pendientes={self._pending} (más antigua {self.oldest_age():.0f}s) "
+            f"guardadas={self.stored} reenviadas={self.replayed} cuarentena={self.dead}"
+        )
@@ -0,0 +1,81 @@
+"""
+Índice en memoria de mejores vueltas (PB) para no enviar upserts que no son PB.
+
+save_lap siempre mandaba INSERT … ON CONFLICT DO UPDATE y los CASE descartaban la
+vuelta si no mejoraba la guardada; en un time-attack con tráfico la mayoría no lo
+hace. PersonalBestIndex guarda el PB conocido por (steam_id, car_model) dentro de
+cada (track, track_config):
+
+  - warm() carga una pista completa con una consulta (NEW_SESSION, en segundo plano)
+  - should_write() solo deja pasar vueltas que mejoran el PB conocido (o sin PB)
+  - confirm() aplica el lap_time que devuelve el upsert (RETURNING): la BD manda.
+    Si otra instancia mejoró el PB entretanto, el índice se corrige con la primera
+    escritura; en el peor caso se envía una vuelta de más, nunca se pierde un PB.
+  - forget() deshace el PB provisional si la escritura falla
+
+Si se borran filas desde el panel, el índice se corrige en el siguiente warm().
+"""
+
+import threading
+import time
+
+
+class PersonalBestIndex:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tracks = {}     # (track, track_config) -> {(steam_id, car_model): lap_time}
+        self._warmed_at = {}  # (track, track_config) -> time.monotonic()
+        self.written = 0
+        self.skipped = 0
+
+    def needs_warm(self, track, track_config, min_interval) -> bool:
+        warmed_at = self._warmed_at.get((track, track_config))
+        return warmed_at is None or time.monotonic() - warmed_at >= min_interval
+
+    def warm(self, cursor, track, track_config) -> int:
+        """Sustituye los PB de la pista por los de la BD (cursor de tuplas)."""
+        cursor.execute(
+            """
+            SELECT steam_id, car_model, lap_time
+            FROM lap_records
+            WHERE track = %s AND COALESCE(track_config, '') = %s
+            """,
+            (track, track_config or ""),
+        )
+        table = {(steam_id, car_model): lap_time for steam_id, car_model, lap_time in cursor.fetchall() or []}
+        with self._lock:
+            self._tracks[(track, track_config)] = table
+            self._warmed_at[(track, track_config)] = time.monotonic()
+        return len(table)
+
+    def should_write(self, steam_id, car_model, track, track_config, lap_time) -> bool:
+        """True si la vuelta mejora el PB conocido; lo marca como PB provisional."""
+        with self._lock:
+            table = self._tracks.setdefault((track, track_config), {})
+            best = table.get((steam_id, car_model))
+            # Empate: el upsert usa `<` estricto y también lo descartaría.
+            if best is not None and lap_time >= best:
+                self.skipped += 1
+                return False
+            table[(steam_id, car_model)] = lap_time
+            self.written += 1
+            return True
+
+    def confirm(self, steam_id, car_model, track, track_config, lap_time):
+        with self._lock:
+            self._tracks.setdefault((track, track_config), {})[(steam_id, car_model)] = lap_time
+
+    def forget(self, steam_id, car_model, track, track_config, lap_time):
+        with self._lock:
+            table = self._tracks.get((track, track_config))
+            if table is not None and table.get((steam_id, car_model)) == lap_time:
+                del table[(steam_id, car_model)]
+
+    def summary(self) -> str:
+        with self._lock:
+            entries = sum(len(t) for t in self._tracks.values())
+            tracks = len(self._tracks)
+            written, skipped = self.written, self.skipped
+        total = written + skipped
+        pct = 100.0 * skipped / total if total else 0.0
+        return f"PB index: {entries} PB en {tracks} pista(s), {skipped} vueltas sin escribir / {total} ({pct:.1f}%)"
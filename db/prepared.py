@@ -0,0 +1,128 @@
+"""
+Sentencias preparadas en el servidor (PREPARE / EXECUTE) para las consultas calientes.
+
+Las consultas calientes (upsert de lap_records y drivers, lookup de evento y de modo)
+se mandaban como texto completo en cada llamada: Postgres las parseaba y planificaba
+cada vez. StatementRegistry hace PREPARE una vez por conexión y después solo
+EXECUTE nombre (params).
+
+  - el estado va en la propia conexión (PreparedConnection, connection_factory del
+    pool): una conexión nueva tras un corte empieza vacía y vuelve a preparar
+  - el nombre incluye un hash del SQL, así que un refresh_schema() que cambie la
+    consulta prepara una sentencia nueva en vez de reutilizar la antigua
+  - los upserts con `VALUES %s` (execute_values) usan la sentencia preparada de una
+    fila cuando el lote trae una sola, que es el caso normal; lotes mayores siguen
+    con execute_values
+  - si la sesión pierde sus sentencias (DISCARD ALL), se vuelven a preparar y la
+    llamada se repite una vez cuando era la primera de su transacción; si no, el
+    error se propaga y el write-behind lo reintenta como fallo transitorio
+  - PgBouncer en modo transacción (puerto 6543 de Supabase) reparte cada
+    transacción a una conexión de servidor distinta y PREPARE no sobrevive: ahí el
+    registro queda deshabilitado y se ejecuta el SQL normal con parámetros
+"""
+
+import hashlib
+import threading
+
+import psycopg2
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+from psycopg2.extensions import connection as _pg_connection
+from psycopg2.extras import execute_values as _execute_values
+
+
+class PreparedConnection(_pg_connection):
+    """Conexión psycopg2 que recuerda qué sentencias tiene preparadas su sesión."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared_statements = set()
+
+
+def _numbered(sql):
+    """`%s` → `$1..$n` (sintaxis de PREPARE); devuelve (sql, n)."""
+    parts = sql.split("%s")
+    out = [parts[0]]
+    for i, part in enumerate(parts[1:], 1):
+        out.append(f"${i}")
+        out.append(part)
+    return "".join(out), len(parts) - 1
+
+
+class _Statement:
+    __slots__ = ("name", "prepare_sql", "execute_sql")
+
+    def __init__(self, key, sql):
+        digest = hashlib.sha1(sql.encode()).hexdigest()[:10]
+        self.name = f"ac_{key}_{digest}"
+        body, n_params = _numbered(sql)
+        self.prepare_sql = f"PREPARE {self.name} AS {body}"
+        args = ", ".join(["%s"] * n_params)
+        self.execute_sql = f"EXECUTE {self.name} ({args})" if n_params else f"EXECUTE {self.name}"
+
+
+class StatementRegistry:
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._statements = {}  # (key, sql) -> _Statement
+        self.prepares = 0
+        self.executes = 0
+        self.plain = 0
+        self.invalidated = 0
+
+    def _statement(self, key, sql):
+        stmt = self._statements.get((key, sql))
+        if stmt is None:
+            with self._lock:
+                stmt = self._statements.setdefault((key, sql), _Statement(key, sql))
+        return stmt
+
+    def execute(self, cursor, key, sql, params=()):
+        """cursor.execute(sql, params), vía EXECUTE si la conexión lo permite."""
+        prepared = getattr(cursor.connection, "prepared_statements", None)
+        if not self.enabled or prepared is None:
+            self.plain += 1
+            cursor.execute(sql, params)
+            return
+        stmt = self._statement(key, sql)
+        conn = cursor.connection
+        fresh = conn.autocommit or conn.get_transaction_status() == TRANSACTION_STATUS_IDLE
+        try:
+            self._execute_prepared(cursor, prepared, stmt, params)
+        except psycopg2.errors.InvalidSqlStatementName:
+            # La sesión perdió sus sentencias (DISCARD ALL de un pooler).
+            prepared.clear()
+            self.invalidated += 1
+            if not fresh:
+                # La transacción del llamador quedó abortada con trabajo previo: no se
+                # puede repetir aquí (_is_transient_db_error lo trata como transitorio).
+                raise
+            # Era la primera sentencia de la transacción: nada se pierde al reintentar.
+            if not conn.autocommit:
+                conn.rollback()
+            self._execute_prepared(cursor, prepared, stmt, params)
+
+    def _execute_prepared(self, cursor, prepared, stmt, params):
+        if stmt.name not in prepared:
+            cursor.execute(stmt.prepare_sql)
+            prepared.add(stmt.name)
+            self.prepares += 1
+        cursor.execute(stmt.execute_sql, params)
+        self.executes += 1
+
+    def execute_values(self, cursor, key, sql, rows, fetch=False):
+        """Como psycopg2.extras.execute_values; con una sola fila usa la sentencia preparada."""
+        if len(rows) != 1 or not self.enabled:
+            return _execute_values(cursor, sql, rows, fetch=fetch)
+        row = rows[0]
+        single = sql.replace("VALUES %s", "VALUES (" + ", ".join(["%s"] * len(row)) + ")", 1)
+        self.execute(cursor, key, single, row)
+        return cursor.fetchall() if fetch else None
+
+    def summary(self) -> str:
+        if not self.enabled:
+            return f"prepared: deshabilitado (SQL directo={self.plain})"
+        return (
+            f"prepared: sentencias={len(self._statements)} PREPARE={self.prepares} "
+            f"EXECUTE={self.executes} SQL directo={self.plain} invalidadas={self.invalidated}"
+        )
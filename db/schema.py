@@ -0,0 +1,177 @@
+"""
+Sondeo único del esquema: qué tablas/columnas existen y las consultas ya montadas.
+
+Las consultas a information_schema son de las más lentas a través del pooler de
+Supabase, y antes se repetían en cada fallo de cache (gate de instancia, modo,
+eventos, IDENTITY/DEFAULT de lap_records.id). probe_schema() hace UNA consulta al catálogo y
+construye SchemaCapabilities, inmutable, con:
+  - tablas y columnas presentes
+  - columna de modo de ac_server_control y su ORDER BY
+  - si server_events puede aislarse por instance_id
+  - los SQL finales de cada lookup (None cuando la tabla/columna no existe) y el
+    upsert de lap_records para execute_values
+
+db/database.py lo ejecuta en init_db() y expone refresh_schema() para cuando el
+esquema cambie (p. ej. tras añadir instance_id).
+"""
+
+import time
+
+from db.control_plane import RUNNING_STATES, control_mode_column, control_order_clause
+
+PROBED_TABLES = ("lap_records", "ac_server_control", "server_events", "server_battles")
+
+_RUNNING_LIST = ", ".join(f"'{s}'" for s in RUNNING_STATES)
+
+_LAP_UPSERT_SQL = """
+        INSERT INTO lap_records (
+            {id_column}steam_id, car_model, track, track_config, server_name, lap_time, valid_lap, "timestamp", "date"
+        )
+        VALUES %s
+        ON CONFLICT (steam_id, car_model, track, track_config) DO UPDATE SET
+            lap_time = CASE
+                WHEN EXCLUDED.lap_time < lap_records.lap_time THEN EXCLUDED.lap_time
+                ELSE lap_records.lap_time
+            END,
+            valid_lap = CASE
+                WHEN EXCLUDED.lap_time < lap_records.lap_time THEN EXCLUDED.valid_lap
+                ELSE lap_records.valid_lap
+            END,
+            "timestamp" = CASE
+                WHEN EXCLUDED.lap_time < lap_records.lap_time THEN EXCLUDED."timestamp"
+                ELSE lap_records."timestamp"
+            END,
+            server_name = EXCLUDED.server_name,
+            "date" = CASE
+                WHEN EXCLUDED.lap_time < lap_records.lap_time THEN EXCLUDED."date"
+                ELSE lap_records."date"
+            END
+        RETURNING steam_id, car_model, track, track_config, lap_time
+        """
+
+
+class SchemaCapabilities:
+    """Resultado inmutable de probe_schema(); los atributos *_sql son None si no aplican."""
+
+    def __init__(self, columns, identity_columns, instance_id, default_columns=frozenset()):
+        self.probed_at = time.time()
+        self.columns = columns                    # {tabla: frozenset(columnas)}
+        self.identity_columns = identity_columns  # {(tabla, columna)} con IDENTITY
+        self.default_columns = default_columns    # {(tabla, columna)} con DEFAULT
+        self.instance_id = instance_id
+
+        control_cols = columns.get("ac_server_control", frozenset())
+        self.control_mode_column = control_mode_column(control_cols)
+        self.control_order_clause = control_order_clause(
+            control_cols, self.control_mode_column or "server_name"
+        )
+
+        self.server_active_sql = None
+        self.server_mode_sql = None
+        self.control_plane_sql = None
+        if control_cols:
+            self.server_active_sql = """
+            SELECT EXISTS (
+                SELECT 1
+                FROM ac_server_control
+                WHERE instance_id = %s
+                  AND server_name = %s
+                  AND COALESCE(power_state, 'stopped') = 'running'
+            )
+            """
+            mode_expr = f"{self.control_mode_column} AS mode" if self.control_mode_column else "NULL AS mode"
+            self.control_plane_sql = f"""
+            SELECT server_name, power_state, {mode_expr}
+            FROM ac_server_control
+            WHERE instance_id = %s
+            ORDER BY {self.control_order_clause}
+            """
+            if self.control_mode_column:
+                self.server_mode_sql = f"""
+            SELECT {self.control_mode_column}
+            FROM ac_server_control
+            WHERE instance_id = %s
+              AND lower(btrim(server_name)) = lower(btrim(%s::text))
+              AND lower(COALESCE(power_state, 'stopped')) IN ({_RUNNING_LIST})
+            ORDER BY {self.control_order_clause}
+            LIMIT 1
+            """
+
+        event_cols = columns.get("server_events", frozenset())
+        # False si hay AC_INSTANCE_ID pero server_events no tiene instance_id (fail-closed).
+        self.events_isolated = not instance_id or "instance_id" in event_cols
+        self.active_event_sql = None
+        self.active_event_by_type_sql = None
+        self.started_events_sql = None
+        if event_cols and self.events_isolated:
+            instance_clause = " AND instance_id = %s" if instance_id else ""
+            self.active_event_sql = f"""
+                SELECT webhook_url, event_type, metadata, event_status
+                FROM server_events
+                WHERE server_name = %s AND event_status = 'started'{instance_clause}
+                ORDER BY id DESC LIMIT 1
+            """
+            self.active_event_by_type_sql = f"""
+                SELECT webhook_url, event_type, metadata, event_status
+                FROM server_events
+                WHERE server_name = %s AND event_type = %s AND event_status = 'started'{instance_clause}
+                ORDER BY id DESC LIMIT 1
+            """
+            self.started_events_sql = f"""
+            SELECT id, server_name, event_type, webhook_url, metadata
+            FROM server_events
+            WHERE event_status = 'started'{instance_clause}
+            ORDER BY id DESC
+            """
+
+        self.lap_id_is_identity = ("lap_records", "id") in identity_columns
+        # IDENTITY o DEFAULT nextval(...): la BD asigna el id y el INSERT no lo lleva.
+        # Si no (Drizzle sin secuencia y sin permiso para crearla), id explícito MAX(id)+1.
+        self.lap_id_generated = self.lap_id_is_identity or ("lap_records", "id") in default_columns
+        self.lap_upsert_sql = _LAP_UPSERT_SQL.format(id_column="" if self.lap_id_generated else "id, ")
+
+    def has_table(self, table_name) -> bool:
+        return table_name in self.columns
+
+    def has_column(self, table_name, column_name) -> bool:
+        return column_name in self.columns.get(table_name, ())
+
+    def instance_params(self):
+        """Parámetros del filtro de instancia de los SQL de server_events."""
+        return (self.instance_id,) if self.instance_id else ()
+
+    def summary(self) -> str:
+        tables = ", ".join(sorted(self.columns)) or "-"
+        return (
+            f"tablas=[{tables}] modo={self.control_mode_column or '-'} "
+            f"eventos_aislados={self.events_isolated} lap_id_identity={self.lap_id_is_identity} "
+            f"lap_id_generado={self.lap_id_generated}"
+        )
+
+
+def probe_schema(cursor, instance_id) -> SchemaCapabilities:
+    """Una sola consulta a information_schema (cursor de tuplas)."""
+    cursor.execute(
+        """
+        SELECT table_name, column_name, is_identity, column_default IS NOT NULL
+        FROM information_schema.columns
+        WHERE table_schema = 'public'
+          AND table_name = ANY(%s)
+        """,
+        (list(PROBED_TABLES),),
+    )
+    columns = {}
+    identity_columns = set()
+    default_columns = set()
+    for table_name, column_name, is_identity, has_default in cursor.fetchall() or []:
+        columns.setdefault(table_name, set()).add(column_name)
+        if is_identity == "YES":
+            identity_columns.add((table_name, column_name))
+        if has_default:
+            default_columns.add((table_name, column_name))
+    return SchemaCapabilities(
+        {t: frozenset(c) for t, c in columns.items()},
+        frozenset(identity_columns),
+        instance_id,
+        frozenset(default_columns),
+    )
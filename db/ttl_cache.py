@@ -0,0 +1,133 @@
+"""
+Cache TTL thread-safe con coalescencia de peticiones (single-flight).
+
+Las consultas por nombre de db/database.py se llaman desde cada hilo listener y
+desde los hilos de dispatch_event. Con dicts sueltos, al expirar una entrada
+todos los hilos fallaban a la vez y mandaban la misma consulta a Postgres.
+TTLCache.get_or_load() garantiza una sola carga en vuelo por clave: el primer hilo
+ejecuta el loader y el resto espera su resultado.
+
+  - tamaño acotado con desalojo LRU (OrderedDict)
+  - contadores hits / misses / coalesced / evictions (stats(), summary())
+  - clear() invalida también las cargas en vuelo: su resultado se entrega a quien
+    esperaba pero no se guarda (evita reinsertar un valor anterior al clear)
+  - si el loader lanza, la excepción llega a todos los que esperaban y no se cachea;
+    con stale_on_error=True se devuelve el último valor (caducado) si lo hay
+    (modo degradado con la BD caída)
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class _Flight:
+    __slots__ = ("done", "value", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class TTLCache:
+    def __init__(self, name, ttl=3.0, max_entries=1024):
+        self.name = name
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (valor, expira_en)
+        self._flights = {}             # key -> _Flight
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.stale = 0
+
+    def get_or_load(self, key, loader, stale_on_error=False):
+        """Devuelve el valor vigente de `key` o lo carga con `loader()` (una vez por clave)."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            flight = self._flights.get(key)
+            if flight is not None:
+                self.coalesced += 1
+                leader = False
+            else:
+                flight = self._flights[key] = _Flight()
+                self.misses += 1
+                leader = True
+            generation = self._generation
+            previous = entry
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = loader()
+        except Exception as e:
+            if stale_on_error and previous is not None:
+                flight.value = previous[0]
+                with self._lock:
+                    self.stale += 1
+                # Sin guardar: la próxima llamada vuelve a intentar la carga.
+                generation = None
+            else:
+                flight.error = e
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+            if flight.error is None and generation is not None and generation == self._generation:
+                self._store(key, flight.value)
+        flight.done.set()
+        if flight.error is not None:
+            raise flight.error
+        return flight.value
+
+    def _store(self, key, value):
+        self._entries[key] = (value, time.monotonic() + self.ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._flights.clear()
+            self._generation += 1
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "evictions": self.evictions,
+                "stale": self.stale,
+            }
+
+    def summary(self) -> str:
+        s = self.stats()
+        lookups = s["hits"] + s["misses"] + s["coalesced"]
+        hit_pct = 100.0 * (s["hits"] + s["coalesced"]) / lookups if lookups else 0.0
+        return (
+            f"{self.name}: {s['size']} entradas, {hit_pct:.1f}% sin consulta "
+            f"(hits={s['hits']} misses={s['misses']} coalesced={s['coalesced']} evictions={s['evictions']} "
+            f"stale={s['stale']})"
+        )
@@ -0,0 +1,433 @@
+"""
+Persistencia write-behind: las escrituras salen del hilo listener.
+
+save_driver / save_lap / touge_* corrían en línea dentro de process_packet: cada
+llamada pedía una conexión del pool y hacía uno o más round trips a Supabase (con
+connect_timeout de 15 s). Una BD lenta paraba la recepción y el kernel descartaba
+CAR_UPDATEs. WriteBehindQueue las encola y las escribe desde hilos propios:
+
+  - una cola acotada por worker; cada operación va al worker hash(key) % workers,
+    así las escrituras de una misma clave (piloto, batalla…) mantienen su orden
+  - el worker espera hasta `linger_sec` para juntar hasta `batch_size` operaciones
+    y las escribe por tipo, en orden de registro, con una conexión y un commit por tipo
+  - cola llena → la operación se descarta y se cuenta (el listener nunca se bloquea,
+    salvo que `put_timeout` > 0); con outbox, se guarda en disco en su lugar
+  - flush() espera a que se vacíe todo; stop() hace flush y para (también en atexit)
+
+Los escritores por tipo reciben (cursor, [payload, ...]) y pueden devolver una
+función que se llama tras el commit (logs, resolver PendingId).
+
+Con `outbox` (db/outbox.py), los tipos registrados como `durable` no se pierden:
+un fallo transitorio (`is_transient(exc)`) los guarda en disco y un hilo de
+replay los reenvía en lotes con backoff. Mientras quede atraso, lo nuevo de esos
+tipos va directamente detrás, sin intentar conectar. Un fallo no transitorio
+(datos inválidos, bug del escritor) se registra y se descarta; en el replay la
+fila pasa a cuarentena (outbox_dead) para no bloquear lo que va detrás. Si la BD
+responde pero el lote de un tipo falla, se reintenta fila a fila para aislar la
+culpable, y una fila que falla `max_replay_attempts` veces con la BD accesible
+también va a cuarentena. Lo que no se guarda llama a `on_failure(payloads)` si
+el tipo lo tiene.
+Sin start() (scripts, tests manuales), submit() escribe en línea, o en
+`inline_executor` si se asignó (runtime asyncio: la escritura no para el loop).
+"""
+
+import atexit
+import queue
+import threading
+import time
+from collections import OrderedDict
+
+_STOP = object()
+
+
+class PendingId:
+    """Id asignado por la BD cuando el writer procese el INSERT (p. ej. touge_battles.id)."""
+
+    __slots__ = ("_done", "value")
+
+    def __init__(self):
+        self._done = threading.Event()
+        self.value = None
+
+    def resolve(self, value):
+        self.value = value
+        self._done.set()
+
+    def result(self, timeout=None):
+        """Bloquea hasta que el writer haya escrito la fila; None si falló o expiró."""
+        self._done.wait(timeout)
+        return self.value
+
+    def __repr__(self):
+        return f"PendingId({self.value if self._done.is_set() else '…'})"
+
+
+class WriteBehindQueue:
+    def __init__(self, name, get_connection, workers=2, max_queue=10000, batch_size=200,
+                 linger_sec=0.05, put_timeout=0.0, outbox=None, is_transient=None, max_replay_attempts=10):
+        self.name = name
+        self.get_connection = get_connection
+        self.workers = max(1, workers)
+        self.batch_size = max(1, batch_size)
+        self.linger_sec = linger_sec
+        self.put_timeout = put_timeout
+        self.outbox = outbox
+        self.is_transient = is_transient or (lambda exc: True)
+        self.inline_executor = None
+        self.max_replay_attempts = max(1, max_replay_attempts)
+        self._replay_attempts = {}  # id de fila del outbox -> fallos con la BD accesible
+        per_worker = max(1, max_queue // self.workers)
+        self._queues = [queue.Queue(per_worker) for _ in range(self.workers)]
+        self._writers = OrderedDict()  # kind -> (write_fn, on_failure, durable)
+        self._threads = []
+        self._replay_stop = threading.Event()
+        self._lock = threading.Lock()
+        self._last_drop_log = 0.0
+        self.submitted = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.spilled = 0
+        self.batches = 0
+        self.max_depth = 0
+        self.flush_ns_total = 0
+        self.flush_ns_max = 0
+
+    def register(self, kind, write_fn, on_failure=None, durable=False):
+        """
+        El orden de registro es el orden de escritura dentro de un lote. `durable`:
+        el payload es serializable y reescribirlo es idempotente (va al outbox).
+        """
+        self._writers[kind] = (write_fn, on_failure, durable)
+
+    @property
+    def running(self):
+        return bool(self._threads)
+
+    def start(self):
+        if self._threads:
+            return
+        for i, q in enumerate(self._queues):
+            t = threading.Thread(target=self._worker, args=(q,), name=f"{self.name}-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+        if self.outbox is not None:
+            self._replay_stop.clear()
+            t = threading.Thread(target=self._replay_loop, name=f"{self.name}-replay", daemon=True)
+            t.start()
+            self._replay_thread = t
+        atexit.register(self.stop)
+
+    def submit(self, kind, key, payload) -> bool:
+        if not self._threads:
+            if self.inline_executor is not None:
+                future = self.inline_executor.submit(self._process, [(kind, payload)])
+                future.add_done_callback(self._report_inline_failure)
+                return True
+            return self._process([(kind, payload)])
+        q = self._queues[hash(key) % self.workers]
+        try:
+            if self.put_timeout > 0:
+                q.put((kind, payload), timeout=self.put_timeout)
+            else:
+                q.put_nowait((kind, payload))
+        except queue.Full:
+            if self.outbox is not None and self._writers[kind][2]:
+                return self._spill([(kind, payload)])
+            self._record_drop(kind)
+            return False
+        depth = q.qsize()
+        with self._lock:
+            self.submitted += 1
+            if depth > self.max_depth:
+                self.max_depth = depth
+        return True
+
+    def _report_inline_failure(self, future):
+        exc = future.exception()
+        if exc is not None:
+            print(f"❌ [{self.name}] Error en escritura en línea: {exc!r}")
+
+    def _record_drop(self, kind):
+        now = time.monotonic()
+        with self._lock:
+            self.dropped += 1
+            dropped = self.dropped
+            log = now - self._last_drop_log >= 5.0
+            if log:
+                self._last_drop_log = now
+        if log:
+            print(f"⚠️ [{self.name}] Cola llena: descartada escritura '{kind}' ({dropped} descartadas en total)")
+
+    def _worker(self, q):
+        while True:
+            item = q.get()
+            if item is _STOP:
+                q.task_done()
+                return
+            batch = [item]
+            deadline = time.monotonic() + self.linger_sec
+            stop = False
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    nxt = q.get(timeout=remaining) if remaining > 0 else q.get_nowait()
+                except queue.Empty:
+                    break
+                if nxt is _STOP:
+                    stop = True
+                    break
+                batch.append(nxt)
+            try:
+                self._process(batch)
+            finally:
+                for _ in batch:
+                    q.task_done()
+            if stop:
+                q.task_done()
+                return
+
+    def _is_durable(self, kind):
+        return self.outbox is not None and self._writers[kind][2]
+
+    def _process(self, batch) -> bool:
+        """Escribe un lote del listener; lo que falla de forma transitoria va al outbox."""
+        if self.outbox is not None and self.outbox.pending:
+            # Hay atraso en disco: lo durable va detrás para no adelantar a su misma clave.
+            # Lo no durable se escribe antes de guardarlo: así un touge_update lleva ya
+            # resuelto el PendingId de su touge_start del mismo lote.
+            behind = [item for item in batch if self._is_durable(item[0])]
+            if behind:
+                batch = [item for item in batch if not self._is_durable(item[0])]
+                ok = self._write_or_spill(batch) if batch else True
+                return self._spill(behind) and ok
+        return self._write_or_spill(batch)
+
+    def _write_or_spill(self, batch) -> bool:
+        failed = self._write_batch(batch)
+        ok = True
+        spill = []
+        for kind, (payloads, error, _reached) in failed.items():
+            if self._is_durable(kind) and self.is_transient(error):
+                spill.extend((kind, p) for p in payloads)
+            else:
+                self._lose(kind, payloads, error)
+                ok = False
+        if spill:
+            ok = self._spill(spill) and ok
+        return ok
+
+    def _spill(self, items) -> bool:
+        try:
+            self.outbox.put_many(items)
+        except Exception as e:
+            print(f"❌ [{self.name}] No se pudo guardar en el outbox ({e})")
+            by_kind = OrderedDict()
+            for kind, payload in items:
+                by_kind.setdefault(kind, []).append(payload)
+            for kind, payloads in by_kind.items():
+                self._lose(kind, payloads, e)
+            return False
+        with self._lock:
+            self.spilled += len(items)
+        return True
+
+    def _lose(self, kind, payloads, error):
+        with self._lock:
+            self.failed += len(payloads)
+        sample = ", ".join(repr(p)[:120] for p in payloads[:3])
+        more = f" (+{len(payloads) - 3})" if len(payloads) > 3 else ""
+        print(f"❌ [{self.name}] Error escribiendo {len(payloads)} '{kind}': {error!r} | {sample}{more}")
+        on_failure = self._writers[kind][1]
+        if on_failure:
+            on_failure(payloads)
+
+    def _write_batch(self, batch):
+        """
+        Escribe por tipo; devuelve {kind: (payloads, excepción, llegó_a_la_bd)} de lo
+        que falló. llegó_a_la_bd: la conexión seguía viva tras el fallo (no es una caída).
+        """
+        by_kind = OrderedDict((kind, []) for kind in self._writers)
+        for kind, payload in batch:
+            by_kind[kind].append(payload)
+        t0 = time.perf_counter_ns()
+        failed = {}
+        conn = None
+        cursor = None
+        try:
+            conn = self.get_connection()
+            cursor = conn.cursor()
+            for kind, payloads in by_kind.items():
+                if not payloads:
+                    continue
+                write_fn = self._writers[kind][0]
+                try:
+                    after_commit = write_fn(cursor, payloads)
+                    conn.commit()
+                except Exception as e:
+                    try:
+                        conn.rollback()
+                    except Exception:
+                        pass
+                    failed[kind] = (payloads, e, not conn.closed)
+                    continue
+                with self._lock:
+                    self.written += len(payloads)
+                if after_commit:
+                    after_commit()
+        except Exception as e:
+            # Sin conexión: falla todo lo que quedaba del lote.
+            for kind, payloads in by_kind.items():
+                if payloads and kind not in failed:
+                    failed[kind] = (payloads, e, False)
+        finally:
+            if cursor:
+                cursor.close()
+            if conn:
+                conn.close()
+        elapsed = time.perf_counter_ns() - t0
+        with self._lock:
+            self.batches += 1
+            self.flush_ns_total += elapsed
+            if elapsed > self.flush_ns_max:
+                self.flush_ns_max = elapsed
+        return failed
+
+    def _replay_loop(self):
+        backoff = 1.0
+        while not self._replay_stop.is_set():
+            if not self.outbox.pending:
+                self._replay_stop.wait(1.0)
+                continue
+            try:
+                transient = self._replay_batch()
+            except Exception as e:
+                # SQLite o una fila ilegible: se registra y se reintenta con backoff en
+                # lugar de dejar morir el hilo (el outbox crecería sin límite).
+                print(f"❌ [{self.name}] Error reenviando el outbox: {e}")
+                self._replay_stop.wait(backoff)
+                backoff = min(backoff * 2, 60.0)
+                continue
+            if transient:
+                if backoff == 1.0:
+                    print(f"⚠️ [{self.name}] BD no disponible; {self.outbox.pending} escritura(s) en el outbox")
+                self._replay_stop.wait(backoff)
+                backoff = min(backoff * 2, 60.0)
+            elif backoff > 1.0:
+                backoff = 1.0
+                print(f"✅ [{self.name}] BD disponible de nuevo; vaciando outbox ({self.outbox.pending} pendientes)")
+
+    def _replay_batch(self) -> bool:
+        """Reenvía un lote del outbox; True si algo falló de forma transitoria."""
+        rows = self.outbox.peek(self.batch_size)
+        failed = self._write_batch([(kind, payload) for _id, kind, payload in rows])
+        by_kind = OrderedDict()
+        for row in rows:
+            by_kind.setdefault(row[1], []).append(row)
+        done = []
+        dead = []
+        transient = False
+        for kind, kind_rows in by_kind.items():
+            failure = failed.get(kind)
+            if failure is None:
+                done.extend(row_id for row_id, _kind, _payload in kind_rows)
+                continue
+            if failure[2] and len(kind_rows) > 1:
+                # La BD responde pero el lote falla: fila a fila para aislar la culpable.
+                results = [(row, self._write_batch([(kind, row[2])]).get(kind)) for row in kind_rows]
+            else:
+                results = [(row, failure) for row in kind_rows]
+            for (row_id, _kind, payload), row_failure in results:
+                if row_failure is None:
+                    done.append(row_id)
+                    continue
+                _payloads, error, reached = row_failure
+                if not self.is_transient(error):
+                    dead.append((row_id, kind, payload, error))
+                elif reached and self._count_attempt(row_id) >= self.max_replay_attempts:
+                    dead.append((row_id, kind, payload, error))
+                else:
+                    transient = True
+        self.outbox.delete(done)
+        for row_id in done:
+            self._replay_attempts.pop(row_id, None)
+        for row_id, kind, payload, error in dead:
+            self._replay_attempts.pop(row_id, None)
+            self.outbox.quarantine([row_id], repr(error))
+            print(f"☣️ [{self.name}] Fila {row_id} del outbox en cuarentena (outbox_dead)")
+            self._lose(kind, [payload], error)
+        return transient
+
+    def _count_attempt(self, row_id) -> int:
+        attempts = self._replay_attempts.get(row_id, 0) + 1
+        self._replay_attempts[row_id] = attempts
+        return attempts
+
+    def depth(self) -> int:
+        return sum(q.qsize() for q in self._queues)
+
+    def flush(self, timeout=None) -> bool:
+        """Espera a que se escriba todo lo encolado hasta ahora."""
+        if not self._threads:
+            return True
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for q in self._queues:
+            with q.all_tasks_done:
+                while q.unfinished_tasks:
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        return False
+                    q.all_tasks_done.wait(remaining)
+        return True
+
+    def stop(self, timeout=10.0):
+        """Vacía las colas y para los workers (idempotente)."""
+        if not self._threads:
+            return
+        threads, self._threads = self._threads, []
+        deadline = time.monotonic() + timeout
+        for q in self._queues:
+            # Bloqueante: el centinela debe entrar aunque la cola esté llena.
+            try:
+                q.put(_STOP, timeout=max(0.01, deadline - time.monotonic()))
+            except queue.Full:
+                pass
+        for t in threads:
+            t.join(max(0.0, deadline - time.monotonic()))
+        if self.outbox is not None:
+            self._replay_stop.set()
+            self._replay_thread.join(max(0.0, deadline - time.monotonic()))
+        pending = self.depth()
+        if pending:
+            print(f"⚠️ [{self.name}] Parada con {pending} escritura(s) sin volcar")
+        else:
+            print(f"💾 [{self.name}] Escrituras pendientes volcadas ({self.written} en total)")
+        if self.outbox is not None and self.outbox.pending:
+            print(f"💾 [{self.name}] {self.outbox.pending} escritura(s) quedan en el outbox para el próximo arranque")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "depth": self.depth(),
+                "max_depth": self.max_depth,
+                "submitted": self.submitted,
+                "written": self.written,
+                "dropped": self.dropped,
+                "failed": self.failed,
+                "spilled": self.spilled,
+                "batches": self.batches,
+                "avg_flush_ms": self.flush_ns_total / self.batches / 1e6 if self.batches else 0.0,
+                "max_flush_ms": self.flush_ns_max / 1e6,
+            }
+
+    def summary(self) -> str:
+        s = self.stats()
+        per_batch = s["written"] / s["batches"] if s["batches"] else 0.0
+        text = (
+            f"{self.name}: cola={s['depth']} (máx {s['max_depth']}) escritas={s['written']} "
+            f"descartadas={s['dropped']} fallidas={s['failed']} al outbox={s['spilled']} lotes={s['batches']} "
+            f"({per_batch:.1f}/lote, flush avg {s['avg_flush_ms']:.1f} ms, máx {s['max_flush_ms']:.1f} ms)"
+        )
+        if self.outbox is not None:
+            text += f" | {self.outbox.summary()}"
+        return text
@@ -1,26 +1,68 @@
+import asyncio
+import functools
 import socket
 import select
+import selectors
+import struct
 import threading
 import time
 import os
 from dotenv import load_dotenv
 
-from db.database import init_db
+from db.database import (
+    flush_writes,
+    init_db,
+    lookup_cache_stats,
+    offload_inline_writes,
+    start_control_plane_refresher,
+    start_write_behind,
+    write_behind_stats,
+)
 from core.config_loader import load_server_configs
+from core.background import use_event_loop
+from core.session_context import session_context_refresh_loop
 from core.session_manager import ServerState, send_registration
-from core.packet_processor import process_packet
-from network.event_dispatcher import send_server_event
+from core.status_delta import StatusDeltaEncoder
+from core.packet_processor import process_packet, format_handler_stats
+from network.event_dispatcher import (
+    drain_webhooks,
+    send_server_event,
+    start_webhook_delivery,
+    webhook_client_stats,
+)
+from network.udp_receiver import iter_datagrams
 
 load_dotenv()
 
 SERVER_IP = '127.0.0.1'
 GHOST_DRIVER_TIMEOUT_MS = int(os.getenv("GHOST_DRIVER_TIMEOUT_MS", "90000"))
+# "thread": un hilo listener por servidor (comportamiento original).
+# "selector": un único hilo con selectors/epoll para todos los sockets.
+# "asyncio": un DatagramProtocol por servidor sobre un único event loop.
+INGEST_BACKEND = os.getenv("INGEST_BACKEND", "thread").strip().lower()
+# Solo asyncio: hilos del executor para trabajo bloqueante (requests.post, BD).
+ASYNC_BLOCKING_WORKERS = int(os.getenv("ASYNC_BLOCKING_WORKERS", "16"))
+# Imprime el histograma de lotes de recepción en cada ciclo de server_status_loop.
+LOG_RECV_STATS = os.getenv("LOG_RECV_STATS", "false").lower() == "true"
+# Imprime llamadas/tiempo por handler de paquete en cada ciclo de server_status_loop.
+LOG_HANDLER_STATS = os.getenv("LOG_HANDLER_STATS", "false").lower() == "true"
+# Imprime hits/misses/coalescencias de los caches de consultas por nombre.
+LOG_CACHE_STATS = os.getenv("LOG_CACHE_STATS", "false").lower() == "true"
+# Imprime profundidad de cola / lotes / fallos del write-behind de la BD.
+LOG_WRITE_STATS = os.getenv("LOG_WRITE_STATS", "false").lower() == "true"
+# Imprime latencia / errores / conexiones reutilizadas de los webhooks por destino.
+LOG_WEBHOOK_STATS = os.getenv("LOG_WEBHOOK_STATS", "false").lower() == "true"
+# server_status solo con cambios (server_status_delta) y keyframe completo cada KEYFRAME_SEC.
+SERVER_STATUS_DELTA = os.getenv("SERVER_STATUS_DELTA", "false").lower() == "true"
+SERVER_STATUS_KEYFRAME_SEC = float(os.getenv("SERVER_STATUS_KEYFRAME_SEC", "60"))
+
+_status_encoder = StatusDeltaEncoder(SERVER_STATUS_KEYFRAME_SEC) if SERVER_STATUS_DELTA else None
 
 # ──────────────────────────────────────────────
 # SERVER LISTENER THREAD
 # ──────────────────────────────────────────────
 
-def listen_server(server_state):
+def _open_server_socket(server_state):
     sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     sock.bind((SERVER_IP, server_state.port))
     sock.setblocking(False)
@@ -31,84 +73,229 @@ def listen_server(server_state):
     # Force connection immediately so we can get NEW_SESSION and active players
     server_state.last_server_addr = (SERVER_IP, server_state.server_cmd_port)
     send_registration(server_state, SERVER_IP)
+    return sock
 
-    while True:
+
+def _receive_batch(sock, server_state):
+    received = 0
+    for data, addr in iter_datagrams(sock, server_state.recv_buffer):
+        received += 1
+        try:
+            process_packet(data, server_state, addr)
+        except Exception as e:
+            print(f"❌ [{server_state.port}] Packet error: {e}")
+    server_state.recv_stats.record(received)
+
+
+def listen_server(server_state, stop_event=None):
+    sock = _open_server_socket(server_state)
+
+    while stop_event is None or not stop_event.is_set():
         ready = select.select([sock], [], [], 0.5)
         if ready[0]:
-            try:
-                data, addr = sock.recvfrom(4096)
-                process_packet(data, server_state, addr)
-            except ConnectionResetError:
-                # This happen on Windows if a previous sendto() failed (ICMP Port Unreachable).
-                # It's safe to ignore for UDP.
-                pass
-            except Exception as e:
-                print(f"❌ [{server_state.port}] Packet error: {e}")
+            _receive_batch(sock, server_state)
+
+
+def listen_all_servers(servers, stop_event=None):
+    """
+    Alternativa a un hilo por servidor: registra todos los sockets en un único
+    selector (epoll en Linux) y enruta cada datagrama a su ServerState por puerto.
+    """
+    sel = selectors.DefaultSelector()
+    for server_state in servers.values():
+        try:
+            sock = _open_server_socket(server_state)
+        except Exception as e:
+            print(f"❌ [{server_state.port}] No se pudo abrir el socket: {e}")
+            continue
+        sel.register(sock, selectors.EVENT_READ, server_state)
+
+    print(f"🎧 Selector ingest: {len(servers)} socket(s) en un único hilo")
+    try:
+        while stop_event is None or not stop_event.is_set():
+            for key, _ in sel.select(timeout=0.5):
+                _receive_batch(key.fileobj, key.data)
+    finally:
+        sel.close()
 
 # ──────────────────────────────────────────────
 # SERVER STATUS SYNC THREAD
 # ──────────────────────────────────────────────
 
+def _ping_car_slot(state, car_id):
+    # Ping AC server for a slot to detect silent disconnects
+    try:
+        state.sock.sendto(struct.pack('BB', 201, car_id), state.last_server_addr)
+    except Exception:
+        pass
+
+
+def _publish_server_status(state):
+    # Build list of active players safely (values might change during loop)
+    now_ms = int(time.time() * 1000)
+    players = []
+    stale_car_ids = []
+    for car_id, d in list(state.active_drivers.items()):
+        last_seen = getattr(d, "last_seen_ms", 0)
+        if last_seen and (now_ms - last_seen) > GHOST_DRIVER_TIMEOUT_MS:
+            stale_car_ids.append(car_id)
+            continue
+        if not d.guid.startswith('unknown_'):
+            players.append({
+                "steamId": d.guid,
+                "name": d.name,
+                "carModel": d.model
+            })
+
+    # Purga defensiva de "ghost players" cuando no llegaron paquetes de salida.
+    for car_id in stale_car_ids:
+        d = state.active_drivers.get(car_id)
+        if not d:
+            continue
+        if d.guid in state.guid_to_driver:
+            del state.guid_to_driver[d.guid]
+        del state.active_drivers[car_id]
+        if not d.guid.startswith('unknown_'):
+            send_server_event("player_leave", getattr(state, 'config_server_name', state.server_name), {
+                "steamId": d.guid,
+                "trackName": state.track,
+                "trackConfig": state.config
+            }, server_key=state.port)
+    if stale_car_ids:
+        print(f"🧹 [{state.port}] Purga estado: {len(stale_car_ids)} ghost(s) removidos por timeout")
+
+    server_name = getattr(state, 'config_server_name', state.server_name)
+    if _status_encoder is not None:
+        update = _status_encoder.encode(state.port, players, state.track, state.config)
+        if update:
+            # Si este envío se pierde, el backend queda desincronizado: el siguiente es keyframe.
+            send_server_event(update[0], server_name, update[1],
+                              on_lost=functools.partial(_status_encoder.forget, state.port), server_key=state.port)
+        return
+
+    send_server_event("server_status", server_name, {
+        "players": players,
+        "trackName": state.track,
+        "trackConfig": state.config
+    }, server_key=state.port)
+
+
 def server_status_loop(servers):
     """
     Sends a "server_status" webhook every 15 seconds
     and polls the server for CAR_INFO to clean up ghosts that dropped while loading.
     """
-    import struct
     while True:
         # Sleep first so we don't spam instantly on boot
         time.sleep(15)
         for state in servers.values():
             if not state.last_server_addr:
                 continue # Never got a packet from this server yet
-            
-            # Ping AC server for all slots to detect silent disconnects
             for i in range(32):
-                packet = struct.pack('BB', 201, i)
-                try:
-                    state.sock.sendto(packet, state.last_server_addr)
-                except Exception:
-                    pass
+                _ping_car_slot(state, i)
                 time.sleep(0.01)
+            _publish_server_status(state)
+            if LOG_RECV_STATS:
+                print(f"📊 [{state.port}] Recv batches: {state.recv_stats.summary()}")
+        if LOG_HANDLER_STATS:
+            print(f"📊 Handlers: {format_handler_stats()}")
+        if LOG_CACHE_STATS:
+            print(f"📊 Lookup caches: {lookup_cache_stats()}")
+        if LOG_WRITE_STATS:
+            print(f"📊 DB writes: {write_behind_stats()}")
+        if LOG_WEBHOOK_STATS:
+            print(f"📊 Webhooks: {webhook_client_stats()}")
+            if _status_encoder is not None:
+                print(f"📊 Status: {_status_encoder.summary()}")
 
-            # Build list of active players safely (values might change during loop)
-            now_ms = int(time.time() * 1000)
-            players = []
-            stale_car_ids = []
-            for car_id, d in list(state.active_drivers.items()):
-                last_seen = getattr(d, "last_seen_ms", 0)
-                if last_seen and (now_ms - last_seen) > GHOST_DRIVER_TIMEOUT_MS:
-                    stale_car_ids.append(car_id)
-                    continue
-                if not d.guid.startswith('unknown_'):
-                    players.append({
-                        "steamId": d.guid,
-                        "name": d.name,
-                        "carModel": d.model
-                    })
-
-            # Purga defensiva de "ghost players" cuando no llegaron paquetes de salida.
-            for car_id in stale_car_ids:
-                d = state.active_drivers.get(car_id)
-                if not d:
-                    continue
-                if d.guid in state.guid_to_driver:
-                    del state.guid_to_driver[d.guid]
-                del state.active_drivers[car_id]
-                if not d.guid.startswith('unknown_'):
-                    send_server_event("player_leave", getattr(state, 'config_server_name', state.server_name), {
-                        "steamId": d.guid,
-                        "trackName": state.track,
-                        "trackConfig": state.config
-                    })
-            if stale_car_ids:
-                print(f"🧹 [{state.port}] Purga estado: {len(stale_car_ids)} ghost(s) removidos por timeout")
-            
-            send_server_event("server_status", getattr(state, 'config_server_name', state.server_name), {
-                "players": players,
-                "trackName": state.track,
-                "trackConfig": state.config
-            })
+# ──────────────────────────────────────────────
+# ASYNCIO RUNTIME (INGEST_BACKEND=asyncio)
+# ──────────────────────────────────────────────
+
+class _ServerDatagramProtocol(asyncio.DatagramProtocol):
+    """
+    Un endpoint por ServerState: cada datagrama va directo a process_packet.
+    Como lote cuenta lo recibido en una misma vuelta del loop (mismo histograma
+    que los backends thread/selector).
+    """
+
+    def __init__(self, server_state):
+        self.server_state = server_state
+        self._loop = None
+        self._batch = 0
+
+    def connection_made(self, transport):
+        self._loop = asyncio.get_running_loop()
+
+    def datagram_received(self, data, addr):
+        if not self._batch:
+            self._loop.call_soon(self._record_batch)
+        self._batch += 1
+        try:
+            process_packet(data, self.server_state, addr)
+        except Exception as e:
+            print(f"❌ [{self.server_state.port}] Packet error: {e}")
+
+    def _record_batch(self):
+        self.server_state.recv_stats.record(self._batch)
+        self._batch = 0
+
+    def error_received(self, exc):
+        # ConnectionResetError en Windows (ICMP Port Unreachable) tras un sendto fallido: se ignora.
+        if not isinstance(exc, ConnectionResetError):
+            print(f"⚠️ [{self.server_state.port}] Error leyendo UDP: {exc}")
+
+
+async def server_status_loop_async(servers):
+    """Igual que server_status_loop, pero sin bloquear el loop entre pings."""
+    while True:
+        await asyncio.sleep(15)
+        for state in servers.values():
+            if not state.last_server_addr:
+                continue
+            for i in range(32):
+                _ping_car_slot(state, i)
+                await asyncio.sleep(0.01)
+            _publish_server_status(state)
+            if LOG_RECV_STATS:
+                print(f"📊 [{state.port}] Recv batches: {state.recv_stats.summary()}")
+        if LOG_HANDLER_STATS:
+            print(f"📊 Handlers: {format_handler_stats()}")
+        if LOG_CACHE_STATS:
+            print(f"📊 Lookup caches: {lookup_cache_stats()}")
+        if LOG_WRITE_STATS:
+            print(f"📊 DB writes: {write_behind_stats()}")
+        if LOG_WEBHOOK_STATS:
+            print(f"📊 Webhooks: {webhook_client_stats()}")
+            if _status_encoder is not None:
+                print(f"📊 Status: {_status_encoder.summary()}")
+
+
+async def run_asyncio(servers):
+    loop = asyncio.get_running_loop()
+    # Registro escalonado y webhooks dejan de abrir un hilo por tarea (ver core/background.py).
+    use_event_loop(loop, ASYNC_BLOCKING_WORKERS)
+    # Con WRITE_BEHIND_ENABLED=false, save_* no deben escribir desde el loop.
+    offload_inline_writes()
+
+    transports = []
+    for server_state in servers.values():
+        try:
+            sock = _open_server_socket(server_state)
+        except Exception as e:
+            print(f"❌ [{server_state.port}] No se pudo abrir el socket: {e}")
+            continue
+        transport, _ = await loop.create_datagram_endpoint(
+            lambda state=server_state: _ServerDatagramProtocol(state), sock=sock
+        )
+        transports.append(transport)
+
+    print(f"\n✅ {len(transports)} event server(s) running (asyncio). Press Ctrl+C to stop.\n")
+    try:
+        await server_status_loop_async(servers)
+    finally:
+        for transport in transports:
+            transport.close()
 
 # ──────────────────────────────────────────────
 # MAIN
@@ -116,6 +303,12 @@ def server_status_loop(servers):
 
 def main():
     init_db()
+    # save_driver / save_lap / touge_* se escriben en lotes desde hilos propios.
+    start_write_behind()
+    # Webhooks de progreso/resultado que fallaron se reintentan desde un spool en disco.
+    start_webhook_delivery()
+    # ac_server_control + server_events en memoria; refresco periódico en segundo plano.
+    start_control_plane_refresher()
     
     # Load all server configurations into ServerState objects
     servers = load_server_configs(ServerState)
@@ -124,11 +317,28 @@ def main():
         print("❌ No event server configurations found. Check EVENTS_SERVERS_PATH in .env")
         return
 
+    # Modo/evento activo de cada servidor: se consulta aquí, no por paquete.
+    threading.Thread(target=session_context_refresh_loop, args=(servers,), daemon=True).start()
+
+    if INGEST_BACKEND == "asyncio":
+        try:
+            asyncio.run(run_asyncio(servers))
+        except KeyboardInterrupt:
+            print("\n👋 Stopping event servers.")
+        drain_webhooks()
+        flush_writes()
+        return
+
     threads = []
-    for server_state in servers.values():
-        t = threading.Thread(target=listen_server, args=(server_state,), daemon=True)
+    if INGEST_BACKEND == "selector":
+        t = threading.Thread(target=listen_all_servers, args=(servers,), daemon=True)
         t.start()
         threads.append(t)
+    else:
+        for server_state in servers.values():
+            t = threading.Thread(target=listen_server, args=(server_state,), daemon=True)
+            t.start()
+            threads.append(t)
 
     # Start 5-minute sync loop in the background
     sync_thread = threading.Thread(target=server_status_loop, args=(servers,), daemon=True)
@@ -142,6 +352,8 @@ def main():
             time.sleep(1)
     except KeyboardInterrupt:
         print("\n👋 Stopping event servers.")
+    drain_webhooks()
+    flush_writes()
 
 if __name__ == "__main__":
     main()
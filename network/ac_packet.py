@@ -1,4 +1,6 @@
 import struct
+from collections import namedtuple
+from operator import itemgetter
 
 class ACSP:
     # Standard AC Dedicated Server Protocol
@@ -28,66 +30,181 @@ class ACSP:
     CE_COLLISION_WITH_ENV = 11
 
 class PacketParser:
+    """
+    Lector secuencial de paquetes ACSP sobre un memoryview: leer enteros o saltar
+    campos no copia nada; solo read_string/read_wstring materializan un str.
+    Acepta bytes, bytearray o memoryview (p.ej. la vista del buffer de recv_into).
+    """
+
+    __slots__ = ("data", "size", "offset")
+
     def __init__(self, data):
-        self.data = data
+        self.data = data if isinstance(data, memoryview) else memoryview(data)
+        self.size = len(self.data)
         self.offset = 0
 
     def read_uint8(self):
-        if self.offset + 1 > len(self.data): return None
+        if self.offset + 1 > self.size: return None
         val = self.data[self.offset]
         self.offset += 1
         return val
 
     def read_uint16(self):
-        if self.offset + 2 > len(self.data): return None
+        if self.offset + 2 > self.size: return None
         val = struct.unpack_from('<H', self.data, self.offset)[0]
         self.offset += 2
         return val
 
     def read_uint32(self):
-        if self.offset + 4 > len(self.data): return None
+        if self.offset + 4 > self.size: return None
         val = struct.unpack_from('<I', self.data, self.offset)[0]
         self.offset += 4
         return val
 
     def read_float(self):
-        if self.offset + 4 > len(self.data): return None
+        if self.offset + 4 > self.size: return None
         val = struct.unpack_from('<f', self.data, self.offset)[0]
         self.offset += 4
         return val
 
     def remaining(self):
-        return len(self.data) - self.offset
+        return self.size - self.offset
 
     def read_string(self):
         """Reads a std::string from AC server (1 byte length + ASCII/UTF-8 bytes)"""
-        if self.offset >= len(self.data): return ""
+        if self.offset >= self.size: return ""
         length = self.read_uint8()
         if length is None or length == 0: return ""
 
-        if self.offset + length <= len(self.data):
+        if self.offset + length <= self.size:
             chunk = self.data[self.offset : self.offset + length]
             self.offset += length
             try:
-                return chunk.decode('utf-8', errors='replace').split('\x00')[0]
+                return str(chunk, 'utf-8', 'replace').split('\x00')[0]
             except: pass
         return ""
 
     def read_wstring(self):
         """Reads a std::wstring from AC server (1 byte length + UTF-32 bytes)"""
-        if self.offset >= len(self.data): return ""
+        if self.offset >= self.size: return ""
         length = self.read_uint8()
         if length is None or length == 0: return ""
 
-        res = ""
-        for _ in range(length):
-            if self.offset + 4 <= len(self.data):
-                char_bytes = self.data[self.offset : self.offset + 4]
-                self.offset += 4
-                try:
-                    char = char_bytes.decode('utf-32le', errors='replace').replace('\x00', '')
-                    res += char
-                except: pass
+        # Una sola decodificación del bloque: si el paquete viene truncado se leen
+        # solo los caracteres completos disponibles (como el bucle carácter a carácter).
+        nbytes = min(length, (self.size - self.offset) >> 2) << 2
+        chunk = self.data[self.offset : self.offset + nbytes]
+        self.offset += nbytes
+        return str(chunk, 'utf-32le', 'replace').replace('\x00', '').strip()
+
+    def skip_string(self):
+        """Avanza sobre un std::string sin decodificarlo (campos que nadie usa)."""
+        if self.offset >= self.size: return
+        length = self.data[self.offset]
+        self.offset = min(self.offset + 1 + length, self.size)
+
+    def skip_wstring(self):
+        """Avanza sobre un std::wstring (UTF-32) sin decodificarlo."""
+        if self.offset >= self.size: return
+        length = self.data[self.offset]
+        self.offset = min(self.offset + 1 + length * 4, self.size)
+
+
+# ─────────────────────────────────────────────────────────────
+# Codecs de layout fijo (struct.Struct precompilado)
+# ─────────────────────────────────────────────────────────────
+# Los paquetes de tamaño fijo se decodifican con un único unpack_from en vez de
+# un read_* por campo. Si el paquete viene truncado el resultado es el mismo que con
+# las lecturas incrementales (campos que no caben a None), pero con tablas precalculadas.
+
+CarUpdate = namedtuple("CarUpdate", "car_id pos_x pos_y pos_z v_x v_y v_z gear rpm spline")
+LapCompleted = namedtuple("LapCompleted", "car_id lap_time cuts")
+ClientEvent = namedtuple("ClientEvent", "ev_type car_id other_car_id impact_speed")
+# tuple.__new__ directo: evita el _make/__new__ en Python de namedtuple en la ruta caliente.
+_tuple_new = tuple.__new__
+
+CAR_UPDATE_STRUCT = struct.Struct('<B6fBHf')      # car_id, pos xyz, vel xyz, gear, rpm, spline
+LAP_COMPLETED_STRUCT = struct.Struct('<BIB')      # car_id, lap_time, cuts
+CLIENT_EVENT_CAR_STRUCT = struct.Struct('<BBBf')  # ev_type, car_id, other_car_id, impact_speed
+CLIENT_EVENT_HEADER_STRUCT = struct.Struct('<BB') # ev_type, car_id
+
+# unpack_from y tamaños ligados a nivel de módulo: ahorran los lookups de atributo por paquete.
+_unpack_car_update = CAR_UPDATE_STRUCT.unpack_from
+_unpack_lap_completed = LAP_COMPLETED_STRUCT.unpack_from
+_unpack_client_event_car = CLIENT_EVENT_CAR_STRUCT.unpack_from
+_CAR_UPDATE_SIZE = CAR_UPDATE_STRUCT.size
+_LAP_COMPLETED_SIZE = LAP_COMPLETED_STRUCT.size
+_CLIENT_EVENT_CAR_SIZE = CLIENT_EVENT_CAR_STRUCT.size
+_CE_COLLISION_WITH_CAR = ACSP.CE_COLLISION_WITH_CAR
+_NONE = (None,)
+
+
+def _truncated_codecs(codes):
+    """
+    Para cada longitud disponible menor que el layout completo, reproduce las lecturas
+    read_* en orden: un campo que no cabe queda a None y no avanza el offset, así que
+    un uint8 posterior aún puede leerse. Devuelve por longitud (unpack_from de los
+    campos leídos, itemgetter que intercala los None, bytes consumidos).
+    """
+    full = struct.calcsize('<' + codes)
+    table = []
+    for available in range(full):
+        offset, present, order = 0, [], []
+        for code in codes:
+            size = struct.calcsize('<' + code)
+            if offset + size <= available:
+                order.append(len(present))
+                present.append(code)
+                offset += size
             else:
-                break
-        return res.strip()
+                order.append(None)
+        # Los campos ausentes apuntan al None que se añade al final de lo desempaquetado.
+        getter = itemgetter(*[len(present) if i is None else i for i in order])
+        table.append((struct.Struct('<' + ''.join(present)).unpack_from, getter, offset))
+    return table
+
+
+_CAR_UPDATE_TRUNCATED = _truncated_codecs('BffffffBHf')
+
+
+def read_car_update(parser):
+    """Cuerpo de CAR_UPDATE (53) a partir de parser.offset (tras el byte de tipo)."""
+    offset = parser.offset
+    if parser.size - offset >= _CAR_UPDATE_SIZE:
+        parser.offset = offset + _CAR_UPDATE_SIZE
+        return _tuple_new(CarUpdate, _unpack_car_update(parser.data, offset))
+    unpack, getter, consumed = _CAR_UPDATE_TRUNCATED[parser.size - offset]
+    parser.offset = offset + consumed
+    return _tuple_new(CarUpdate, getter(unpack(parser.data, offset) + _NONE))
+
+
+def read_lap_completed(parser):
+    """Cabecera de LAP_COMPLETED: car_id, lap_time, cuts (el leaderboard que sigue no se lee)."""
+    offset = parser.offset
+    if parser.size - offset >= _LAP_COMPLETED_SIZE:
+        parser.offset = offset + _LAP_COMPLETED_SIZE
+        return _tuple_new(LapCompleted, _unpack_lap_completed(parser.data, offset))
+    # Con tres campos las lecturas sueltas salen más baratas que la tabla de truncados.
+    return _tuple_new(LapCompleted, (parser.read_uint8(), parser.read_uint32(), parser.read_uint8()))
+
+
+def read_client_event(parser):
+    """CLIENT_EVENT (130): other_car_id/impact_speed solo en CE_COLLISION_WITH_CAR."""
+    offset = parser.offset
+    remaining = parser.size - offset
+    if remaining >= 2:
+        # Los dos bytes de cabecera se indexan directamente en el memoryview: más
+        # barato que un unpack_from para dos uint8.
+        data = parser.data
+        ev_type = data[offset]
+        if ev_type != _CE_COLLISION_WITH_CAR:
+            parser.offset = offset + 2
+            return _tuple_new(ClientEvent, (ev_type, data[offset + 1], None, None))
+        if remaining >= _CLIENT_EVENT_CAR_SIZE:
+            parser.offset = offset + _CLIENT_EVENT_CAR_SIZE
+            return _tuple_new(ClientEvent, _unpack_client_event_car(data, offset))
+    ev_type = parser.read_uint8()
+    car_id = parser.read_uint8()
+    if ev_type == ACSP.CE_COLLISION_WITH_CAR:
+        return _tuple_new(ClientEvent, (ev_type, car_id, parser.read_uint8(), parser.read_float()))
+    return _tuple_new(ClientEvent, (ev_type, car_id, None, None))
@@ -0,0 +1,163 @@
+"""
+event_batcher.py
+================
+Micro-batching opcional de los eventos generales (send_server_event) hacia
+SERVER_EVENT_WEBHOOK_URL.
+
+Al empezar una sesión se reconectan 20+ pilotos en pocos segundos y cada
+player_join era un POST. EventBatcher acumula los eventos por servidor durante
+`window_sec` (o hasta `max_events`) y los entrega de una vez a `send_batch(key,
+eventos)`, que manda un único POST con el array.
+
+  - orden: por servidor hay como mucho un lote en vuelo; el siguiente no se
+    programa hasta que termina el anterior, así que los eventos de un servidor
+    llegan en el orden en que se generaron (servidores distintos van en paralelo)
+  - un server_status nuevo sustituye al que siguiera pendiente del mismo servidor
+  - `on_lost` de cada evento se llama si su lote no se admite o `send_batch`
+    devuelve False / lanza (p. ej. para forzar un keyframe de server_status)
+  - un solo hilo vigila las ventanas; el envío va por `submit` (el
+    WebhookDispatcher), con como mucho una tarea por servidor en la cola
+"""
+
+import threading
+import time
+
+
+class _Pending:
+    __slots__ = ("events", "deadline", "in_flight")
+
+    def __init__(self):
+        self.events = []
+        self.deadline = None
+        self.in_flight = False
+
+
+class EventBatcher:
+    def __init__(self, send_batch, submit, window_sec=0.2, max_events=50, name="event-batcher"):
+        self.send_batch = send_batch
+        self.submit = submit
+        self.window_sec = window_sec
+        self.max_events = max(1, max_events)
+        self.name = name
+        self._cond = threading.Condition()
+        self._pending = {}  # key -> _Pending
+        self._thread = None
+        self._stopping = False
+        self.events = 0
+        self.batches = 0
+        self.superseded = 0
+        self.rejected = 0
+        self.max_batch = 0
+
+    def start(self):
+        with self._cond:
+            if self._thread is None:
+                self._stopping = False
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+
+    def add(self, key, event, supersede=None, on_lost=None):
+        """
+        Añade `event` al lote de `key`. Con `supersede` (p. ej. "server_status"), un
+        evento pendiente con la misma marca se retira: solo cuenta el último.
+        """
+        if self._thread is None:
+            self.start()
+        with self._cond:
+            pending = self._pending.get(key)
+            if pending is None:
+                pending = self._pending[key] = _Pending()
+            if supersede is not None:
+                before = len(pending.events)
+                pending.events = [e for e in pending.events if e[0] != supersede]
+                self.superseded += before - len(pending.events)
+            pending.events.append((supersede, event, on_lost))
+            self.events += 1
+            if len(pending.events) >= self.max_events:
+                pending.deadline = 0.0
+                self._cond.notify()
+            elif pending.deadline is None:
+                # Ventana nueva: el hilo recalcula su espera.
+                pending.deadline = time.monotonic() + self.window_sec
+                self._cond.notify()
+
+    def _run(self):
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                wait = None
+                for key, pending in list(self._pending.items()):
+                    if pending.in_flight or not pending.events:
+                        continue
+                    if self._stopping or pending.deadline <= now:
+                        self._dispatch(key, pending)
+                    else:
+                        remaining = pending.deadline - now
+                        wait = remaining if wait is None else min(wait, remaining)
+                if self._stopping and not any(p.events or p.in_flight for p in self._pending.values()):
+                    self._cond.notify_all()
+                    return
+                self._cond.wait(wait)
+
+    def _dispatch(self, key, pending):
+        # Con self._cond tomado.
+        taken = pending.events[: self.max_events]
+        batch = [event for _mark, event, _on_lost in taken]
+        lost = [on_lost for _mark, _event, on_lost in taken if on_lost]
+        pending.events = pending.events[self.max_events:]
+        pending.deadline = time.monotonic() + self.window_sec if pending.events else None
+        pending.in_flight = True
+        self.batches += 1
+        if len(batch) > self.max_batch:
+            self.max_batch = len(batch)
+        if self.submit(self._send, key, batch, lost) is False:
+            # La cola de envío no lo admitió: el lote se pierde, el servidor sigue.
+            pending.in_flight = False
+            self.rejected += len(batch)
+            for on_lost in lost:
+                on_lost()
+
+    def _send(self, key, batch, lost=()):
+        ok = False
+        try:
+            ok = self.send_batch(key, batch) is not False
+            return ok
+        finally:
+            if not ok:
+                for on_lost in lost:
+                    on_lost()
+            with self._cond:
+                pending = self._pending.get(key)
+                if pending is not None:
+                    pending.in_flight = False
+                    if pending.events and len(pending.events) >= self.max_events:
+                        pending.deadline = 0.0
+                    elif not pending.events:
+                        del self._pending[key]
+                self._cond.notify_all()
+
+    def stop(self, timeout=10.0) -> bool:
+        """Envía lo pendiente sin esperar a la ventana y espera a que termine (idempotente)."""
+        with self._cond:
+            thread = self._thread
+            if thread is None:
+                return True
+            self._stopping = True
+            self._cond.notify_all()
+        thread.join(timeout)
+        with self._cond:
+            self._thread = None
+            left = sum(len(p.events) + (1 if p.in_flight else 0) for p in self._pending.values())
+        if left:
+            print(f"⚠️ [{self.name}] Parada con {left} evento(s)/lote(s) sin enviar")
+        return not left
+
+    def summary(self) -> str:
+        with self._cond:
+            pending = sum(len(p.events) for p in self._pending.values())
+            per_batch = self.events / self.batches if self.batches else 0.0
+            return (
+                f"{self.name}: eventos={self.events} lotes={self.batches} ({per_batch:.1f}/lote, "
+                f"máx {self.max_batch}) pendientes={pending} sustituidos={self.superseded} "
+                f"rechazados={self.rejected}"
+            )
@@ -17,49 +17,305 @@ To add a new event type:
 
 import os
 import threading
+import time
+from http.cookiejar import DefaultCookiePolicy
+from urllib.parse import urlsplit
+
 import requests
+from requests.adapters import HTTPAdapter
+
 from db.database import get_active_server_event
+from network.event_batcher import EventBatcher
+from network.webhook_spool import WebhookSpool
+from network.webhook_dispatcher import CRITICAL, NORMAL, STATUS, WebhookDispatcher
 
 ACAPI_KEY      = os.getenv("API_KEY", "")
 WEBHOOK_SECRET = os.getenv("EVENT_WEBHOOK_SECRET", "default_secret")
 # Node.js backend URL for general server events
 GENERAL_WEBHOOK_URL = os.getenv("SERVER_EVENT_WEBHOOK_URL")
 
+# Shared keep-alive client: number of per-host pools kept and connections per host.
+WEBHOOK_POOL_HOSTS       = int(os.getenv("WEBHOOK_POOL_HOSTS", "10"))
+WEBHOOK_POOL_MAXSIZE     = int(os.getenv("WEBHOOK_POOL_MAXSIZE", "16"))
+WEBHOOK_CONNECT_TIMEOUT  = float(os.getenv("WEBHOOK_CONNECT_TIMEOUT", "3"))
+WEBHOOK_READ_TIMEOUT     = float(os.getenv("WEBHOOK_READ_TIMEOUT", "10"))
+GENERAL_WEBHOOK_TIMEOUT  = float(os.getenv("GENERAL_WEBHOOK_TIMEOUT", "5"))
+# Bounded delivery: fixed worker threads and queue size (see webhook_dispatcher.py).
+WEBHOOK_WORKERS          = int(os.getenv("WEBHOOK_WORKERS", "8"))
+WEBHOOK_QUEUE_SIZE       = int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000"))
+WEBHOOK_DRAIN_TIMEOUT    = float(os.getenv("WEBHOOK_DRAIN_TIMEOUT_SEC", "10"))
+# Opt-in micro-batching of general events: one POST with a JSON array per server
+# every BATCH_WINDOW_MS (or BATCH_MAX events). The backend must accept arrays.
+GENERAL_WEBHOOK_BATCH            = os.getenv("GENERAL_WEBHOOK_BATCH", "false").lower() == "true"
+GENERAL_WEBHOOK_BATCH_WINDOW_MS  = float(os.getenv("GENERAL_WEBHOOK_BATCH_WINDOW_MS", "250"))
+GENERAL_WEBHOOK_BATCH_MAX        = int(os.getenv("GENERAL_WEBHOOK_BATCH_MAX", "50"))
+# Durable delivery for event progress and battle results (see webhook_spool.py).
+WEBHOOK_SPOOL_ENABLED    = os.getenv("WEBHOOK_SPOOL_ENABLED", "true").lower() == "true"
+WEBHOOK_SPOOL_PATH       = os.getenv(
+    "WEBHOOK_SPOOL_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "webhook_spool.sqlite3"),
+)
+WEBHOOK_RETRY_BASE_SEC   = float(os.getenv("WEBHOOK_RETRY_BASE_SEC", "1"))
+WEBHOOK_RETRY_MAX_SEC    = float(os.getenv("WEBHOOK_RETRY_MAX_SEC", "300"))
+WEBHOOK_REPLAY_BATCH     = int(os.getenv("WEBHOOK_REPLAY_BATCH", "50"))
+WEBHOOK_REPLAY_RATE      = float(os.getenv("WEBHOOK_REPLAY_RATE", "10"))
+
+
+# ─────────────────────────────────────────────────────────────
+# Shared HTTP client (keep-alive, per-host connection pools)
+# ─────────────────────────────────────────────────────────────
+
+class WebhookClient:
+    """
+    One requests.Session shared by every dispatch thread. Module-level
+    requests.post() built a new Session per call, so each event paid a fresh
+    TCP (and TLS) handshake to the backend; here urllib3 keeps up to
+    `pool_maxsize` idle connections per host and reuses them.
+
+    Cookies are disabled (the shared jar is the only part of a Session that is
+    not safe to mutate from several threads, and webhooks don't need it).
+    Latency, errors and connection reuse are tracked per destination
+    (scheme://host:port).
+    """
+
+    def __init__(self, pool_hosts=10, pool_maxsize=16, connect_timeout=3.0, read_timeout=10.0):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self._adapter = HTTPAdapter(pool_connections=pool_hosts, pool_maxsize=pool_maxsize, max_retries=0)
+        self._session = requests.Session()
+        self._session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+        self._session.mount("http://", self._adapter)
+        self._session.mount("https://", self._adapter)
+        self._lock = threading.Lock()
+        self._stats = {}  # destination -> [sent, errors, total_ms, max_ms, last_ms]
+
+    def post(self, url, payload, secret, timeout=None, headers=None):
+        """POST JSON with the webhook secret header; raises like requests.post."""
+        destination = _destination(url)
+        request_headers = {
+            "Content-Type": "application/json",
+            "x-webhook-secret": secret,
+        }
+        if headers:
+            request_headers.update(headers)
+        t0 = time.perf_counter()
+        try:
+            resp = self._session.post(
+                url,
+                json=payload,
+                headers=request_headers,
+                timeout=(self.connect_timeout, timeout or self.read_timeout),
+            )
+        except Exception:
+            self._record(destination, (time.perf_counter() - t0) * 1000.0, error=True)
+            raise
+        self._record(destination, (time.perf_counter() - t0) * 1000.0, error=resp.status_code >= 400)
+        return resp
+
+    def _record(self, destination, elapsed_ms, error):
+        with self._lock:
+            entry = self._stats.get(destination)
+            if entry is None:
+                entry = self._stats[destination] = [0, 0, 0.0, 0.0, 0.0]
+            entry[0] += 1
+            if error:
+                entry[1] += 1
+            entry[2] += elapsed_ms
+            if elapsed_ms > entry[3]:
+                entry[3] = elapsed_ms
+            entry[4] = elapsed_ms
+
+    def _connections(self):
+        """destination -> TCP connections opened by urllib3 (requests - connections = reused)."""
+        opened = {}
+        pools = self._adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            conn_pool = pools.get(key)
+            if conn_pool is None:
+                continue
+            destination = f"{key.key_scheme}://{key.key_host}:{key.key_port}"
+            opened[destination] = opened.get(destination, 0) + conn_pool.num_connections
+        return opened
+
+    def stats(self) -> dict:
+        opened = self._connections()
+        with self._lock:
+            return {
+                destination: {
+                    "sent": sent,
+                    "errors": errors,
+                    "avg_ms": total_ms / sent if sent else 0.0,
+                    "max_ms": max_ms,
+                    "last_ms": last_ms,
+                    "connections": opened.get(destination, 0),
+                }
+                for destination, (sent, errors, total_ms, max_ms, last_ms) in self._stats.items()
+            }
+
+    def summary(self) -> str:
+        stats = self.stats()
+        if not stats:
+            return "webhooks: sin envíos"
+        parts = []
+        for destination, s in sorted(stats.items()):
+            reused = s["sent"] - s["connections"]
+            parts.append(
+                f"{destination} enviados={s['sent']} errores={s['errors']} "
+                f"media={s['avg_ms']:.1f}ms max={s['max_ms']:.1f}ms conexiones={s['connections']} "
+                f"reutilizadas={max(0, reused)}"
+            )
+        return " | ".join(parts)
+
+    def close(self):
+        self._session.close()
+
+
+def _destination(url):
+    parts = urlsplit(url)
+    port = parts.port or (443 if parts.scheme == "https" else 80)
+    return f"{parts.scheme}://{(parts.hostname or '').lower()}:{port}"
+
+
+http_client = WebhookClient(
+    pool_hosts=WEBHOOK_POOL_HOSTS,
+    pool_maxsize=WEBHOOK_POOL_MAXSIZE,
+    connect_timeout=WEBHOOK_CONNECT_TIMEOUT,
+    read_timeout=WEBHOOK_READ_TIMEOUT,
+)
+
+
+dispatcher = WebhookDispatcher("webhooks", workers=WEBHOOK_WORKERS, max_queue=WEBHOOK_QUEUE_SIZE)
+
+
+def battle_webhook_secret():
+    return (
+        (os.getenv("BATTLE_WEBHOOK_SECRET") or "").strip()
+        or (os.getenv("battle_webhook_secret") or "").strip()
+        or None
+    )
+
+
+# Secrets are never written to the spool: rows carry one of these names and the
+# secret is read from the environment at send time (None = WEBHOOK_SECRET).
+BATTLE_SECRET_REF = "battle"
+_SPOOL_SECRETS = {
+    None: lambda: None,
+    BATTLE_SECRET_REF: battle_webhook_secret,
+}
+
+
+def _send_durable(url, secret_ref, payload, idempotency_key):
+    secret = _SPOOL_SECRETS[secret_ref]() if secret_ref in _SPOOL_SECRETS else secret_ref  # rows from older versions
+    return http_client.post(url, payload, secret or WEBHOOK_SECRET, headers={"Idempotency-Key": idempotency_key})
+
+
+webhook_spool = WebhookSpool(
+    WEBHOOK_SPOOL_PATH,
+    _send_durable,
+    batch_size=WEBHOOK_REPLAY_BATCH,
+    rate_per_sec=WEBHOOK_REPLAY_RATE,
+    base_backoff=WEBHOOK_RETRY_BASE_SEC,
+    max_backoff=WEBHOOK_RETRY_MAX_SEC,
+)
+
+
+def start_webhook_delivery():
+    """Opens the on-disk spool and starts replaying anything left from a previous run."""
+    if WEBHOOK_SPOOL_ENABLED:
+        webhook_spool.start()
+
+
+def _send_general_batch(server_key, payloads):
+    try:
+        resp = http_client.post(GENERAL_WEBHOOK_URL, payloads, WEBHOOK_SECRET, timeout=GENERAL_WEBHOOK_TIMEOUT)
+        if resp.status_code >= 400:
+            print(f"⚠️ [GENERAL-WEBHOOK] Batch of {len(payloads)} for server '{server_key}' failed with {resp.status_code}: {resp.text}")
+            return False
+    except Exception as e:
+        print(f"❌ [GENERAL-WEBHOOK] Network error dispatching batch of {len(payloads)} for server '{server_key}': {e}")
+        return False
+    return True
+
+
+# One batch task per server at a time, so it is never dropped by the queue.
+general_batcher = EventBatcher(
+    _send_general_batch,
+    lambda fn, *args: dispatcher.submit(CRITICAL, fn, *args),
+    window_sec=GENERAL_WEBHOOK_BATCH_WINDOW_MS / 1000.0,
+    max_events=GENERAL_WEBHOOK_BATCH_MAX,
+    name="general-batcher",
+) if GENERAL_WEBHOOK_BATCH else None
+
+
+def webhook_client_stats() -> str:
+    stats = f"{dispatcher.summary()} | {http_client.summary()}"
+    if general_batcher is not None:
+        stats += f" | {general_batcher.summary()}"
+    if WEBHOOK_SPOOL_ENABLED:
+        stats += f" | {webhook_spool.summary()}"
+    return stats
+
+
+def drain_webhooks():
+    """Sends what is still queued (bounded by WEBHOOK_DRAIN_TIMEOUT_SEC) on shutdown."""
+    if general_batcher is not None:
+        general_batcher.stop(WEBHOOK_DRAIN_TIMEOUT)
+    dispatcher.stop(WEBHOOK_DRAIN_TIMEOUT)
+    webhook_spool.stop()
+
+
+def _event_class(event_type):
+    if event_type in ("server_status", "server_status_delta"):
+        return STATUS
+    if event_type == "lap_completed":
+        return CRITICAL
+    return NORMAL
+
 # ─────────────────────────────────────────────────────────────
 # General Server Event Dispatcher
 # ─────────────────────────────────────────────────────────────
 
-def send_server_event(event_type, server_name, data):
+def send_server_event(event_type, server_name, data, on_lost=None, server_key=None):
     """
     Dispatches a general server event (player_join, player_leave, lap_completed, server_status)
     to the centralized Node.js backend.
+    With GENERAL_WEBHOOK_BATCH=true the payload is queued in the server's batch instead.
+    on_lost() is called if the event is dropped by the queue or its delivery fails.
+    server_key identifies the server for batching (its UDP port): callers pass the
+    session name or the .ini name as server_name, and both must share one batch.
     """
+    payload = {
+        "event": event_type,
+        "serverName": server_name,
+        "data": data
+    }
+    # Omit serverName for lap_completed as requested by spec (it only asks for data inside lap_completed)
+    if event_type == "lap_completed":
+        del payload["serverName"]
+
+    if general_batcher is not None:
+        batch_key = server_key if server_key is not None else server_name
+        general_batcher.add(batch_key, payload, supersede="server_status" if event_type == "server_status" else None,
+                            on_lost=on_lost)
+        return
+
     def _send():
         try:
-            payload = {
-                "event": event_type,
-                "serverName": server_name,
-                "data": data
-            }
-            # Omit serverName for lap_completed as requested by spec (it only asks for data inside lap_completed)
-            if event_type == "lap_completed":
-                del payload["serverName"]
-                
-            resp = requests.post(
-                GENERAL_WEBHOOK_URL,
-                json=payload,
-                headers={
-                    "Content-Type": "application/json",
-                    "x-webhook-secret": WEBHOOK_SECRET
-                },
-                timeout=5
-            )
+            resp = http_client.post(GENERAL_WEBHOOK_URL, payload, WEBHOOK_SECRET, timeout=GENERAL_WEBHOOK_TIMEOUT)
             if resp.status_code >= 400:
                 print(f"⚠️ [GENERAL-WEBHOOK] {event_type} failed with {resp.status_code}: {resp.text}")
+                ok = False
+            else:
+                ok = True
         except Exception as e:
             print(f"❌ [GENERAL-WEBHOOK] Network error dispatching '{event_type}': {e}")
+            ok = False
+        if not ok and on_lost:
+            on_lost()
+        return ok
 
-    threading.Thread(target=_send, daemon=True).start()
+    if not dispatcher.submit(_event_class(event_type), _send, on_drop=on_lost):
+        print(f"⚠️ [GENERAL-WEBHOOK] Queue full, dropped '{event_type}'")
 
 
 # ─────────────────────────────────────────────────────────────
@@ -147,24 +403,21 @@ def dispatch_event(server_state, driver, lap_time_ms=None, drift_score=None, is_
                 print(f"⚠️  [{server_state.port}] [EVENTS] Unknown event type: '{event_type}'. Skipping dispatch.")
                 return
 
-            resp = requests.post(
-                webhook_url,
-                json=payload,
-                headers={
-                    "Content-Type":     "application/json",
-                    "x-webhook-secret": WEBHOOK_SECRET,
-                },
-                timeout=10
-            )
+            resp = webhook_spool.deliver(webhook_url, None, payload, f"EVENT:{event_type}")
+            if resp is None:
+                return True  # Stored in the spool for retry
             print(
                 f"📡 [{server_state.port}] [EVENT:{event_type}] → HTTP {resp.status_code} "
                 f"| {driver.name} lap #{driver.lap_count} ({lap_time_ms}ms)"
             )
+            return resp.status_code < 400
 
         except Exception as e:
             print(f"❌ [{server_state.port}] [EVENTS] Error dispatching: {e}")
+            return False
 
-    threading.Thread(target=_send, daemon=True).start()
+    if not dispatcher.submit(CRITICAL, _send):
+        print(f"⚠️ [{server_state.port}] [EVENTS] Queue full, dropped event update for {driver.name}")
 
 def dispatch_battle_webhook(server_state, battle_config, p1_score, p2_score, winner_guid, points_log):
     """
@@ -176,7 +429,7 @@ def dispatch_battle_webhook(server_state, battle_config, p1_score, p2_score, win
             if not webhook_url:
                 return
             
-            secret = battle_config.get("webhook_secret") or WEBHOOK_SECRET
+            secret = battle_config.get("webhook_secret")
 
             # Prepare telemetry info
             p1_guid = battle_config.get("player1_steam_id")
@@ -211,19 +464,22 @@ def dispatch_battle_webhook(server_state, battle_config, p1_score, p2_score, win
             if winner_guid:
                 payload["winnerSteamId"] = winner_guid
 
-            resp = requests.post(
-                webhook_url,
-                json=payload,
-                headers={
-                    "Content-Type": "application/json",
-                    "x-webhook-secret": secret,
-                },
-                timeout=10
-            )
+            if winner_guid and secret == battle_webhook_secret():
+                # Final result: retried from the spool until the backend accepts it.
+                resp = webhook_spool.deliver(webhook_url, BATTLE_SECRET_REF, payload, "BATTLE-RESULT")
+            else:
+                # Secrets that can't be resolved from the environment are never spooled.
+                resp = http_client.post(webhook_url, payload, secret or WEBHOOK_SECRET)
 
+            if resp is None:
+                return True  # Stored in the spool for retry
             print(f"📡 [{server_state.port}] [BATTLE-WEBHOOK] → HTTP {resp.status_code} | Status: {status}")
+            return resp.status_code < 400
 
         except Exception as e:
             print(f"❌ [{server_state.port}] [BATTLE-WEBHOOK] Error dispatching: {e}")
+            return False
 
-    threading.Thread(target=_send, daemon=True).start()
+    # Live scores are superseded by the next update; the final result is never dropped.
+    if not dispatcher.submit(CRITICAL if winner_guid else NORMAL, _send):
+        print(f"⚠️ [{server_state.port}] [BATTLE-WEBHOOK] Queue full, dropped live score update")
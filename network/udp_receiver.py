@@ -0,0 +1,98 @@
+"""
+udp_receiver.py
+===============
+Lectura por lotes de los sockets UDP del plugin de AC.
+
+En cada wakeup de select/epoll se vacía el socket en modo no bloqueante hasta
+RECV_BATCH_BUDGET datagramas, en lugar de leer uno solo y volver a select. El
+tamaño de cada lote se contabiliza en BatchStats para ver dónde satura el loop
+(lotes que agotan el presupuesto = el kernel tiene más datos esperando).
+
+Cada socket lee con recvfrom_into sobre un RecvBuffer preasignado: no se crea un
+`bytes` por datagrama. La vista entregada solo es válida hasta la siguiente lectura,
+así que el consumidor debe procesarla (o copiarla) antes de pedir el siguiente.
+"""
+
+import os
+
+RECV_BUFFER_SIZE = 4096
+RECV_BATCH_BUDGET = max(1, int(os.getenv("RECV_BATCH_BUDGET", "64")))
+
+
+class BatchStats:
+    """Histograma de tamaños de lote por socket (buckets potencia de 2)."""
+
+    BUCKET_LABELS = ("1", "2-3", "4-7", "8-15", "16-31", "32-63", "64-127", "128+")
+
+    def __init__(self):
+        self.wakeups = 0
+        self.packets = 0
+        self.saturated = 0
+        self.max_batch = 0
+        self.histogram = [0] * len(self.BUCKET_LABELS)
+
+    def record(self, batch_size, budget=RECV_BATCH_BUDGET):
+        if batch_size <= 0:
+            return
+        self.wakeups += 1
+        self.packets += batch_size
+        if batch_size > self.max_batch:
+            self.max_batch = batch_size
+        if batch_size >= budget:
+            self.saturated += 1
+        idx = min(batch_size.bit_length() - 1, len(self.histogram) - 1)
+        self.histogram[idx] += 1
+
+    def summary(self):
+        if not self.wakeups:
+            return "sin tráfico"
+        avg = self.packets / self.wakeups
+        sat_pct = 100.0 * self.saturated / self.wakeups
+        hist = " ".join(
+            f"{label}:{n}" for label, n in zip(self.BUCKET_LABELS, self.histogram) if n
+        )
+        return (
+            f"wakeups={self.wakeups} pkts={self.packets} avg={avg:.1f} max={self.max_batch} "
+            f"saturados={sat_pct:.1f}% | {hist}"
+        )
+
+
+class RecvBuffer:
+    """bytearray preasignado + memoryview reutilizable para recvfrom_into."""
+
+    __slots__ = ("buf", "view")
+
+    def __init__(self, size=RECV_BUFFER_SIZE):
+        self.buf = bytearray(size)
+        self.view = memoryview(self.buf)
+
+
+def iter_datagrams(sock, recv_buffer, budget=RECV_BATCH_BUDGET):
+    """
+    Lee hasta `budget` datagramas sin bloquear y produce (memoryview, addr) por cada uno.
+    La vista apunta a recv_buffer y se sobrescribe en la siguiente iteración.
+    """
+    buf = recv_buffer.buf
+    view = recv_buffer.view
+    for _ in range(budget):
+        try:
+            nbytes, addr = sock.recvfrom_into(buf)
+        except (BlockingIOError, InterruptedError):
+            return
+        except ConnectionResetError:
+            # This happen on Windows if a previous sendto() failed (ICMP Port Unreachable).
+            # It's safe to ignore for UDP.
+            continue
+        except OSError as e:
+            # ENOBUFS, ECONNREFUSED...: se registra y se cierra el lote; el siguiente
+            # wakeup vuelve a leer. Que escape mataría el hilo que atiende el socket.
+            print(f"⚠️ [{_port(sock)}] Error leyendo UDP: {e}")
+            return
+        yield view[:nbytes], addr
+
+
+def _port(sock):
+    try:
+        return sock.getsockname()[1]
+    except OSError:
+        return "?"
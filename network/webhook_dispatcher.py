@@ -0,0 +1,210 @@
+"""
+webhook_dispatcher.py
+=====================
+Cola acotada + pool fijo de hilos para los webhooks de event_dispatcher.py.
+
+Antes cada player_join/leave, vuelta, purga de fantasmas y server_status (cada 15 s
+por servidor) abría un threading.Thread. Con el backend lento (timeouts de 10 s)
+los hilos se acumulaban sin límite. WebhookDispatcher mantiene `workers` hilos y
+una cola FIFO de `max_queue` tareas con política de desborde por clase:
+
+  status    server_status (keyframe o delta): al llenarse la cola se descarta el
+            status más antiguo (el siguiente lo sustituye de todas formas)
+  normal    join/leave, marcadores de batalla en curso: desaloja el status más
+            antiguo o, si no queda ninguno, el normal más antiguo
+  critical  vueltas, progreso de eventos y resultados de batalla: nunca se
+            descartan; si hace falta se admiten por encima de `max_queue`
+            (contados en `over_capacity`)
+
+El orden de entrega es el de llegada (una sola cola); los desalojos marcan la
+tarea como muerta y los workers la saltan, y `on_drop` avisa a quien la encoló
+(p. ej. para forzar un keyframe de server_status). stop() drena lo pendiente
+con límite de tiempo al apagar.
+
+Una tarea cuenta como fallida si lanza o devuelve False (las de
+event_dispatcher.py registran su propio error y devuelven False).
+"""
+
+import threading
+import time
+from collections import deque
+
+STATUS = "status"
+NORMAL = "normal"
+CRITICAL = "critical"
+_DROP_ORDER = (STATUS, NORMAL)
+
+
+class _Task:
+    __slots__ = ("kind", "fn", "args", "alive", "on_drop")
+
+    def __init__(self, kind, fn, args, on_drop=None):
+        self.kind = kind
+        self.fn = fn
+        self.args = args
+        self.alive = True
+        self.on_drop = on_drop
+
+
+class WebhookDispatcher:
+    def __init__(self, name="webhooks", workers=8, max_queue=1000):
+        self.name = name
+        self.workers = max(1, workers)
+        self.max_queue = max(1, max_queue)
+        self._cond = threading.Condition()
+        self._queue = deque()                                   # orden de llegada
+        self._by_kind = {STATUS: deque(), NORMAL: deque()}      # candidatas a desalojo
+        self._depth = 0                                         # tareas vivas en cola
+        self._in_flight = 0
+        self._threads = []
+        self._stopping = False
+        self.submitted = 0
+        self.sent = 0
+        self.failed = 0
+        self.over_capacity = 0
+        self.max_depth = 0
+        self.dropped = {STATUS: 0, NORMAL: 0}
+
+    def start(self):
+        with self._cond:
+            if self._threads:
+                return
+            self._stopping = False
+            for i in range(self.workers):
+                t = threading.Thread(target=self._run, name=f"{self.name}-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def submit(self, kind, fn, *args, on_drop=None) -> bool:
+        """
+        Encola fn(*args); False si se descartó por la política de desborde.
+        `on_drop()` se llama si la tarea se descarta, al encolarla o desalojada después.
+        """
+        if not self._threads:
+            self.start()
+        task = _Task(kind, fn, args, on_drop)
+        victim = None
+        with self._cond:
+            self.submitted += 1
+            if self._depth >= self.max_queue:
+                admitted, victim = self._make_room(kind)
+                if not admitted:
+                    self.dropped[kind] += 1
+                    task = None
+            if task is not None:
+                if self._depth >= self.max_queue:
+                    self.over_capacity += 1
+                self._queue.append(task)
+                victims = self._by_kind.get(kind)
+                if victims is not None:
+                    # Las ya enviadas quedan al principio (FIFO): se podan aquí.
+                    while victims and not victims[0].alive:
+                        victims.popleft()
+                    victims.append(task)
+                self._depth += 1
+                if self._depth > self.max_depth:
+                    self.max_depth = self._depth
+                self._cond.notify()
+        # Los avisos van fuera del lock: pueden tomar otros (p. ej. el del encoder de status).
+        if victim is not None and victim.on_drop:
+            victim.on_drop()
+        if task is None:
+            if on_drop:
+                on_drop()
+            return False
+        return True
+
+    def _make_room(self, kind):
+        """(admitida, tarea desalojada o None)."""
+        # status solo desaloja status; normal y critical desalojan status y luego
+        # normal; critical entra igualmente por encima del límite.
+        allowed = (STATUS,) if kind == STATUS else _DROP_ORDER
+        for victim_kind in allowed:
+            victims = self._by_kind[victim_kind]
+            while victims:
+                victim = victims.popleft()
+                if victim.alive:
+                    victim.alive = False
+                    victim.fn = victim.args = None
+                    self._depth -= 1
+                    self.dropped[victim_kind] += 1
+                    return True, victim
+        return kind == CRITICAL, None
+
+    def _next(self):
+        with self._cond:
+            while True:
+                while self._queue:
+                    task = self._queue.popleft()
+                    if not task.alive:
+                        continue
+                    task.alive = False
+                    self._depth -= 1
+                    self._in_flight += 1
+                    return task
+                if self._stopping:
+                    return None
+                self._cond.wait()
+
+    def _run(self):
+        while True:
+            task = self._next()
+            if task is None:
+                return
+            try:
+                # Las tareas que capturan sus propios errores devuelven False al fallar.
+                ok = task.fn(*task.args) is not False
+            except Exception as e:
+                ok = False
+                print(f"❌ [{self.name}] Error en webhook ({task.kind}): {e}")
+            with self._cond:
+                self._in_flight -= 1
+                if ok:
+                    self.sent += 1
+                else:
+                    self.failed += 1
+                self._cond.notify_all()
+
+    def stop(self, timeout=10.0) -> bool:
+        """Drena la cola (hasta `timeout` s) y para los workers (idempotente)."""
+        if not self._threads:
+            return True
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self._depth or self._in_flight:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            drained = not (self._depth or self._in_flight)
+            pending = self._depth + self._in_flight
+            self._stopping = True
+            self._cond.notify_all()
+        for t in self._threads:
+            t.join(max(0.0, deadline - time.monotonic()) or 0.1)
+        self._threads = []
+        if not drained:
+            print(f"⚠️ [{self.name}] Parada con {pending} webhook(s) sin enviar")
+        return drained
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "depth": self._depth,
+                "in_flight": self._in_flight,
+                "max_depth": self.max_depth,
+                "submitted": self.submitted,
+                "sent": self.sent,
+                "failed": self.failed,
+                "over_capacity": self.over_capacity,
+                "dropped_status": self.dropped[STATUS],
+                "dropped_normal": self.dropped[NORMAL],
+            }
+
+    def summary(self) -> str:
+        s = self.stats()
+        return (
+            f"{self.name}: cola={s['depth']}/{self.max_queue} (máx {s['max_depth']}) en vuelo={s['in_flight']} "
+            f"enviados={s['sent']} fallos={s['failed']} descartados status={s['dropped_status']} "
+            f"normal={s['dropped_normal']} sobre_límite={s['over_capacity']}"
+        )
@@ -0,0 +1,219 @@
+"""
+webhook_spool.py
+================
+Entrega durable de webhooks: reintento con backoff exponencial + spool en disco.
+
+Si el backend Node o el endpoint de Convex devolvía 5xx o no respondía,
+dispatch_event / dispatch_battle_webhook registraban el error y el payload (progreso
+de vuelta, resultado de batalla) se perdía. WebhookSpool.deliver() envía en vivo y,
+ante un fallo transitorio, guarda el webhook en un SQLite local (db/outbox.py, una
+fila por webhook con la destinación host:puerto como `kind`). Un hilo lo reenvía:
+
+  - cada webhook lleva un `Idempotency-Key` generado en el primer intento y
+    reutilizado en todos los reintentos: el backend puede descartar duplicados
+    (p. ej. si se cayó tras procesar pero antes de responder)
+  - transitorio = error de red/timeout, 5xx, 408, 425 o 429; cualquier otro 4xx se
+    descarta (el backend nunca lo aceptará) y se registra
+  - backoff exponencial con jitter POR DESTINO (base·2^n, máx. `max_backoff`, ×0.5–1):
+    un backend caído no frena los webhooks de otro
+  - el replay va en lotes de `batch_size` y como mucho `rate_per_sec` envíos por
+    segundo, para que un atraso acumulado no sature al backend recién recuperado
+  - mientras un destino tenga filas en el spool, lo nuevo para ese destino entra
+    detrás de ellas (se conserva el orden)
+  - el secreto no se guarda en disco: cada fila lleva solo una referencia
+    (`secret_ref`) que `send` resuelve desde el entorno al enviar
+"""
+
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+from uuid import uuid4
+
+from db.outbox import SQLiteOutbox
+
+_RETRYABLE_STATUS = (408, 425, 429)
+
+
+def is_retryable_status(status_code) -> bool:
+    return status_code >= 500 or status_code in _RETRYABLE_STATUS
+
+
+def _destination(url):
+    return urlsplit(url).netloc.lower()
+
+
+class WebhookSpool:
+    def __init__(self, path, send, batch_size=50, rate_per_sec=10.0, base_backoff=1.0, max_backoff=300.0,
+                 name="webhook-spool"):
+        self.path = path
+        self.send = send  # send(url, secret_ref, payload, idempotency_key) -> requests.Response
+        self.batch_size = max(1, batch_size)
+        self.rate_per_sec = rate_per_sec
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.name = name
+        self._outbox = None
+        self._lock = threading.Lock()  # protege _pending y _backoff (deliver, replay y summary)
+        self._pending = {}  # destino -> filas en el spool
+        self._backoff = {}  # destino -> (reintentar_en, fallos seguidos)
+        self._stop = threading.Event()
+        self._thread = None
+        self.live = 0
+        self.spooled = 0
+        self.replayed = 0
+        self.dropped = 0
+
+    def start(self):
+        """Abre el spool y arranca el replay (reenvía también lo que quedó de la ejecución anterior)."""
+        if self._thread is not None:
+            return
+        try:
+            self._outbox = SQLiteOutbox(self.path)
+            self._pending = self._outbox.count_by_kind()
+        except Exception as e:
+            self._outbox = None
+            print(f"⚠️ [{self.name}] Spool no disponible ({self.path}: {e}); los webhooks fallidos se perderán.")
+            return
+        if self._outbox.pending:
+            print(f"📦 [{self.name}] {self._outbox.pending} webhook(s) pendientes de la ejecución anterior")
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._replay_loop, name=self.name, daemon=True)
+        self._thread.start()
+
+    def deliver(self, url, secret_ref, payload, label):
+        """
+        Envía el webhook; ante un fallo transitorio lo deja en el spool. Devuelve la
+        respuesta (None si no hubo) y relanza el error de red solo si no hay spool.
+        """
+        key = uuid4().hex
+        destination = _destination(url)
+        if self._outbox is not None:
+            with self._lock:
+                behind = bool(self._pending.get(destination))
+            if behind:
+                self._put(destination, url, secret_ref, payload, key, label, "hay pendientes por delante")
+                return None
+        try:
+            resp = self.send(url, secret_ref, payload, key)
+        except Exception as e:
+            if self._outbox is None:
+                raise
+            self._put(destination, url, secret_ref, payload, key, label, str(e))
+            return None
+        if is_retryable_status(resp.status_code) and self._outbox is not None:
+            self._put(destination, url, secret_ref, payload, key, label, f"HTTP {resp.status_code}")
+        else:
+            self.live += 1
+        return resp
+
+    def _put(self, destination, url, secret_ref, payload, key, label, reason):
+        try:
+            self._outbox.put_many([(destination, (url, secret_ref, payload, key, label))])
+        except Exception as e:
+            self.dropped += 1
+            print(f"❌ [{self.name}] No se pudo guardar {label} para {destination}: {e}")
+            return
+        with self._lock:
+            self._pending[destination] = self._pending.get(destination, 0) + 1
+            self.spooled += 1
+        print(f"📦 [{self.name}] {label} → {destination} guardado para reintento ({reason})")
+
+    def _delay(self, failures):
+        delay = min(self.max_backoff, self.base_backoff * (2 ** (failures - 1)))
+        return delay * random.uniform(0.5, 1.0)
+
+    def _blocked(self):
+        now = time.monotonic()
+        with self._lock:
+            return {d for d, (until, _n) in self._backoff.items() if until > now}
+
+    def _replay_loop(self):
+        interval = 1.0 / self.rate_per_sec if self.rate_per_sec > 0 else 0.0
+        while not self._stop.is_set():
+            if not self._outbox.pending:
+                self._stop.wait(1.0)
+                continue
+            blocked = self._blocked()
+            try:
+                # Solo filas de destinos fuera de backoff: uno caído no tapa a los demás.
+                rows = self._outbox.peek(self.batch_size, exclude_kinds=blocked)
+            except Exception as e:
+                print(f"❌ [{self.name}] Error leyendo el spool: {e}")
+                self._stop.wait(self.base_backoff)
+                continue
+            done = []
+            attempts = 0
+            for row_id, destination, (url, secret_ref, payload, key, label) in rows:
+                if self._stop.is_set():
+                    break
+                if destination in blocked:
+                    continue
+                attempts += 1
+                try:
+                    resp = self.send(url, secret_ref, payload, key)
+                    status, error = resp.status_code, None
+                except Exception as e:
+                    status, error = None, e
+                if status is not None and not is_retryable_status(status):
+                    done.append((row_id, destination))
+                    if status >= 400:
+                        self.dropped += 1
+                        print(f"❌ [{self.name}] {label} → {destination} rechazado con HTTP {status}; descartado")
+                    else:
+                        self.replayed += 1
+                    with self._lock:
+                        recovered = self._backoff.pop(destination, None)
+                    if recovered:
+                        print(f"✅ [{self.name}] {destination} disponible de nuevo; reenviando spool")
+                else:
+                    with self._lock:
+                        failures = self._backoff.get(destination, (0.0, 0))[1] + 1
+                        delay = self._delay(failures)
+                        self._backoff[destination] = (time.monotonic() + delay, failures)
+                    blocked.add(destination)
+                    if failures == 1:
+                        reason = f"HTTP {status}" if status is not None else error
+                        print(f"⚠️ [{self.name}] {destination} sigue fallando ({reason}); "
+                              f"reintento en {delay:.1f}s con backoff")
+                if interval:
+                    self._stop.wait(interval)
+            if done:
+                try:
+                    self._outbox.delete([row_id for row_id, _d in done])
+                except Exception as e:
+                    print(f"❌ [{self.name}] Error borrando {len(done)} fila(s) reenviadas del spool: {e}")
+                    self._stop.wait(self.base_backoff)
+                    continue
+                with self._lock:
+                    for _row_id, destination in done:
+                        left = self._pending.get(destination, 0) - 1
+                        if left > 0:
+                            self._pending[destination] = left
+                        else:
+                            self._pending.pop(destination, None)
+            elif not attempts:
+                now = time.monotonic()
+                with self._lock:
+                    waits = [until - now for until, _n in self._backoff.values()]
+                self._stop.wait(min([1.0] + [w for w in waits if w > 0]))
+
+    def stop(self, timeout=5.0):
+        """Para el replay; lo que quede en el spool se reenvía al arrancar de nuevo."""
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+        self._thread = None
+        if self._outbox is not None and self._outbox.pending:
+            print(f"📦 [{self.name}] {self._outbox.pending} webhook(s) quedan en el spool para el próximo arranque")
+
+    def summary(self) -> str:
+        if self._outbox is None:
+            return f"{self.name}: deshabilitado"
+        with self._lock:
+            backing_off = sum(1 for until, _n in self._backoff.values() if until > time.monotonic())
+        return (
+            f"{self.name}: en vivo={self.live} guardados={self.spooled} reenviados={self.replayed} "
+            f"descartados={self.dropped} destinos en backoff={backing_off} | {self._outbox.summary()}"
+        )
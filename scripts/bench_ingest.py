@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Benchmark de ingesta UDP: un hilo por servidor (`listen_server`) frente a un
+único selector (`listen_all_servers`).
+
+Un proceso aparte envía paquetes CAR_UPDATE (53) en round-robin a N puertos locales;
+este proceso los recibe con el backend elegido y los pasa por `process_packet` real.
+Se mide paquetes/seg recibidos y CPU consumida por el proceso receptor (todas sus
+hebras), además de la CPU en reposo (sin tráfico) para ver el coste de los wakeups.
+
+Uso:
+  python scripts/bench_ingest.py
+  python scripts/bench_ingest.py --servers 32 --packets 200000
+  python scripts/bench_ingest.py --servers 24 --rate 15360   # 640 pkt/s por servidor
+  python scripts/bench_ingest.py --backend selector
+"""
+
+from __future__ import annotations
+
+import argparse
+import multiprocessing
+import os
+import resource
+import socket
+import struct
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main as runtime  # noqa: E402
+from core.session_manager import ServerState  # noqa: E402
+
+CAR_UPDATE = struct.pack("<BB6fBHf", 53, 200, 1.0, 2.0, 3.0, 4.0, 5.0, 6.0, 3, 5000, 0.5)
+
+
+def _cpu_seconds():
+    ru = resource.getrusage(resource.RUSAGE_SELF)
+    return ru.ru_utime + ru.ru_stime
+
+
+def _sender(ports, total, rate, ready):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    ready.wait()
+    targets = [(runtime.SERVER_IP, p) for p in ports]
+    n = len(targets)
+    t0 = time.perf_counter()
+    for i in range(total):
+        sock.sendto(CAR_UPDATE, targets[i % n])
+        if rate and i % 100 == 99:
+            ahead = (i + 1) / rate - (time.perf_counter() - t0)
+            if ahead > 0:
+                time.sleep(ahead)
+    sock.close()
+
+
+def _run(backend, n_servers, total, rate, base_port, idle_sec):
+    sink = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sink.bind((runtime.SERVER_IP, 0))
+    cmd_port = sink.getsockname()[1]
+
+    servers = {}
+    for i in range(n_servers):
+        port = base_port + i
+        servers[port] = ServerState(port, cmd_port, "bench_track", "", f"bench-{i}")
+
+    received = [0]
+    real_process = runtime.process_packet
+
+    def counting_process(data, state, addr):
+        received[0] += 1
+        real_process(data, state, addr)
+
+    runtime.process_packet = counting_process
+    stop = threading.Event()
+    threads = []
+    if backend == "selector":
+        threads.append(threading.Thread(target=runtime.listen_all_servers, args=(servers, stop), daemon=True))
+    else:
+        for state in servers.values():
+            threads.append(threading.Thread(target=runtime.listen_server, args=(state, stop), daemon=True))
+    for t in threads:
+        t.start()
+    time.sleep(2.0)  # deja terminar los hilos de send_registration
+
+    cpu0 = _cpu_seconds()
+    time.sleep(idle_sec)
+    idle_cpu = _cpu_seconds() - cpu0
+
+    ready = multiprocessing.Event()
+    proc = multiprocessing.Process(target=_sender, args=(list(servers.keys()), total, rate, ready))
+    proc.start()
+    cpu0 = _cpu_seconds()
+    t0 = time.perf_counter()
+    ready.set()
+
+    last, last_change = 0, time.perf_counter()
+    while received[0] < total:
+        time.sleep(0.05)
+        if received[0] != last:
+            last, last_change = received[0], time.perf_counter()
+        elif not proc.is_alive() and time.perf_counter() - last_change > 0.5:
+            break  # UDP: el resto se perdió en el kernel
+    elapsed = last_change - t0
+    busy_cpu = _cpu_seconds() - cpu0
+    proc.join()
+
+    stop.set()
+    for t in threads:
+        t.join(timeout=2.0)
+    for state in servers.values():
+        if state.sock:
+            state.sock.close()
+    sink.close()
+    runtime.process_packet = real_process
+
+    got = received[0]
+    wakeups = sum(s.recv_stats.wakeups for s in servers.values())
+    return {
+        "backend": backend,
+        "threads": len(threads),
+        "received": got,
+        "sent": total,
+        "pps": got / elapsed if elapsed > 0 else 0.0,
+        "cpu_us_per_pkt": busy_cpu * 1e6 / got if got else 0.0,
+        "idle_cpu_ms_per_sec": idle_cpu * 1000 / idle_sec,
+        "avg_batch": got / wakeups if wakeups else 0.0,
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark ingesta UDP: thread-per-server vs selector")
+    parser.add_argument("--servers", type=int, default=24)
+    parser.add_argument("--packets", type=int, default=100000)
+    parser.add_argument("--rate", type=int, default=0, help="paquetes/seg totales (0 = sin límite)")
+    parser.add_argument("--base-port", type=int, default=19600)
+    parser.add_argument("--idle-sec", type=float, default=3.0)
+    parser.add_argument("--backend", choices=("thread", "selector", "all"), default="all")
+    args = parser.parse_args()
+
+    backends = ("thread", "selector") if args.backend == "all" else (args.backend,)
+    results = []
+    for i, backend in enumerate(backends):
+        # Puertos distintos por ronda para no chocar con sockets en TIME_WAIT / cierre tardío.
+        base = args.base_port + i * (args.servers + 10)
+        results.append(_run(backend, args.servers, args.packets, args.rate, base, args.idle_sec))
+
+    print()
+    print(f"{'backend':<10}{'threads':>8}{'recv/sent':>18}{'pkt/s':>12}{'CPU µs/pkt':>12}{'idle CPU ms/s':>15}{'avg batch':>11}")
+    for r in results:
+        print(
+            f"{r['backend']:<10}{r['threads']:>8}{r['received']:>10}/{r['sent']:<7}"
+            f"{r['pps']:>12.0f}{r['cpu_us_per_pkt']:>12.1f}{r['idle_cpu_ms_per_sec']:>15.2f}"
+            f"{r['avg_batch']:>11.1f}"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
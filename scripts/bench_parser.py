@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+Benchmark del parser ACSP por tipo de paquete.
+
+1) Paquetes de layout fijo: lectura incremental (un read_* por campo) frente a
+   los codecs de network/ac_packet.py (un único struct.Struct.unpack_from).
+2) Paquetes con wstrings (UTF-32): decodificación carácter a carácter (la
+   implementación anterior de read_wstring, copiada aquí como referencia) frente a
+   la decodificación del bloque completo, con nombres normales y el peor caso
+   de 255 caracteres.
+
+Cada caso parsea el paquete completo desde el byte de tipo, como process_packet.
+
+Uso:
+  python scripts/bench_parser.py
+  python scripts/bench_parser.py --number 50000   # más estable, ~1 min
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import struct
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from network.ac_packet import (  # noqa: E402
+    ACSP,
+    PacketParser,
+    read_car_update,
+    read_client_event,
+    read_lap_completed,
+)
+
+CAR_UPDATE = struct.pack("<BB6fBHf", ACSP.CAR_UPDATE, 7, 1.0, 2.0, 3.0, 4.0, 5.0, 6.0, 3, 5000, 0.5)
+LAP_COMPLETED = bytes([ACSP.LAP_COMPLETED]) + struct.pack("<BIB", 7, 93512, 0) + bytes(40)
+CLIENT_EVENT_CAR = bytes([ACSP.CLIENT_EVENT]) + struct.pack("<BBBf", ACSP.CE_COLLISION_WITH_CAR, 7, 3, 14.5) + bytes(24)
+CLIENT_EVENT_ENV = bytes([ACSP.CLIENT_EVENT]) + struct.pack("<BBf", ACSP.CE_COLLISION_WITH_ENV, 7, 9.0) + bytes(24)
+
+
+def car_update_incremental(data):
+    p = PacketParser(data)
+    p.read_uint8()
+    return (
+        p.read_uint8(),
+        p.read_float(), p.read_float(), p.read_float(),
+        p.read_float(), p.read_float(), p.read_float(),
+        p.read_uint8(), p.read_uint16(), p.read_float(),
+    )
+
+
+def car_update_codec(data):
+    p = PacketParser(data)
+    p.read_uint8()
+    return read_car_update(p)
+
+
+def lap_completed_incremental(data):
+    p = PacketParser(data)
+    p.read_uint8()
+    return p.read_uint8(), p.read_uint32(), p.read_uint8()
+
+
+def lap_completed_codec(data):
+    p = PacketParser(data)
+    p.read_uint8()
+    return read_lap_completed(p)
+
+
+def client_event_incremental(data):
+    p = PacketParser(data)
+    p.read_uint8()
+    ev_type = p.read_uint8()
+    car_id = p.read_uint8()
+    if ev_type == ACSP.CE_COLLISION_WITH_CAR:
+        return ev_type, car_id, p.read_uint8(), p.read_float()
+    return ev_type, car_id, None, None
+
+
+def client_event_codec(data):
+    p = PacketParser(data)
+    p.read_uint8()
+    return read_client_event(p)
+
+
+def legacy_read_wstring(p):
+    """read_wstring anterior: un decode por carácter y `res += char`."""
+    if p.offset >= p.size: return ""
+    length = p.read_uint8()
+    if length is None or length == 0: return ""
+    res = ""
+    for _ in range(length):
+        if p.offset + 4 <= p.size:
+            char_bytes = p.data[p.offset : p.offset + 4]
+            p.offset += 4
+            res += str(char_bytes, 'utf-32le', 'replace').replace('\x00', '')
+        else:
+            break
+    return res.strip()
+
+
+def _wstr(text):
+    return bytes([len(text)]) + text.encode("utf-32le")
+
+
+def _str(text):
+    return bytes([len(text)]) + text.encode("utf-8")
+
+
+def _wstring_packets(name, guid, model):
+    return {
+        "NEW_SESSION": bytes([ACSP.NEW_SESSION, 4, 0, 0, 3]) + _wstr(name) + _str("ks_nordschleife") + _str("touristenfahrten"),
+        "NEW_CONNECTION": bytes([ACSP.NEW_CONNECTION]) + _wstr(name) + _wstr(guid) + bytes([7]) + _str(model) + _str("skin_01"),
+        "CONNECTION_CLOSED": bytes([ACSP.CONNECTION_CLOSED]) + _wstr(name) + _wstr(guid) + bytes([7]) + _str(model) + _str("skin_01"),
+        "CAR_INFO": bytes([ACSP.CAR_INFO, 7, 1]) + _wstr(model) + _wstr("skin_01") + _wstr(name) + _wstr("Team") + _wstr(guid),
+    }
+
+
+def _parse_wstring_packet(kind, data, read_w):
+    p = PacketParser(data)
+    p.read_uint8()
+    if kind == "NEW_SESSION":
+        for _ in range(4):
+            p.read_uint8()
+        return read_w(p), p.read_string(), p.read_string()
+    if kind in ("NEW_CONNECTION", "CONNECTION_CLOSED"):
+        return read_w(p), read_w(p), p.read_uint8()
+    p.read_uint8()
+    p.read_uint8()
+    return read_w(p), read_w(p), read_w(p), read_w(p), read_w(p)
+
+
+WSTRING_INPUTS = [
+    ("normal", _wstring_packets("Some Driver Name", "76561198000000000", "ks_toyota_ae86")),
+    ("255 chars", _wstring_packets("W" * 255, "7" * 255, "m" * 255)),
+]
+
+CASES = [
+    # (nombre, paquete, incremental, codec)
+    ("CAR_UPDATE", CAR_UPDATE, car_update_incremental, car_update_codec),
+    ("CAR_UPDATE (truncado)", CAR_UPDATE[:20], car_update_incremental, car_update_codec),
+    ("LAP_COMPLETED", LAP_COMPLETED, lap_completed_incremental, lap_completed_codec),
+    ("LAP_COMPLETED (truncado)", LAP_COMPLETED[:4], lap_completed_incremental, lap_completed_codec),
+    ("CLIENT_EVENT car", CLIENT_EVENT_CAR, client_event_incremental, client_event_codec),
+    ("CLIENT_EVENT env", CLIENT_EVENT_ENV, client_event_incremental, client_event_codec),
+]
+
+
+def _ns_per_call(func, data, number):
+    best = min(timeit.repeat(lambda: func(data), number=number, repeat=5))
+    return best * 1e9 / number
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark del parser ACSP por tipo de paquete")
+    parser.add_argument("--number", type=int, default=5000,
+                        help="llamadas por medición (mejor de 5 repeticiones)")
+    args = parser.parse_args()
+
+    print(f"{'packet':<24}{'incremental ns':>16}{'codec ns':>12}{'speedup':>10}")
+    for name, data, incremental, codec in CASES:
+        assert tuple(codec(data)) == tuple(incremental(data)), name
+        t_inc = _ns_per_call(incremental, data, args.number)
+        t_codec = _ns_per_call(codec, data, args.number)
+        print(f"{name:<24}{t_inc:>16.0f}{t_codec:>12.0f}{t_inc / t_codec:>9.2f}x")
+
+    print()
+    print(f"{'packet':<30}{'per-char ns':>14}{'bulk ns':>12}{'speedup':>10}")
+    bulk = PacketParser.read_wstring
+    for label, packets in WSTRING_INPUTS:
+        # Los nombres de 255 caracteres son ~100x más lentos con el bucle antiguo.
+        number = args.number if label == "normal" else max(1, args.number // 20)
+        for kind, data in packets.items():
+            name = f"{kind} ({label})"
+            old = lambda d, k=kind: _parse_wstring_packet(k, d, legacy_read_wstring)
+            new = lambda d, k=kind: _parse_wstring_packet(k, d, bulk)
+            assert old(data) == new(data), name
+            t_old = _ns_per_call(old, data, number)
+            t_new = _ns_per_call(new, data, number)
+            print(f"{name:<30}{t_old:>14.0f}{t_new:>12.0f}{t_old / t_new:>9.2f}x")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
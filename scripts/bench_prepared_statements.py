@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+Benchmark de latencia por llamada: SQL directo frente a PREPARE/EXECUTE
+(db/prepared.py) para las cuatro consultas calientes:
+
+  lap_upsert     upsert de una vuelta en lap_records (RETURNING)
+  driver_upsert  upsert de un piloto en drivers
+  server_mode    lookup de modo en ac_server_control
+  active_event   lookup del evento activo en server_events
+
+Crea tablas TEMP con el mismo nombre (ocultan las de public en esta sesión, así
+que no toca datos reales), siembra `--servers` servidores y ejecuta cada consulta
+`--iterations` veces por modo en una sola conexión, con commit por llamada como
+hace el writer. Imprime media, p50 y p95 en µs y la mejora relativa.
+
+Úsalo contra un Postgres local (o el 5432 de sesión); contra el pooler 6543 en
+modo transacción PREPARE no es fiable.
+
+Uso:
+  python scripts/bench_prepared_statements.py
+  python scripts/bench_prepared_statements.py --dsn postgresql://postgres@localhost/postgres --iterations 5000
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+import psycopg2
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db.prepared import PreparedConnection, StatementRegistry  # noqa: E402
+from db.schema import SchemaCapabilities  # noqa: E402
+
+INSTANCE_ID = "bench"
+
+_TEMP_TABLES = (
+    """
+    CREATE TEMP TABLE lap_records (
+        id SERIAL PRIMARY KEY,
+        steam_id VARCHAR(50),
+        car_model VARCHAR(100),
+        track VARCHAR(100),
+        track_config VARCHAR(255) DEFAULT '',
+        server_name VARCHAR(100),
+        lap_time INTEGER NOT NULL,
+        valid_lap SMALLINT DEFAULT 1,
+        "timestamp" BIGINT DEFAULT 0,
+        "date" TIMESTAMPTZ DEFAULT NOW(),
+        CONSTRAINT lap_records_unique_lap UNIQUE (steam_id, car_model, track, track_config)
+    )
+    """,
+    """
+    CREATE TEMP TABLE drivers (
+        steam_id VARCHAR(50) PRIMARY KEY,
+        name VARCHAR(100) NOT NULL,
+        created_at TIMESTAMPTZ DEFAULT NOW(),
+        updated_at TIMESTAMPTZ DEFAULT NOW()
+    )
+    """,
+    """
+    CREATE TEMP TABLE ac_server_control (
+        id SERIAL PRIMARY KEY,
+        instance_id TEXT,
+        server_name TEXT,
+        power_state TEXT,
+        server_type TEXT,
+        updated_at TIMESTAMPTZ DEFAULT NOW()
+    )
+    """,
+    """
+    CREATE TEMP TABLE server_events (
+        id BIGSERIAL PRIMARY KEY,
+        instance_id TEXT,
+        server_name TEXT NOT NULL,
+        webhook_url TEXT,
+        event_type TEXT,
+        event_status TEXT DEFAULT 'started',
+        metadata JSONB
+    )
+    """,
+)
+
+_COLUMNS = {
+    "lap_records": frozenset({"id", "steam_id", "car_model", "track", "track_config", "server_name",
+                              "lap_time", "valid_lap", "timestamp", "date"}),
+    "ac_server_control": frozenset({"id", "instance_id", "server_name", "power_state", "server_type", "updated_at"}),
+    "server_events": frozenset({"id", "instance_id", "server_name", "webhook_url", "event_type",
+                                "event_status", "metadata"}),
+}
+
+_DRIVER_UPSERT_SQL = """
+        INSERT INTO drivers (steam_id, name)
+        VALUES %s
+        ON CONFLICT (steam_id) DO UPDATE SET
+            name = EXCLUDED.name,
+            updated_at = NOW()
+        """
+
+
+def _setup(cursor, n_servers):
+    for sql in _TEMP_TABLES:
+        cursor.execute(sql)
+    for i in range(n_servers):
+        cursor.execute(
+            "INSERT INTO ac_server_control (instance_id, server_name, power_state, server_type) "
+            "VALUES (%s, %s, 'running', 'battle')",
+            (INSTANCE_ID, f"Server {i}"),
+        )
+        cursor.execute(
+            "INSERT INTO server_events (instance_id, server_name, webhook_url, event_type) "
+            "VALUES (%s, %s, 'http://127.0.0.1/hook', 'touge')",
+            (INSTANCE_ID, f"Server {i}"),
+        )
+    cursor.execute("ANALYZE lap_records, drivers, ac_server_control, server_events")
+
+
+def _calls(schema, n_servers):
+    def lap_upsert(registry, cursor, i):
+        row = (f"7656119{i % 500:010d}", "ks_toyota_ae86", "touge_bench", "", f"Server {i % n_servers}",
+               90000 - (i % 1000), 1, 1700000000000 + i, "2024-01-01T00:00:00+00:00")
+        registry.execute_values(cursor, "lap_upsert", schema.lap_upsert_sql, [row], fetch=True)
+
+    def driver_upsert(registry, cursor, i):
+        row = (f"7656119{i % 500:010d}", f"Driver {i % 7}")
+        registry.execute_values(cursor, "driver_upsert", _DRIVER_UPSERT_SQL, [row])
+
+    def server_mode(registry, cursor, i):
+        registry.execute(cursor, "server_mode", schema.server_mode_sql, (INSTANCE_ID, f"server {i % n_servers}"))
+        cursor.fetchone()
+
+    def active_event(registry, cursor, i):
+        registry.execute(cursor, "active_event", schema.active_event_sql,
+                         (f"Server {i % n_servers}", *schema.instance_params()))
+        cursor.fetchone()
+
+    return (("lap_upsert", lap_upsert), ("driver_upsert", driver_upsert),
+            ("server_mode", server_mode), ("active_event", active_event))
+
+
+def _measure(conn, registry, fn, iterations, warmup):
+    cursor = conn.cursor()
+    samples = []
+    for i in range(warmup + iterations):
+        t0 = time.perf_counter_ns()
+        fn(registry, cursor, i)
+        conn.commit()
+        if i >= warmup:
+            samples.append((time.perf_counter_ns() - t0) / 1000.0)
+    cursor.close()
+    samples.sort()
+    return statistics.fmean(samples), samples[len(samples) // 2], samples[int(len(samples) * 0.95)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dsn", default=os.getenv("DATABASE_URL") or os.getenv("SUPABASE_DB_URL"))
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--warmup", type=int, default=200)
+    parser.add_argument("--servers", type=int, default=24)
+    args = parser.parse_args()
+    if not args.dsn:
+        parser.error("define --dsn o DATABASE_URL")
+
+    conn = psycopg2.connect(args.dsn, connection_factory=PreparedConnection)
+    cursor = conn.cursor()
+    _setup(cursor, args.servers)
+    conn.commit()
+    cursor.close()
+
+    schema = SchemaCapabilities(_COLUMNS, frozenset(), INSTANCE_ID, frozenset({("lap_records", "id")}))
+    plain = StatementRegistry(enabled=False)
+    prepared = StatementRegistry(enabled=True)
+
+    print(f"{'consulta':<14} {'modo':<9} {'media µs':>10} {'p50 µs':>10} {'p95 µs':>10}")
+    for label, fn in _calls(schema, args.servers):
+        results = {}
+        for mode, registry in (("directo", plain), ("prepared", prepared)):
+            mean, p50, p95 = _measure(conn, registry, fn, args.iterations, args.warmup)
+            results[mode] = mean
+            print(f"{label:<14} {mode:<9} {mean:>10.1f} {p50:>10.1f} {p95:>10.1f}")
+        gain = 100.0 * (results["directo"] - results["prepared"]) / results["directo"]
+        print(f"{'':<14} → {gain:+.1f}% por llamada")
+    print(prepared.summary())
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
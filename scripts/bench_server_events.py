@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Benchmark de eventos generales (send_server_event): un POST por evento frente al
+micro-batching opcional (GENERAL_WEBHOOK_BATCH, network/event_batcher.py).
+
+Simula el arranque de sesión: `--servers` servidores reciben cada uno `--drivers`
+player_join y algunos server_status repartidos en `--burst-ms`. Un backend stub local
+(HTTP/1.1 keep-alive) tarda `--backend-ms` por petición y cuenta peticiones, eventos,
+CPU propia y eventos fuera de orden por servidor. Se imprime, con y sin batching:
+peticiones HTTP, eventos/petición, peticiones/seg que recibe el backend, CPU del
+backend y tiempo hasta entregar todo.
+
+Uso:
+  python scripts/bench_server_events.py
+  python scripts/bench_server_events.py --servers 24 --drivers 24 --window-ms 250
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from network import event_dispatcher  # noqa: E402
+from network.event_batcher import EventBatcher  # noqa: E402
+from network.webhook_dispatcher import CRITICAL  # noqa: E402
+
+
+class _Backend(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, work_sec):
+        super().__init__(address, _Handler)
+        self.work_sec = work_sec
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.requests = 0
+            self.events = 0
+            self.cpu_sec = 0.0
+            self.out_of_order = 0
+            self.last_seq = {}
+            self.first_at = None
+            self.last_at = None
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        t_cpu = time.thread_time()
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", "0"))))
+        events = body if isinstance(body, list) else [body]
+        if self.server.work_sec:
+            time.sleep(self.server.work_sec)  # coste fijo por petición (auth, parseo, BD...)
+        server = self.server
+        with server.lock:
+            now = time.perf_counter()
+            server.first_at = server.first_at or now
+            server.last_at = now
+            server.requests += 1
+            server.events += len(events)
+            for event in events:
+                name, seq = event.get("serverName"), event["data"]["seq"]
+                if seq < server.last_seq.get(name, -1):
+                    server.out_of_order += 1
+                server.last_seq[name] = seq
+            server.cpu_sec += time.thread_time() - t_cpu
+        self.send_response(204)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+def _generate(n_servers, n_drivers, burst_sec):
+    """Eventos de arranque de sesión intercalados entre servidores a lo largo del burst."""
+    total = n_servers * (n_drivers + 2)
+    step = burst_sec / total if total else 0.0
+    t0 = time.perf_counter()
+    seq = {}
+    i = 0
+    for d in range(n_drivers + 2):
+        for s in range(n_servers):
+            name = f"Server {s}"
+            n = seq[name] = seq.get(name, -1) + 1
+            if d in (0, n_drivers + 1):
+                event_dispatcher.send_server_event("server_status", name, {"seq": n, "drivers": d})
+            else:
+                event_dispatcher.send_server_event("player_join", name, {"seq": n, "steamId": f"7656119{s:04d}{d:06d}"})
+            i += 1
+            ahead = t0 + i * step - time.perf_counter()
+            if ahead > 0:
+                time.sleep(ahead)
+    return total
+
+
+def _run(label, backend, args, batcher):
+    backend.reset()
+    event_dispatcher.general_batcher = batcher
+    t0 = time.perf_counter()
+    total = _generate(args.servers, args.drivers, args.burst_ms / 1000.0)
+    if batcher is not None:
+        batcher.stop(30)
+    event_dispatcher.dispatcher.stop(30)
+    wall = time.perf_counter() - t0
+    with backend.lock:
+        span = (backend.last_at - backend.first_at) if backend.requests > 1 else 0.0
+        rps = backend.requests / span if span else float(backend.requests)
+        print(
+            f"{label:<9} eventos={total} recibidos={backend.events} peticiones={backend.requests} "
+            f"({backend.events / max(1, backend.requests):.1f} ev/pet) backend={rps:.0f} pet/s "
+            f"CPU backend={backend.cpu_sec * 1000:.0f}ms fuera_de_orden={backend.out_of_order} "
+            f"entrega={wall:.2f}s"
+        )
+    return backend.requests
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--servers", type=int, default=12)
+    parser.add_argument("--drivers", type=int, default=22)
+    parser.add_argument("--burst-ms", type=float, default=2000.0)
+    parser.add_argument("--backend-ms", type=float, default=2.0)
+    parser.add_argument("--window-ms", type=float, default=250.0)
+    parser.add_argument("--batch-max", type=int, default=50)
+    args = parser.parse_args()
+
+    backend = _Backend(("127.0.0.1", 0), args.backend_ms / 1000.0)
+    threading.Thread(target=backend.serve_forever, daemon=True).start()
+    event_dispatcher.GENERAL_WEBHOOK_URL = f"http://127.0.0.1:{backend.server_address[1]}/events"
+
+    single = _run("sin lote", backend, args, None)
+    batcher = EventBatcher(
+        event_dispatcher._send_general_batch,
+        lambda fn, *a: event_dispatcher.dispatcher.submit(CRITICAL, fn, *a),
+        window_sec=args.window_ms / 1000.0,
+        max_events=args.batch_max,
+    )
+    batched = _run("con lote", backend, args, batcher)
+    print(f"→ {single / max(1, batched):.1f}x menos peticiones al backend | {batcher.summary()}")
+    backend.shutdown()
+
+
+if __name__ == "__main__":
+    main()
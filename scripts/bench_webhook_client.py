@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Benchmark de envío de webhooks: `requests.post` por evento (una conexión TCP nueva
+en cada llamada) frente al cliente compartido con keep-alive de
+network/event_dispatcher.py (`WebhookClient`).
+
+Levanta un servidor HTTP/1.1 local (stub con keep-alive que responde 200 a cada POST
+y cuenta las conexiones aceptadas) y manda `--requests` POST JSON desde `--threads`
+hilos con cada cliente. Imprime eventos/seg, latencia media/p50/p95 y conexiones
+TCP abiertas en el servidor.
+
+Uso:
+  python scripts/bench_webhook_client.py
+  python scripts/bench_webhook_client.py --requests 5000 --threads 16
+  python scripts/bench_webhook_client.py --delay-ms 2   # simula tiempo de respuesta del backend
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from network.event_dispatcher import WebhookClient  # noqa: E402
+
+PAYLOAD = {
+    "event": "lap_completed",
+    "data": {"steamId": "76561198000000000", "lapTime": 91234, "car": "ks_toyota_ae86", "valid": True},
+}
+
+
+class _StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, delay_sec):
+        super().__init__(address, _StubHandler)
+        self.delay_sec = delay_sec
+        self.connections = 0
+        self._count_lock = threading.Lock()
+
+    def process_request(self, request, client_address):
+        with self._count_lock:
+            self.connections += 1
+        super().process_request(request, client_address)
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Cabeceras y cuerpo salen en dos write(): sin TCP_NODELAY, Nagle + delayed ACK
+    # añaden ~40 ms a cada respuesta sobre una conexión reutilizada.
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", "0")))
+        if self.server.delay_sec:
+            time.sleep(self.server.delay_sec)
+        body = b'{"ok":true}'
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def _plain_post(url):
+    return requests.post(
+        url,
+        json=PAYLOAD,
+        headers={"Content-Type": "application/json", "x-webhook-secret": "bench"},
+        timeout=10,
+    )
+
+
+def _run(label, send, server, total, threads):
+    latencies = []
+    lock = threading.Lock()
+    connections_before = server.connections
+
+    def one(_):
+        t0 = time.perf_counter()
+        resp = send()
+        elapsed = (time.perf_counter() - t0) * 1000.0
+        if resp.status_code != 200:
+            raise RuntimeError(f"HTTP {resp.status_code}")
+        with lock:
+            latencies.append(elapsed)
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(one, range(total)))
+    wall = time.perf_counter() - t0
+    latencies.sort()
+    print(
+        f"{label:<10} {total / wall:>10.0f} ev/s  media={statistics.fmean(latencies):.2f}ms "
+        f"p50={latencies[len(latencies) // 2]:.2f}ms p95={latencies[int(len(latencies) * 0.95)]:.2f}ms "
+        f"conexiones TCP={server.connections - connections_before}"
+    )
+    return total / wall
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--delay-ms", type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = _StubServer(("127.0.0.1", 0), args.delay_ms / 1000.0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/webhook"
+
+    client = WebhookClient(pool_maxsize=args.threads)
+    plain_rate = _run("post()", lambda: _plain_post(url), server, args.requests, args.threads)
+    pooled_rate = _run("pooled", lambda: client.post(url, PAYLOAD, "bench"), server, args.requests, args.threads)
+    print(f"→ {pooled_rate / plain_rate:.2f}x eventos/seg con el cliente compartido")
+    print(client.summary())
+
+    client.close()
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
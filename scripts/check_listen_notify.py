@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Comprobación de extremo a extremo de la invalidación LISTEN/NOTIFY del plano de control.
+
+Instala los triggers, arranca el refresher con DB_LISTEN_NOTIFY=true, inserta un
+server_events 'started' para un servidor de prueba y mide cuánto tarda la
+instantánea en reflejarlo (con polling cada CONTROL_PLANE_REFRESH_SEC serían
+hasta 3 s; con NOTIFY debería ser del orden de la latencia de red). Al terminar
+borra la fila de prueba.
+
+Requiere DATABASE_URL (o DATABASE_LISTEN_URL si DATABASE_URL apunta al pooler
+6543) y AC_INSTANCE_ID. Úsalo contra un Postgres local o un entorno de pruebas.
+
+Uso:
+  DB_LISTEN_NOTIFY=true AC_INSTANCE_ID=test python scripts/check_listen_notify.py
+  python scripts/check_listen_notify.py --server-name "__notify_check__" --timeout 10
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import time
+
+import psycopg2
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault("DB_LISTEN_NOTIFY", "true")
+
+from db import database  # noqa: E402
+from db.notify_listener import install_control_plane_triggers  # noqa: E402
+
+
+def _wait_for(predicate, timeout):
+    t0 = time.perf_counter()
+    while time.perf_counter() - t0 < timeout:
+        if predicate():
+            return time.perf_counter() - t0
+        time.sleep(0.005)
+    return None
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Latencia de invalidación por LISTEN/NOTIFY")
+    parser.add_argument("--server-name", default="__notify_check__")
+    parser.add_argument("--timeout", type=float, default=10.0)
+    args = parser.parse_args()
+
+    if not database.DATABASE_URL or not database.AC_INSTANCE_ID:
+        print("❌ Define DATABASE_URL y AC_INSTANCE_ID.")
+        return 1
+
+    conn = psycopg2.connect(database.DATABASE_URL)
+    conn.autocommit = True
+    cursor = conn.cursor()
+    install_control_plane_triggers(cursor)
+
+    database.start_control_plane_refresher()
+    if _wait_for(database.control_plane_listening, args.timeout) is None:
+        print("❌ El listener no llegó a conectarse (¿pooler 6543? define DATABASE_LISTEN_URL).")
+        return 1
+
+    def snapshot_event():
+        snap = database._control_plane
+        return snap is not None and snap.active_event(args.server_name) is not None
+
+    event_id = None
+    try:
+        cursor.execute(
+            """
+            INSERT INTO server_events (server_name, event_type, event_status, webhook_url, metadata, instance_id)
+            VALUES (%s, 'time-attack', 'started', '', '{}', %s)
+            RETURNING id
+            """,
+            (args.server_name, database.AC_INSTANCE_ID),
+        )
+        event_id = cursor.fetchone()[0]
+        added = _wait_for(snapshot_event, args.timeout)
+
+        cursor.execute("DELETE FROM server_events WHERE id = %s", (event_id,))
+        event_id = None
+        removed = _wait_for(lambda: not snapshot_event(), args.timeout)
+    finally:
+        if event_id is not None:
+            cursor.execute("DELETE FROM server_events WHERE id = %s", (event_id,))
+        cursor.close()
+        conn.close()
+
+    for label, elapsed in (("INSERT", added), ("DELETE", removed)):
+        if elapsed is None:
+            print(f"❌ {label}: la instantánea no cambió en {args.timeout:.0f} s")
+        else:
+            print(f"✅ {label}: visible en la instantánea en {elapsed * 1000:.0f} ms")
+    return 0 if added is not None and removed is not None else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Comprobación del spool de webhooks: un destino caído no frena a los demás.
+
+Con un `send` simulado (sin red) guarda 30 webhooks para a.test, que responde
+503 siempre, y después uno para b.test, que falla una vez y se recupera. El
+replay debe entregar el de b.test mientras a.test sigue en backoff; antes de la
+corrección las 30 filas de a.test ocupaban toda la ventana del peek y b.test se
+quedaba atascado detrás.
+
+Uso:
+  python scripts/check_webhook_spool.py
+  python scripts/check_webhook_spool.py --backlog 500 --timeout 10
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from network.webhook_spool import WebhookSpool  # noqa: E402
+
+
+class _Resp:
+    def __init__(self, status_code):
+        self.status_code = status_code
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--backlog", type=int, default=30, help="webhooks guardados para el destino caído")
+    ap.add_argument("--timeout", type=float, default=5.0)
+    args = ap.parse_args()
+
+    b_down = [True]
+    delivered = []
+
+    def send(url, secret_ref, payload, key):
+        if "a.test" in url or ("b.test" in url and b_down[0]):
+            return _Resp(503)
+        delivered.append(key)
+        return _Resp(200)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        spool = WebhookSpool(os.path.join(tmp, "spool.sqlite3"), send, batch_size=5, rate_per_sec=0,
+                             base_backoff=30.0, max_backoff=30.0)
+        spool.start()
+        for i in range(args.backlog):
+            spool.deliver("http://a.test/hook", None, {"n": i}, "A")
+        spool.deliver("http://b.test/hook", None, {"n": 0}, "B")
+        b_down[0] = False
+        # El backoff de b.test tras su primer fallo dura 15-30 s; se salta para la prueba.
+        with spool._lock:
+            spool._backoff.pop("b.test", None)
+
+        t0 = time.perf_counter()
+        while time.perf_counter() - t0 < args.timeout and not delivered:
+            time.sleep(0.05)
+        with spool._lock:
+            pending = dict(spool._pending)
+        spool.stop()
+        print(spool.summary())
+
+    if not delivered:
+        print(f"❌ b.test no se reenvió en {args.timeout:.0f}s; pendientes={pending}")
+        return 1
+    print(f"✅ b.test reenviado en {time.perf_counter() - t0:.2f}s con a.test en backoff; pendientes={pending}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())